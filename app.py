@@ -1,7 +1,6 @@
 # app.py
 from ast import literal_eval
 import asyncio
-import re
 import time
 import uuid
 import json
@@ -14,10 +13,18 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from database import database
 import os
 import signal
+import threading
 
-from flow.utils.helpers import create_agent_config, load_yaml, save_yaml
+from flow.utils.helpers import load_config, load_yaml
 from flow.scriptGenerationFlow import generate_script_and_roles
 from flow.dialogueFlow import DialogueFlow
+from flow.utils.script_jobs import JOB_DONE, get_script_jobs
+from flow.utils.session_log import get_session_log
+from flow.utils.conversation import Conversation
+from flow.utils.spans import span, traced
+from flow.utils import metrics
+from flow.utils.script_store import generate_variant, get_script_store
+from flow.utils.socket_utils import send_script_status
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -37,20 +44,36 @@ with app.app_context():
         init_db()
     else:
         print("--- APP: Database already exists.")
+        from database.database import migrate_db
+        migrate_db()
         
 # --- Initialize Config Files ---
 folder_path = "flow/crews/config"
-original_agents_config_path = f"{folder_path}/agents.yaml"
 base_participants_path = f"{folder_path}/base_participants.yaml"
 meta_agents_path = f"{folder_path}/meta_agents.yaml"
-dynamic_participants_path = f"{folder_path}/dynamic_participants.yaml"
-output_path = f"{folder_path}/agents.yaml"
 base_script_path = f"{folder_path}/base_script.yaml"
-dynamic_script_path = f"{folder_path}/dynamic_script.yaml"
 problem_path = f"{folder_path}/problems.yaml"
 
 # --- Load Config Files ---
-problem_list_data = load_yaml(problem_path)
+problem_list_data = load_config(problem_path)  # chỉ đọc: dùng chung bản đã parse trong config cache
+
+def default_script_and_roles():
+    """Kịch bản và vai trò mặc định, dùng khi không sinh được kịch bản."""
+    return load_yaml(base_script_path), load_yaml(base_participants_path)
+
+def mark_session_ready(session_id, script, roles):
+    db = database.get_db()
+    db.execute(
+        "UPDATE sessions SET script = ?, roles = ?, status = 'ready' WHERE session_id = ?",
+        (json.dumps(script), json.dumps(roles), session_id)
+    )
+    db.commit()
+
+# Job sinh kịch bản của lần chạy trước đã mất khi server tắt: dùng kịch bản mặc định cho các phiên đó
+with app.app_context():
+    for row in database.get_db().execute("SELECT session_id FROM sessions WHERE status = 'preparing'").fetchall():
+        print(f"--- APP: Session {row['session_id']} was left preparing, using the default script.")
+        mark_session_ready(row['session_id'], *default_script_and_roles())
 
 dialogue_flow = None
 sid_to_session = {}  # Dictionary to map socket ID to session ID
@@ -65,14 +88,15 @@ sid_to_session = {}  # Dictionary to map socket ID to session ID
 
 def initialize_dialogue_flow(session_id):
     db = database.get_db()
-    session_data = db.execute(
-        '''SELECT session_id, user_name, problem, 
-                    script, roles, current_stage_id, 
-                    conversation, log_file, stage_state, inner_thought,
-                    turn_number
-                    FROM sessions 
-                    WHERE session_id = ?''', (session_id,)
-    ).fetchone()
+    with span("db.load_session"):
+        session_data = db.execute(
+            '''SELECT session_id, user_name, problem, 
+                        script, roles, current_stage_id, 
+                        conversation, log_file, stage_state, inner_thought,
+                        turn_number
+                        FROM sessions 
+                        WHERE session_id = ?''', (session_id,)
+        ).fetchone()
 
     if session_data is None:
         print(f"!!! ERROR: Session ID '{session_id}' not found.")
@@ -88,13 +112,7 @@ def initialize_dialogue_flow(session_id):
     else:
         roles = json.loads(roles)
 
-    save_yaml(dynamic_participants_path, roles)
-
-    create_agent_config(
-        dynamic_participants_path,
-        meta_agents_path,
-        output_path
-    )
+    # Vai trò được truyền trong bộ nhớ tới DialogueFlow: không ghi file dùng chung, các phiên chạy song song an toàn
 
     participant_list = []
     
@@ -131,6 +149,7 @@ def initialize_dialogue_flow(session_id):
     print(f"--- APP: Dialogue flow initialized for session {session_id}")
     return session_data
 
+@traced("db.create_session")
 def create_session(session_data):
     """
     Create a new session in the database.
@@ -140,8 +159,8 @@ def create_session(session_data):
         '''INSERT INTO sessions (
             session_id, user_name, problem, script, roles,
             current_stage_id, conversation, log_file, stage_state,
-            inner_thought, turn_number
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            inner_thought, turn_number, status
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
         (session_data['session_id'],
          session_data['user_name'],
          session_data['problem'],
@@ -152,12 +171,14 @@ def create_session(session_data):
          session_data['log_file'],
          json.dumps(session_data['stage_state']),
          json.dumps(list(session_data['inner_thought'])), # Ensure inner_thought is a list
-         session_data['turn_number'])
+         session_data['turn_number'],
+         session_data.get('status', 'ready'))
     )
     db.commit()
     print(f"--- APP: Created session {session_data['session_id']} in DB.")
 
 
+@traced("db.save_session")
 def save_session_data(session_data):
     """
     Save the session data to the database (update existing).
@@ -229,6 +250,21 @@ def select_problem_page():
 @app.route('/chat/<session_id>')
 def chat_interface(session_id):
     """Displays the main chat interface for a specific session."""
+    db = database.get_db()
+    session_row = db.execute(
+        'SELECT problem, user_name, status FROM sessions WHERE session_id = ?', (session_id,)
+    ).fetchone()
+    if session_row is None:
+        return redirect(url_for('list_sessions'))
+    if session_row['status'] == 'preparing':
+        # Kịch bản đang được sinh: trang chờ, client tải lại khi nhận được script_status hoàn tất
+        return render_template('chat_interface.html',
+                               participants=[],
+                               problem=session_row['problem'],
+                               session_id=session_id,
+                               user_name=session_row['user_name'],
+                               session_status='preparing')
+
     session_data = initialize_dialogue_flow(session_id)
     if session_data is None:
         return redirect(url_for('list_sessions'))
@@ -257,7 +293,8 @@ def chat_interface(session_id):
                            participants=participant_list,
                            problem=problem_for_session,
                            session_id=session_id,
-                           user_name=user_name)
+                           user_name=user_name,
+                           session_status='ready')
 
 @app.route('/history/<session_id>')
 def history(session_id):
@@ -274,38 +311,22 @@ def history(session_id):
         (session_id,)
     ).fetchone()
     
-    history_list = []
-    if session_data and session_data[0]:
-        lines = session_data[0].split('\n')
-        current_message = None
-        for line in lines:
-            pattern = r"TIME=([0-9.]+) \| CON#(\d+) \| SENDER=([^|]+) \| TEXT=(.+)"
-            match = re.match(pattern, line)
-            if match:
-                # Nếu có message trước đó, lưu lại
-                if current_message:
-                    history_list.append(current_message)
-                time_val, turn, sender, text = match.groups()
-                timestamp = float(time_val)
-                turn = int(turn)
-                sender_name = sender.strip()
-                text = text.strip()
-                current_message = {
-                    "source": sender_name,
-                    "content": {
-                        "text": text,
-                        "sender_name": sender_name
-                    },
-                    "timestamp": timestamp * 1000  # Convert to milliseconds
-                }
-            else:
-                # Nếu không match, đây là dòng tiếp theo của TEXT
-                if current_message:
-                    # Nối thêm dòng này vào text, giữ nguyên xuống dòng
-                    current_message["content"]["text"] += "\n" + line
-        # Đừng quên lưu message cuối cùng
-        if current_message:
-            history_list.append(current_message)
+    # Phiên đang chạy: dùng danh sách tin nhắn trong bộ nhớ (mới hơn bản trong DB), không cần đọc lại văn bản
+    if dialogue_flow and getattr(dialogue_flow, "session_id", None) == session_id:
+        conversation = dialogue_flow.state.conversation
+    else:
+        conversation = Conversation.parse(session_data[0] if session_data else "")
+    history_list = [
+        {
+            "source": record.sender,
+            "content": {
+                "text": record.text.strip(),
+                "sender_name": record.sender
+            },
+            "timestamp": record.time * 1000  # Convert to milliseconds
+        }
+        for record in conversation
+    ]
     
     script_content = json.loads(session_data["script"])
     stage_state = json.loads(session_data["stage_state"])
@@ -336,9 +357,13 @@ def delete_session(session_id):
         
         # Try to delete the log file if it exists
         try:
-            log_file = f"logs/{session_id}.log"
-            if os.path.exists(log_file):
-                os.remove(log_file)
+            # Trace JSONL của phiên và log văn bản cũ (phiên tạo trước khi có trace)
+            for log_file in (f"logs/{session_id}.jsonl", f"logs/{session_id}.log"):
+                # Ghi nốt và đóng file log đang mở trong luồng ghi log trước khi xóa
+                get_session_log().close(log_file)
+                for path in [log_file] + [f"{log_file}.{index}" for index in range(1, get_session_log().backup_count + 1)]:
+                    if os.path.exists(path):
+                        os.remove(path)
         except Exception as e:
             print(f"Warning: Could not delete log file: {e}")
         
@@ -400,7 +425,8 @@ def handle_join(data):
     # Check if session exists
     with app.app_context():
         db = database.get_db()
-        if not db.execute('SELECT 1 FROM sessions WHERE session_id = ?', (session_id,)).fetchone():
+        session_row = db.execute('SELECT status FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if not session_row:
             emit('navigate', {'url': url_for('list_sessions')}, room=request.sid)
             return
     
@@ -408,6 +434,11 @@ def handle_join(data):
     sid_to_session[request.sid] = session_id  # Ghi nhớ mapping này
     print(f"--- SOCKETIO [{session_id}]: Client {request.sid} joined room")
     emit('joined', {'status': 'success', 'session_id': session_id}, room=request.sid)
+    # Job có thể đã xong trước khi client vào phòng: gửi trạng thái hiện tại cho client này
+    job = get_script_jobs().get(session_id)
+    job_status = job.to_dict() if job else {'status': session_row['status']}
+    emit('script_status', {'source': 'system', 'content': job_status, 'timestamp': int(time.time() * 1000)},
+         room=request.sid)
 
 @socketio.on('leave')
 def handle_leave(data):
@@ -434,9 +465,13 @@ def handle_message(data):
     # Check if session exists
     with app.app_context():
         db = database.get_db()
-        if not db.execute('SELECT 1 FROM sessions WHERE session_id = ?', (session_id,)).fetchone():
+        session_row = db.execute('SELECT status FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if not session_row:
             emit('error', {'message': 'Session not found'})
             return
+        if session_row['status'] == 'preparing':
+            emit('error', {'message': 'Kịch bản đang được chuẩn bị, vui lòng đợi.'})
+            return
     
     sender_id = f"user-{sender_name.lower().replace(' ', '-')}"
     print(f"--- SOCKETIO [{session_id}]: Received message from '{sender_name}' ({sender_id}): {text}")
@@ -475,6 +510,16 @@ def handle_message(data):
         emit('error', {'message': 'Lỗi: Phiên trò chuyện chưa được khởi tạo.'})
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Counters, gauges and histograms (LLM calls, spans of each dialogue phase, DB saves, emits, script store size)
+    in Prometheus text format.
+    """
+    get_script_store().publish_metrics()
+    return Response(metrics.render_prometheus(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
 @app.route('/api/problems')
 def get_problems():
     """
@@ -493,8 +538,8 @@ def get_problems():
 @app.route('/generate_script_and_start_chat', methods=['POST'])
 def generate_script_and_start_chat():
     """
-    Receives problem selection, generates script/personas, creates a new chat session,
-    and redirects to the chat interface.
+    Receives problem selection, creates a new chat session and redirects to the chat interface.
+    Generated scripts/personas are produced by a background job while the session is 'preparing'.
     """
     problem_id = request.form.get('problem_id')
     username = request.form.get('username', 'User').strip()
@@ -525,34 +570,18 @@ def generate_script_and_start_chat():
     keywords_list = [kw.strip() for kw in keywords.split(",") if kw.strip()]
 
     if script_from_client == 'default':
-        script = load_yaml(base_script_path)
-        roles = load_yaml(base_participants_path)
-        create_agent_config(
-            base_participants_path,
-            meta_agents_path,
-            output_path
-        )
+        script, roles = default_script_and_roles()
+        status = 'ready'
     else:
-        try:
-            kwargs = {
-                "problem": problem_text,
-                "solution": solution_text,
-                "keywords": keywords_list
-            }
-            script, roles = generate_script_and_roles(folder_path, **kwargs)
-            
-            # Create agent config from dynamic script and roles for this session
-            create_agent_config(
-                dynamic_participants_path,
-                meta_agents_path,
-                output_path
-            )
-        except Exception as e:
-            print(f"!!! ERROR generating or saving script/personas: {e}")
-            traceback.print_exc()
-            flash("Có lỗi xảy ra trong quá trình tạo kịch bản. Sử dụng kịch bản mặc định (nếu có).", "warning")
-
-
+        stored = get_script_store().sample(problem_id, keywords_list)
+        if stored is not None:
+            # Kịch bản sinh sẵn cho cùng bài toán, từ khóa và phiên bản prompt
+            script, roles = stored
+            status = 'ready'
+        else:
+            # Kịch bản được sinh trong job nền; phiên ở trạng thái 'preparing' cho tới khi job xong
+            script, roles = {}, None
+            status = 'preparing'
 
     # Create new session in DB
     session_id = str(uuid.uuid4())
@@ -560,7 +589,7 @@ def generate_script_and_start_chat():
 
     try:
         current_stage_id = "1"
-        log_file = f"logs/{session_id}.log"
+        log_file = f"logs/{session_id}.jsonl"
         stage_state = {
             "completed_task_ids": [],
             "signal": "1"
@@ -579,14 +608,12 @@ def generate_script_and_start_chat():
             "log_file": log_file,
             "stage_state": stage_state,
             "inner_thought": inner_thought, # Use the list here
-            "turn_number": turn_number
+            "turn_number": turn_number,
+            "status": status
         }
         # Call the new create_session function instead of save_session_data
         create_session(session_data)
         print(f"--- APP: Created new session {session_id} for user {username} (problem {problem_id}) ---")
-        
-        return redirect(url_for('chat_interface', session_id=session_id))
-    
     except Exception as e:
         print(f"!!! ERROR creating new session in DB: {e}")
         traceback.print_exc()
@@ -594,6 +621,43 @@ def generate_script_and_start_chat():
         flash("Có lỗi xảy ra khi tạo phiên trò chuyện mới.", "error")
         return redirect(url_for('select_problem_page'))
 
+    if status == 'preparing':
+        submit_script_job(session_id, problem_id, {
+            "problem": problem_text,
+            "solution": solution_text,
+            "keywords": keywords_list
+        })
+
+    return redirect(url_for('chat_interface', session_id=session_id))
+
+def submit_script_job(session_id, problem_id, kwargs):
+    """
+    Generate the script and roles of a 'preparing' session on the script job queue.
+    Progress and completion are pushed to the session room as 'script_status' events;
+    the default script is used when generation fails or misses its deadline.
+    Generated scripts are added to the script store for later sessions.
+    """
+    def generate(progress):
+        script, roles = generate_script_and_roles(on_progress=progress, **kwargs)
+        if not script or not roles:
+            raise ValueError("Empty script or roles")
+        return script, roles
+
+    def on_progress(job):
+        with app.app_context():
+            send_script_status(job.to_dict(), session_id)
+
+    def on_complete(job, result):
+        store = get_script_store()
+        if job.status == JOB_DONE and store.flow == "generation":
+            store.add(problem_id, kwargs["keywords"], *result)
+        with app.app_context():
+            mark_session_ready(session_id, *result)
+            send_script_status(job.to_dict(), session_id)
+        print(f"--- APP: Script for session {session_id} is ready ({job.status}).")
+
+    get_script_jobs().submit(session_id, generate, default_script_and_roles, on_progress, on_complete)
+
 # Biến cờ để kiểm soát việc tắt
 shutdown_flag = False
 
@@ -613,6 +677,12 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)  # Bắt tín hiệu Ctrl+C
     signal.signal(signal.SIGTERM, signal_handler) # Bắt tín hiệu tắt khác
 
+    if os.getenv("SCRIPT_STORE_WARM", "0").lower() in ("1", "true", "yes") and get_script_store().flow == "generation":
+        # Sinh sẵn kịch bản cho các bài toán chưa có đủ biến thể, chạy nền để không chặn server
+        threading.Thread(
+            target=get_script_store().warm, args=(problem_list_data, generate_variant), daemon=True
+        ).start()
+
     try:
         socketio.run(app, debug=True, use_reloader=False)
     except Exception as e:
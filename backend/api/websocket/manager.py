@@ -6,6 +6,8 @@ from fastapi import WebSocket
 import json
 import logging
 
+from flow.utils.spans import traced
+
 logger = logging.getLogger(__name__)
 
 
@@ -44,6 +46,7 @@ class ConnectionManager:
         except Exception as e:
             logger.error(f"Error sending personal message: {e}")
 
+    @traced("ws.broadcast")
     async def broadcast_to_session(self, message: dict, session_id: str):
         """Broadcast a message to all connections in a session."""
         if session_id not in self.active_connections:
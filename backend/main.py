@@ -9,12 +9,14 @@ import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from dotenv import load_dotenv
 
 from backend.api.routes import problems_router, sessions_router
 from backend.api.websocket.manager import manager
 from backend.services.dialogue_service import process_user_message, cleanup_session
 from backend.models import MessageCreate
+from flow.utils import metrics
 
 # Load environment variables
 load_dotenv()
@@ -99,6 +101,12 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Counters and histograms (LLM calls, spans of each dialogue phase, WebSocket sends) in Prometheus text format."""
+    return Response(content=metrics.render_prometheus(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """
@@ -94,7 +94,7 @@ async def create_dialogue_manager(
         participants=["Harry", "Hermione", "Ron"],
         current_stage_id="1",
         turn_number=0,
-        filename=f"logs/{session_id}.log"
+        filename=f"logs/{session_id}.jsonl"
     )
 
     # Store in active managers
@@ -0,0 +1,90 @@
+"""
+Measure conversation bookkeeping over a long session: the previous string (+= per message, split per recent-history
+lookup, regex parse for /history) against the Conversation record list in flow/utils/conversation.py.
+
+Usage:
+    python -m benchmarks.conversation --messages 2000
+"""
+import argparse
+import re
+import time
+
+from flow.utils.conversation import Conversation
+
+# Mỗi lượt DialogueFlow đưa toàn bộ hội thoại vào khoảng 5 prompt (stage, think, evaluate, talk...)
+PROMPTS_PER_TURN = 5
+RECENT_MESSAGES = 5
+
+
+def sample_message(index):
+    if index % 2:
+        return "User", f"Em chưa hiểu bước {index}, bạn giải thích lại được không?"
+    return "Bob", (f"**Bước {index}:** Tập xác định $D = \\mathbb{{R}}$.\n"
+                   "  • Đạo hàm $f'(x) = \\frac{2}{(x+1)^2}$\n"
+                   "  • Hàm số đồng biến trên từng khoảng xác định.")
+
+
+def legacy_history(conversation):
+    '''Previous /history parsing, kept as the reference.'''
+    history = []
+    current = None
+    for line in conversation.split('\n'):
+        match = re.match(r"TIME=([0-9.]+) \| CON#(\d+) \| SENDER=([^|]+) \| TEXT=(.+)", line)
+        if match:
+            if current:
+                history.append(current)
+            current = {"sender": match.group(3).strip(), "text": match.group(4).strip()}
+        elif current:
+            current["text"] += "\n" + line
+    if current:
+        history.append(current)
+    return history
+
+
+def run_legacy(messages):
+    conversation = ""
+    prompt_chars = 0
+    for index in range(messages):
+        sender, text = sample_message(index)
+        conversation += f"TIME={time.time()} | CON#{index} | SENDER={sender} | TEXT={text}\n"
+        for _ in range(PROMPTS_PER_TURN):
+            prompt_chars += len(conversation)
+        lines = conversation.strip().split('\n')
+        prompt_chars += len('\n'.join(lines[-RECENT_MESSAGES:]))
+    return len(legacy_history(conversation)), prompt_chars
+
+
+def run_records(messages):
+    conversation = Conversation()
+    prompt_chars = 0
+    for index in range(messages):
+        sender, text = sample_message(index)
+        conversation.append(sender, text, index)
+        for _ in range(PROMPTS_PER_TURN):
+            prompt_chars += len(conversation.text)
+        prompt_chars += len(conversation.tail(RECENT_MESSAGES))
+    stored = conversation.text
+    return len([(record.sender, record.text) for record in Conversation.parse(stored)]), prompt_chars
+
+
+def timed(function, messages):
+    started_at = time.perf_counter()
+    result = function(messages)
+    return time.perf_counter() - started_at, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the conversation string with the Conversation record list.")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages in the simulated session")
+    args = parser.parse_args()
+
+    legacy_s, (legacy_count, _) = timed(run_legacy, args.messages)
+    records_s, (records_count, _) = timed(run_records, args.messages)
+    print(f"{'variant':<10} {'messages':>9} {'seconds':>9}")
+    print(f"{'string':<10} {legacy_count:>9} {legacy_s:>9.3f}")
+    print(f"{'records':<10} {records_count:>9} {records_s:>9.3f}")
+    print(f"speedup: {legacy_s / records_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure the per-turn Python overhead of preparing the dialogue crews, rebuilding them every turn
+(as before the crew pool) versus leasing compiled crews from the pool. No LLM call is made.
+
+Usage:
+    python -m benchmarks.crew_pool --turns 20
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from flow.crews.dialogueCrew import Evaluator, Participant, StageManager
+from flow.utils.crew_pool import CrewPool
+from flow.utils.helpers import load_yaml
+
+CONFIG_FOLDER = "flow/crews/config"
+
+
+def rebuild_turn(roles):
+    '''Old path: new crew classes (YAML parsing) and new Crew/Agent/Task objects for every call.'''
+    participants = list(roles)
+    crews = [StageManager().crew(), Evaluator().crew()]
+    for name in participants:
+        crews.append(Participant(name, "think", roles).crew())
+    crews.append(Participant(participants[0], "talk", roles).crew())
+    return crews
+
+
+def pooled_turn(pool, crew_bases):
+    '''New path: crew classes created once per session, compiled crews leased from the pool.'''
+    crews = []
+    for crew_base in crew_bases:
+        with pool.lease(crew_base, "benchmark") as crew:
+            crews.append(crew)
+    return crews
+
+
+def measure(turn, turns):
+    durations = []
+    tracemalloc.start()
+    for _ in range(turns):
+        started_at = time.perf_counter()
+        turn()
+        durations.append(time.perf_counter() - started_at)
+    _, peak = tracemalloc.get_traced_memory()
+    allocated = sum(stat.size for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    return {
+        "mean_ms": statistics.mean(durations) * 1000,
+        "steady_ms": statistics.mean(durations[1:] or durations) * 1000,
+        "peak_kb": peak / 1024,
+        "retained_kb": allocated / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rebuilding crews per turn with the crew pool.")
+    parser.add_argument("--turns", type=int, default=20, help="Number of simulated turns")
+    args = parser.parse_args()
+
+    roles = load_yaml(f"{CONFIG_FOLDER}/dynamic_participants.yaml")
+    participants = list(roles)
+    pool = CrewPool()
+    crew_bases = [StageManager(), Evaluator()] + [Participant(name, "think", roles) for name in participants]
+    crew_bases.append(Participant(participants[0], "talk", roles))
+
+    results = {
+        "rebuild": measure(lambda: rebuild_turn(roles), args.turns),
+        "pool": measure(lambda: pooled_turn(pool, crew_bases), args.turns),
+    }
+    print(f"{'path':<8} {'mean (ms)':>10} {'steady (ms)':>12} {'peak (KB)':>10} {'retained (KB)':>14}")
+    for path, r in results.items():
+        print(f"{path:<8} {r['mean_ms']:>10.1f} {r['steady_ms']:>12.1f} {r['peak_kb']:>10.0f} {r['retained_kb']:>14.0f}")
+    print(f"pool: {pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Load-test concurrent DialogueFlow sessions against the local fake LLM provider (no network, no API key).
+
+Usage:
+    python -m benchmarks.load_test --sessions 20 --turns 5
+
+The fake provider is configured with the FAKE_LLM_* variables (latency, stream pacing, error injection)
+and the scheduler with LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY, as on the server.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.think_modes import SAMPLE_MESSAGES, build_flow
+from flow.utils import metrics
+from flow.utils.traces import TurnTrace
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run_session(index, turns, log_folder, think_mode, latencies, errors):
+    flow = build_flow(think_mode, log_folder)
+    flow.filename = f"{log_folder}/session_{index}.jsonl"
+    flow.trace = TurnTrace(flow.filename, f"session_{index}")
+    for turn in range(turns):
+        sender, text = SAMPLE_MESSAGES[turn % len(SAMPLE_MESSAGES)]
+        flow.state.turn_number += 1
+        flow.state.conversation.append(sender, text, flow.state.turn_number)
+        # Giống process_new_message nhưng không có độ trễ 10 giây và Socket.IO
+        flow.start_turn()
+        started_at = time.perf_counter()
+        try:
+            flow.kickoff()
+        except Exception as e:
+            errors.append(f"session {index} turn {turn}: {e}")
+            continue
+        latencies.append(time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run concurrent dialogue sessions against the fake LLM provider.")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session")
+    parser.add_argument("--think-mode", default="parallel", choices=["parallel", "batched"])
+    parser.add_argument("--live", action="store_true", help="Use the real LLM provider instead of the fake one")
+    args = parser.parse_args()
+
+    if not args.live:
+        os.environ["LLM_PROVIDER"] = "fake"
+    metrics.registry.reset()
+    latencies, errors = [], []
+
+    with tempfile.TemporaryDirectory() as log_folder:
+        started_at = time.perf_counter()
+        threads = [
+            threading.Thread(target=run_session, args=(i, args.turns, log_folder, args.think_mode, latencies, errors))
+            for i in range(args.sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+    print(f"{args.sessions} sessions x {args.turns} turns in {elapsed:.1f}s, {len(errors)} failed turns")
+    if latencies:
+        print(f"turn latency: p50 {percentile(latencies, 0.5):.2f}s  p95 {percentile(latencies, 0.95):.2f}s  "
+              f"p99 {percentile(latencies, 0.99):.2f}s  mean {statistics.mean(latencies):.2f}s")
+    snapshot = metrics.registry.snapshot()
+    for counter in snapshot["counters"]:
+        labels = ",".join(f"{k}={v}" for k, v in counter["labels"].items())
+        print(f"  {counter['name']}{{{labels}}} {counter['value']:g}")
+    for error in errors[:10]:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measure clean_response/process_content per call on long LLM outputs (scripts, evaluations, speeches),
+comparing the precompiled pipeline in flow/utils/helpers.py with the previous regex chain.
+
+Usage:
+    python -m benchmarks.response_cleaning --repeat 2000
+"""
+import argparse
+import json
+import re
+import time
+
+import yaml
+
+from flow.utils.helpers import clean_response, process_content
+
+CONFIG_FOLDER = "flow/crews/config"
+
+
+def legacy_clean_response(raw_response):
+    '''Previous implementation, kept as the reference for the equivalence tests.'''
+    cleaned = re.sub(r'```(json|yaml|html|markdown)?', '', raw_response)
+    cleaned = cleaned.replace('<\\html>', '').replace('</html>', '')
+    cleaned = cleaned.replace('\r\n', '\n').replace('\r', '\n')
+    cleaned = re.sub(r'^\s*\{\{', '{', cleaned)
+    cleaned = re.sub(r'\}\}\s*$', '}', cleaned)
+    cleaned = re.sub(
+        r'(?<!\\)\\(?!["\\/bfnrt]|u[0-9a-fA-F]{4})',
+        r'\\\\',
+        cleaned
+    )
+    return cleaned.strip()
+
+
+def legacy_process_content(content):
+    '''Previous implementation, kept as the reference for the equivalence tests.'''
+    content = re.sub(r'(\d+\.)\s', r'<span class="list-number">\1</span> ', content)
+    content = re.sub(r'•\s', r'<span class="list-bullet">•</span> ', content)
+    content = re.sub(r'\\sqrt(\w+)', r'\\sqrt{\1}', content)
+    content = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', content)
+    content = re.sub(r'\$(?! )', '$ ', content)
+    content = re.sub(r'(?<! )\$', ' $', content)
+    content = re.sub(r'\n\s{2,}', lambda m: '\n' + ' ' * (len(m.group(0))//2), content)
+    bullet_replacements = {'◦': '○', '■': '▪', '‣': '▸'}
+    for k, v in bullet_replacements.items():
+        content = content.replace(k, v)
+    return content
+
+
+def sample_outputs():
+    '''Realistic inputs: a script as the ScriptWriter returns it, an evaluation and a speech with LaTeX.'''
+    with open(f"{CONFIG_FOLDER}/base_script.yaml", "r", encoding="utf-8") as f:
+        script = "```yaml\n" + f.read() + "\n```"
+    evaluation = "```json\n" + json.dumps([
+        {"name": name, "action": "speak", "score": "4", "internal_score": 3.5, "external_score": 4.0,
+         "reason": "Bạn ấy muốn giải thích $f'(x) = \\frac{2}{(x+1)^2} > 0$ với mọi $x \\neq -1$. " * 4}
+        for name in ("Bob", "Alice", "Charlie")
+    ], ensure_ascii=False, indent=2) + "\n```"
+    speech = ("**Bước 1:** Tập xác định $D = \\mathbb{R} \\setminus \\{-1\\}$.\n"
+              "  • Đạo hàm $f'(x) = \\frac{2}{(x+1)^2}$, \\sqrt2 ◦ 1. Xét dấu.\n"
+              "    ■ Hàm số đồng biến trên $(-\\infty; -1)$ và $(-1; +\\infty)$.\n") * 8
+    return {
+        "script": (clean_response, legacy_clean_response, script),
+        "evaluation": (clean_response, legacy_clean_response, evaluation),
+        "speech": (process_content, legacy_process_content, speech),
+        "short": (clean_response, legacy_clean_response, '{"signal": "1", "completed_task_ids": ["1.1"]}'),
+    }
+
+
+def per_call_us(function, text, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        function(text)
+    return (time.perf_counter() - started_at) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the precompiled response cleaning with the old regex chain.")
+    parser.add_argument("--repeat", type=int, default=2000, help="Calls per input")
+    args = parser.parse_args()
+
+    print(f"{'input':<12} {'chars':>7} {'legacy (us)':>12} {'new (us)':>9} {'speedup':>8}")
+    for name, (function, legacy, text) in sample_outputs().items():
+        assert function(text) == legacy(text), name
+        legacy_us = per_call_us(legacy, text, args.repeat)
+        new_us = per_call_us(function, text, args.repeat)
+        print(f"{name:<12} {len(text):>7} {legacy_us:>12.1f} {new_us:>9.1f} {legacy_us / new_us:>7.2f}x")
+    # Kịch bản YAML sau khi làm sạch vẫn phải đọc được
+    yaml.safe_load(clean_response(sample_outputs()["script"][2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare the sequential optimize loop of ScriptPlannerFlow with beam search for several beam widths.
+
+Usage:
+    python -m benchmarks.script_planner --widths 1 2 4
+    python -m benchmarks.script_planner --live --widths 3
+
+Runs against the fake LLM provider unless --live is given (FAKE_LLM_* variables set the simulated latency).
+"""
+import argparse
+import os
+import time
+
+from flow.scriptPlannerFlow import ScriptPlannerFlow
+from flow.utils.helpers import load_yaml
+
+CONFIG_FOLDER = "flow/crews/config"
+
+
+def run(search, beam_width, problem_data, skill_tree, time_budget):
+    flow = ScriptPlannerFlow(
+        problem=problem_data["problem"],
+        solution=problem_data.get("solution", ""),
+        keywords="",
+        skill_tree=skill_tree,
+        search=search,
+        beam_width=beam_width,
+        time_budget=time_budget,
+    )
+    started_at = time.perf_counter()
+    flow.kickoff()
+    return time.perf_counter() - started_at, flow.state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs. beam search script optimization.")
+    parser.add_argument("--problem", default="1", help="Problem id in problems.yaml")
+    parser.add_argument("--widths", type=int, nargs="+", default=[1, 2, 3], help="Beam widths to try")
+    parser.add_argument("--time-budget", type=float, default=600, help="Wall-clock budget of the beam search (s)")
+    parser.add_argument("--live", action="store_true", help="Use the real LLM provider instead of the fake one")
+    args = parser.parse_args()
+
+    if not args.live:
+        os.environ["LLM_PROVIDER"] = "fake"
+    problem_data = load_yaml(f"{CONFIG_FOLDER}/problems.yaml")[args.problem]
+    with open(f"{CONFIG_FOLDER}/skill_tree.yaml", "r", encoding="utf-8") as f:
+        skill_tree = f.read()
+
+    runs = [("sequential", 1)] + [("beam", width) for width in args.widths]
+    print(f"{'search':<12} {'k':>3} {'total (s)':>10} {'iterations':>11} {'score':>6}  scores per iteration")
+    for search, width in runs:
+        elapsed, state = run(search, width, problem_data, skill_tree, args.time_budget)
+        per_iteration = " | ".join(
+            f"{entry['seconds']:.1f}s {entry['scores']}" for entry in state.iteration_log[1:]
+        )
+        print(f"{search:<12} {width:>3} {elapsed:>10.1f} {len(state.iteration_log) - 1:>11} "
+              f"{state.overall_score:>6}  {per_iteration}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Measure per-turn stage tracking on large synthetic scripts: re-rendering the stage from the script dict every turn
+(as before the compiled script) versus tracking with a CompiledScript built once per session.
+
+Usage:
+    python -m benchmarks.task_tracking --stages 20 --tasks 50 --turns 2000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from flow.utils.task_utils import CompiledScript
+
+
+def legacy_track_task(stage_state, current_stage_id, script):
+    '''Old path: task id lists and O(n·m) `in` checks on the completed list, stage re-rendered every turn.'''
+    completed_task_ids = stage_state["completed_task_ids"]
+    signal = stage_state["signal"]
+    all_task_ids = [task["id"] for task in script[current_stage_id]["tasks"]]
+    max_number_of_stage = len(script.keys())
+    uncompleted_task_ids = [task_id for task_id in all_task_ids if task_id not in completed_task_ids]
+    next_stage_id = str(int(current_stage_id) + 1)
+    if len(uncompleted_task_ids) == 0 and signal[0] == "3" and int(next_stage_id) <= max_number_of_stage:
+        return legacy_initialize_task(script, next_stage_id), completed_task_ids, next_stage_id
+    task_status = []
+    next_task_id = None
+    for i, task_id in enumerate(all_task_ids):
+        if task_id in completed_task_ids:
+            task_status.append(f'''
+                [X] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
+                ''')
+        elif next_task_id is None:
+            next_task_id = task_id
+            task_status.append(f'''
+                [!] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
+                    ''')
+        else:
+            task_status.append(f'''
+                [] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
+                    ''')
+    task_status = "\n".join(task_status)
+    current_stage_description = f'''
+        Name: {script[current_stage_id]["name"]}
+        Description: {script[current_stage_id]["description"]}
+        Đây là các nhiệm vụ cần thực hiện, [X] là task đã làm xong, [] là task chưa làm, [!] là task tiếp theo cần tập trung:
+        Tasks:
+        {task_status}
+        '''
+    return current_stage_description, completed_task_ids, current_stage_id
+
+
+def legacy_initialize_task(script, current_stage_id):
+    current_stage_description = f'''
+    Name: {script[current_stage_id]["name"]}
+    Description: {script[current_stage_id]["description"]}
+    Đây là các nhiệm vụ cần thực hiện, [X] là task đã làm xong, [] là task chưa làm, [!] là task tiếp theo cần tập trung:
+    Tasks:
+    '''
+    tasks = script[current_stage_id]["tasks"]
+    current_stage_description += f'''
+        [!] [{tasks[0]["id"]}] {tasks[0]["description"]}
+    '''
+    for task in tasks[1:]:
+        current_stage_description += f'''
+        [] [{task["id"]}] {task["description"]}
+        '''
+    return current_stage_description
+
+
+def make_script(stages, tasks):
+    return {
+        str(stage): {
+            "stage": str(stage),
+            "name": f"Stage {stage}",
+            "description": f"Mô tả của stage {stage}.\n" * 3,
+            "tasks": [{"id": f"{stage}.{task}", "description": f"Nhiệm vụ {task} của stage {stage}.\n" * 2}
+                      for task in range(1, tasks + 1)],
+        }
+        for stage in range(1, stages + 1)
+    }
+
+
+def make_turns(script, turns, seed=0):
+    '''A session walking through the script: tasks get completed one by one, the stage advances on signal 3.'''
+    rng = random.Random(seed)
+    stage_ids = list(script)
+    turns_per_stage = max(1, turns // len(stage_ids))
+    states = []
+    for stage_id in stage_ids:
+        task_ids = [task["id"] for task in script[stage_id]["tasks"]]
+        completed = []
+        for turn in range(turns_per_stage):
+            done = min(len(task_ids), (turn + 1) * len(task_ids) // turns_per_stage)
+            completed = completed + [task_id for task_id in task_ids[len(completed):done]]
+            signal = "3" if done == len(task_ids) and rng.random() < 0.5 else str(rng.choice((1, 2)))
+            states.append((stage_id, {"completed_task_ids": list(completed), "signal": signal}))
+    return states[:turns]
+
+
+def measure(track, turns):
+    durations = []
+    for stage_id, stage_state in turns:
+        started_at = time.perf_counter()
+        track(stage_state, stage_id)
+        durations.append(time.perf_counter() - started_at)
+    return {
+        "mean_us": statistics.mean(durations) * 1e6,
+        "p95_us": sorted(durations)[int(len(durations) * 0.95)] * 1e6,
+        "total_ms": sum(durations) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare legacy stage tracking with the compiled script.")
+    parser.add_argument("--stages", type=int, default=20, help="Stages in the synthetic script")
+    parser.add_argument("--tasks", type=int, default=50, help="Tasks per stage")
+    parser.add_argument("--turns", type=int, default=2000, help="Simulated turns")
+    args = parser.parse_args()
+
+    script = make_script(args.stages, args.tasks)
+    turns = make_turns(script, args.turns)
+
+    started_at = time.perf_counter()
+    compiled = CompiledScript(script)
+    compile_ms = (time.perf_counter() - started_at) * 1000
+
+    # Cả hai cách phải cho cùng mô tả stage, từng ký tự
+    for stage_id, stage_state in turns:
+        assert compiled.track(stage_state, stage_id) == legacy_track_task(stage_state, stage_id, script)
+
+    results = {
+        "legacy": measure(lambda stage_state, stage_id: legacy_track_task(stage_state, stage_id, script), turns),
+        "compiled": measure(compiled.track, turns),
+    }
+    print(f"{args.stages} stages x {args.tasks} tasks, {len(turns)} turns, compiled once in {compile_ms:.2f} ms")
+    print(f"{'path':<10} {'mean (us)':>10} {'p95 (us)':>10} {'total (ms)':>11}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['mean_us']:>10.1f} {result['p95_us']:>10.1f} {result['total_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the 'parallel' and 'batched' think modes of DialogueFlow on the same conversation.
+
+Usage:
+    python -m benchmarks.think_modes --turns 5
+
+Set LLM_CACHE_MODE=record on the first run and LLM_CACHE_MODE=replay afterwards
+to compare the modes offline from the recorded responses.
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections import deque
+
+from flow.dialogueFlow import DialogueFlow
+from flow.utils import metrics
+from flow.utils.helpers import load_yaml
+
+CONFIG_FOLDER = "flow/crews/config"
+
+SAMPLE_MESSAGES = [
+    ("User", "Chào mọi người, bài này mình nên bắt đầu từ đâu nhỉ?"),
+    ("User", "Mình nghĩ là phải tìm tập xác định trước đúng không?"),
+    ("User", "Tập xác định là R bỏ đi -1 phải không các bạn?"),
+]
+
+
+def build_flow(think_mode, log_folder):
+    roles = load_yaml(f"{CONFIG_FOLDER}/dynamic_participants.yaml")
+    script = load_yaml(f"{CONFIG_FOLDER}/base_script.yaml")
+    problem = load_yaml(f"{CONFIG_FOLDER}/problems.yaml")["1"]["problem"]
+    conversation = f"TIME={time.time()} | CON#0 | SENDER=System | TEXT=Chào mừng các bạn đến với lớp học. Bài toán của chúng ta là: {problem}\n"
+    for turn, (sender, text) in enumerate(SAMPLE_MESSAGES, start=1):
+        conversation += f"TIME={time.time()} | CON#{turn} | SENDER={sender} | TEXT={text}\n"
+
+    return DialogueFlow(
+        socketio=None,
+        conversation=conversation,
+        filename=f"{log_folder}/think_{think_mode}.jsonl",
+        problem=problem,
+        stage_state={"completed_task_ids": [], "signal": "1"},
+        current_stage_id="1",
+        script=script,
+        participants=list(roles.keys()),
+        turn_number=len(SAMPLE_MESSAGES),
+        inner_thought=deque(maxlen=5),
+        roles=roles,
+        think_mode=think_mode,
+    )
+
+
+def llm_usage(task_names):
+    requests = sum(metrics.registry.get("llm_requests_total", task=task, cached=cached)
+                   for task in task_names for cached in (False, True))
+    tokens = sum(metrics.registry.get("llm_tokens_total", task=task) for task in task_names)
+    return requests, tokens
+
+
+def run_mode(think_mode, turns, log_folder):
+    flow = build_flow(think_mode, log_folder)
+    metrics.registry.reset()
+    latencies = []
+    for _ in range(turns):
+        started_at = time.perf_counter()
+        inner_thought_list = asyncio.run(flow._run_thinkers(flow.state.current_stage_description))
+        latencies.append(time.perf_counter() - started_at)
+        flow.state.inner_thought.append(inner_thought_list)
+    requests, tokens = llm_usage(["think", "think_batch"])
+    return {
+        "mode": think_mode,
+        "mean_s": statistics.mean(latencies),
+        "max_s": max(latencies),
+        "requests_per_turn": requests / turns,
+        "tokens_per_turn": tokens / turns,
+        "fallbacks": metrics.registry.get("batched_think_fallbacks_total"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare parallel and batched inner-thought generation.")
+    parser.add_argument("--turns", type=int, default=3, help="Number of think rounds per mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_folder:
+        results = [run_mode(mode, args.turns, log_folder) for mode in ("parallel", "batched")]
+
+    print(f"{'mode':<10} {'mean (s)':>9} {'max (s)':>9} {'req/turn':>9} {'tokens/turn':>12} {'fallbacks':>10}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['mean_s']:>9.2f} {r['max_s']:>9.2f} {r['requests_per_turn']:>9.1f} "
+              f"{r['tokens_per_turn']:>12.0f} {r['fallbacks']:>10}")
+
+
+if __name__ == "__main__":
+    main()
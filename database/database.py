@@ -31,6 +31,15 @@ def init_db():
         db.executescript(f.read().decode('utf8'))
     print("Initialized the database.")
 
+def migrate_db():
+    """Add the columns introduced after an existing database was created."""
+    db = get_db()
+    columns = {row['name'] for row in db.execute('PRAGMA table_info(sessions)').fetchall()}
+    if 'status' not in columns:
+        db.execute("ALTER TABLE sessions ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
+        db.commit()
+        print("Migrated the database: added sessions.status.")
+
 @click.command('init-db')
 @with_appcontext
 def init_db_command():
@@ -14,7 +14,8 @@ CREATE TABLE sessions (
   log_file TEXT,                    -- Path to the log file
   stage_state TEXT,                 -- State of the current stage as string of JSON
   inner_thought TEXT,               -- Agent's inner thoughts as string of lists
-  turn_number INTEGER                -- Number of turns in the conversation
+  turn_number INTEGER,               -- Number of turns in the conversation
+  status TEXT NOT NULL DEFAULT 'ready' -- 'preparing' while the script is being generated, then 'ready'
 );
 
 CREATE TABLE events (
@@ -118,7 +118,7 @@ def start_session():
             participants=["Harry", "Hermione", "Ron"],
             current_stage_id="1",
             turn_number=0,
-            filename=f"logs/{session_id}.log"
+            filename=f"logs/{session_id}.jsonl"
         )
 
         # Store in active sessions
@@ -0,0 +1,196 @@
+"""
+Batch pre-generation of scripts and roles into the script store, across a pool of worker processes.
+
+Usage:
+    python -m flow.batch_scripts --variants 3
+    python -m flow.batch_scripts --problems-file term1.yaml --flow planner --workers 4
+    python -m flow.batch_scripts --ids 1 2 --keywords "đạo hàm"
+
+The global rate limit (LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY) is split evenly between the workers.
+Every finished unit (problem, variant) is appended to a checkpoint file. A run only plans the variants still missing
+from the store, under unit ids not used before, so an interrupted run resumes where it stopped when started again with
+the same arguments, and a duplicate or failed unit is retried instead of being counted as a stored variant.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+from dotenv import load_dotenv
+
+from flow.utils.helpers import load_yaml, parse_yaml
+from flow.utils.script_store import CONFIG_FOLDER, ScriptStore, normalize_keywords
+
+load_dotenv()
+
+
+def load_problems(path):
+    '''
+    Problems from a YAML or JSON file: either {id: {"problem", "solution"}} like problems.yaml,
+    or a list of {"id", "problem", "solution"}.
+    '''
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = load_yaml(path)
+    if isinstance(data, list):
+        data = {str(item["id"]): item for item in data}
+    return {str(problem_id): problem for problem_id, problem in (data or {}).items() if problem.get("problem")}
+
+
+def init_worker(workers):
+    '''Give each worker process its share of the global LLM rate limit.'''
+    from flow.utils.llm_scheduler import LLMScheduler, set_scheduler
+
+    max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", 0))
+    set_scheduler(LLMScheduler(
+        requests_per_minute=float(os.getenv("LLM_RPM", 0)) / workers,
+        tokens_per_minute=float(os.getenv("LLM_TPM", 0)) / workers,
+        max_concurrency=max(1, max_concurrency // workers) if max_concurrency else 0,
+    ))
+
+
+def generate_unit(flow, problem, solution, keywords):
+    '''Run one script generation in a worker process; return (script, roles).'''
+    if flow == "planner":
+        from flow.scriptPlannerFlow import ScriptPlannerFlow
+        from flow.utils.crew_runner import run_crew
+
+        with open(os.path.join(CONFIG_FOLDER, "skill_tree.yaml"), "r", encoding="utf-8") as f:
+            skill_tree = f.read()
+        planner = ScriptPlannerFlow(problem=problem, solution=solution, keywords=keywords, skill_tree=skill_tree)
+        script = planner.kickoff()
+        roles = run_crew(planner.roles_writer, {
+            "problem": problem,
+            "solution": solution,
+            "keywords": keywords,
+            "script": yaml.dump(script, allow_unicode=True, sort_keys=False)
+        })
+        return script, parse_yaml(roles.raw)
+
+    from flow.scriptGenerationFlow import generate_script_and_roles
+
+    return generate_script_and_roles(problem=problem, solution=solution, keywords=keywords)
+
+
+class Checkpoint:
+    '''Append-only JSONL record of finished units; the last record of a unit wins for `done`.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.units = set()  # mọi unit đã được ghi (done, duplicate, failed): id của chúng không được dùng lại
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # dòng ghi dở khi tiến trình bị dừng
+                    self.units.add(record["unit"])
+                    if record.get("status") == "done":
+                        self.done.add(record["unit"])
+                    else:
+                        self.done.discard(record["unit"])
+
+    def record(self, unit, status, **details):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"unit": unit, "status": status, "time": time.time(), **details}, ensure_ascii=False) + "\n")
+        self.units.add(unit)
+        if status == "done":
+            self.done.add(unit)
+        else:
+            self.done.discard(unit)
+
+
+def plan_units(problems, keywords, variants, store, checkpoint):
+    '''
+    Units (problem_id, unit id) still to generate: `variants` minus what the store already holds for each problem.
+    The store is the source of truth, so each missing variant gets a fresh unit id not yet in the checkpoint.
+    '''
+    units = []
+    for problem_id in problems:
+        prefix = f"{problem_id}|{','.join(keywords)}#"
+        index = 0
+        for _ in range(variants - store.count(problem_id, keywords)):
+            while f"{prefix}{index}" in checkpoint.units:
+                index += 1
+            units.append((problem_id, f"{prefix}{index}"))
+            index += 1
+    return units
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate scripts and roles for many problems in parallel.")
+    parser.add_argument("--problems-file", default=os.path.join(CONFIG_FOLDER, "problems.yaml"),
+                        help="YAML/JSON file of problems (default: problems.yaml)")
+    parser.add_argument("--ids", nargs="*", help="Only these problem ids")
+    parser.add_argument("--keywords", default="", help="Comma-separated keywords the scripts are generated for")
+    parser.add_argument("--flow", default=os.getenv("SCRIPT_STORE_FLOW", "generation"), choices=["generation", "planner"],
+                        help="ScriptGenerationFlow (write_script + write_roles) or ScriptPlannerFlow (optimize loop)")
+    parser.add_argument("--variants", type=int, default=int(os.getenv("SCRIPT_STORE_VARIANTS", 3)),
+                        help="Variants per problem")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes")
+    parser.add_argument("--store-dir", default=os.getenv("SCRIPT_STORE_DIR", ".cache/scripts"))
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: <store-dir>/checkpoints/<flow>-<prompt version>.jsonl)")
+    args = parser.parse_args()
+
+    problems = load_problems(args.problems_file)
+    if args.ids:
+        problems = {problem_id: problems[problem_id] for problem_id in args.ids if problem_id in problems}
+    keywords = list(normalize_keywords(args.keywords))
+    store = ScriptStore(args.store_dir, variants=args.variants, flow=args.flow)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(
+        args.store_dir, "checkpoints", f"{args.flow}-{store.version}.jsonl"
+    ))
+    units = plan_units(problems, keywords, args.variants, store, checkpoint)
+    print(f"--- BATCH: {len(problems)} problems, {len(units)} units to generate "
+          f"({len(checkpoint.done)} already done), flow={args.flow}, workers={args.workers}")
+
+    started_at = time.perf_counter()
+    done, duplicates, failed = 0, 0, 0
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.workers,))
+    try:
+        futures = {
+            executor.submit(generate_unit, args.flow, problems[problem_id]["problem"],
+                            problems[problem_id].get("solution", ""), keywords): (problem_id, unit, time.perf_counter())
+            for problem_id, unit in units
+        }
+        for future in as_completed(futures):
+            problem_id, unit, submitted_at = futures[future]
+            try:
+                script, roles = future.result()
+                if not script or not roles:
+                    raise ValueError("Empty script or roles")
+            except Exception as e:
+                failed += 1
+                checkpoint.record(unit, "failed", error=str(e))
+                print(f"--- BATCH: {unit} failed: {e}")
+                continue
+            # Chỉ tiến trình chính ghi vào store và checkpoint
+            added = store.add(problem_id, keywords, script, roles)
+            # Bản trùng không thêm biến thể nào: không ghi là done, lần chạy sau sinh lại với id mới
+            checkpoint.record(unit, "done" if added else "duplicate", key=store.key(problem_id, keywords),
+                              seconds=round(time.perf_counter() - submitted_at, 1))
+            if added:
+                done += 1
+            else:
+                duplicates += 1
+            print(f"--- BATCH: {unit} {'done' if added else 'duplicate'} ({done + duplicates + failed}/{len(units)})")
+    except KeyboardInterrupt:
+        print("--- BATCH: Interrupted, finished units are checkpointed; run again to resume.")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    print(f"--- BATCH: {done} done, {duplicates} duplicates, {failed} failed "
+          f"in {time.perf_counter() - started_at:.0f}s. Store: {store.stats()}")
+
+
+if __name__ == "__main__":
+    main()
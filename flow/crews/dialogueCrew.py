@@ -1,23 +1,28 @@
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from dotenv import load_dotenv
+from flow.utils.config_cache import cached_crew_config
+from flow.crews.schemas import Speech, StageState
 
 load_dotenv()
     
+@cached_crew_config
 @CrewBase
 class Participant:
     """Participant Crew"""
 
-    def __init__(self, agent_name, task_name):
+    def __init__(self, agent_name, task_name, roles=None):
         self.agent_name = agent_name
         self.task_name = task_name
-        self.agents_config = "config/agents.yaml"
+        # Vai trò của phiên (trong bộ nhớ) được ưu tiên hơn base_participants.yaml, để các phiên không ghi đè file dùng chung
+        self.roles = roles or {}
+        self.agents_config = "config/base_participants.yaml"
         self.tasks_config = "config/tasks.yaml"
 
     @agent
     def agent(self) -> Agent:
         return Agent(
-            config=self.agents_config[self.agent_name],
+            config=dict(self.roles.get(self.agent_name) or self.agents_config[self.agent_name]),
         )
 
     @task
@@ -25,6 +30,8 @@ class Participant:
         return Task(
             config=self.tasks_config[self.task_name],
             agent=self.agent(),
+            # Lời nói được trả về theo schema (structured output) thay vì sửa JSON bằng regex
+            output_pydantic=Speech if self.task_name == "talk" else None,
         )
         
     @crew
@@ -36,10 +43,13 @@ class Participant:
             # verbose=True,
         )
 
+@cached_crew_config
 @CrewBase
 class Evaluator():
     """Evaluator Crew"""
-    agents_config = "config/agents.yaml"
+    agent_name = "Evaluator"
+    task_name = "evaluate"
+    agents_config = "config/meta_agents.yaml"
     tasks_config = "config/tasks.yaml"
     
     @agent
@@ -67,10 +77,13 @@ class Evaluator():
         )
 
 
+@cached_crew_config
 @CrewBase
 class StageManager():
     """Stage Manager Crew"""
-    agents_config = "config/agents.yaml"
+    agent_name = "StageManager"
+    task_name = "manage_stage"
+    agents_config = "config/meta_agents.yaml"
     tasks_config = "config/tasks.yaml"
     
     @agent
@@ -84,6 +97,7 @@ class StageManager():
         return Task(
             config=self.tasks_config["manage_stage"],
             agent=self.stage_manager(),
+            output_pydantic=StageState,
         )
     
     @crew
@@ -93,4 +107,35 @@ class StageManager():
             tasks=self.tasks,
             process=Process.sequential,
             # verbose=True,
-        )
\ No newline at end of file
+        )
+
+@cached_crew_config
+@CrewBase
+class BatchThinker():
+    """Batched Inner Thought Crew: thoughts of all participants in one call"""
+    agent_name = "ThoughtSimulator"
+    task_name = "think_batch"
+    agents_config = "config/meta_agents.yaml"
+    tasks_config = "config/tasks.yaml"
+
+    @agent
+    def thought_simulator(self) -> Agent:
+        return Agent(
+            config=self.agents_config["ThoughtSimulator"],
+        )
+
+    @task
+    def think_batch(self) -> Task:
+        return Task(
+            config=self.tasks_config["think_batch"],
+            agent=self.thought_simulator(),
+        )
+
+    @crew
+    def crew(self) -> Crew:
+        return Crew(
+            agents=self.agents,
+            tasks=self.tasks,
+            process=Process.sequential,
+            # verbose=True,
+        )
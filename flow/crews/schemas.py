@@ -0,0 +1,51 @@
+from typing import Literal
+from pydantic import BaseModel, Field
+
+
+class InnerThought(BaseModel):
+    """Output of the 'think' task for one participant"""
+    stimuli: list[str] = []
+    thought: str
+    action: Literal["listen", "speak"]
+
+
+class BatchedInnerThought(InnerThought):
+    """One entry of the 'think_batch' task output"""
+    agent: str
+
+
+class StageState(BaseModel):
+    """Output of the 'manage_stage' task"""
+    explain: str = ""
+    signal: list[str] = Field(min_length=2, max_length=2)
+    completed_task_ids: list[str] = []
+
+
+class ThoughtEvaluation(BaseModel):
+    """One entry of the 'evaluate' task output"""
+    name: str
+    action: Literal["listen", "speak"]
+    score: str = ""
+    internal_score: float = Field(ge=1.0, le=5.0)
+    external_score: float = Field(ge=1.0, le=5.0)
+
+
+class Speech(BaseModel):
+    """Output of the 'talk' task"""
+    spoken_message: str
+
+
+class AgentTurn(BaseModel):
+    """Final answer of a Claude Agent SDK turn"""
+    selected_agent: str
+    response: str
+    reasoning: str = ""
+
+
+# Schema đầu ra của các task hội thoại, dùng để kiểm tra kết quả trước khi đưa vào state
+TASK_SCHEMAS = {
+    "think": InnerThought,
+    "manage_stage": StageState,
+    "evaluate": list[ThoughtEvaluation],
+    "talk": Speech,
+}
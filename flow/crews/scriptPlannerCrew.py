@@ -1,17 +1,19 @@
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from dotenv import load_dotenv
+from flow.utils.config_cache import cached_crew_config
 
 load_dotenv()
 import os
 
+@cached_crew_config
 @CrewBase
 class ScriptPlannerCrew():
 
     def __init__(self, agent_name: str, task_name: str):
         self.agent_name = agent_name
         self.task_name = task_name
-        self.agents_config = "config/agents.yaml"
+        self.agents_config = "config/meta_agents.yaml"
         self.tasks_config = "config/tasks.yaml"        
 
     @agent
@@ -32,6 +34,5 @@ class ScriptPlannerCrew():
             agents=self.agents,
             tasks=self.tasks,
             process=Process.sequential,
-            max_rpm=15,
             # verbose=True,
         )
\ No newline at end of file
@@ -3,27 +3,39 @@ from ast import literal_eval
 import asyncio
 from collections import deque
 import json
+import os
 import random
-from pydantic import BaseModel
-from crewai.flow import Flow, listen, start
-from flow.crews.dialogueCrew import Participant, Evaluator, StageManager
+from pydantic import BaseModel, Field, ValidationError
+from crewai.flow import Flow, and_, listen, start
+from flow.crews.dialogueCrew import Participant, Evaluator, StageManager, BatchThinker
+from flow.crews.schemas import BatchedInnerThought
 from dotenv import load_dotenv
-from flow.utils.helpers import (parse_json_response, parse_output, 
+from flow.utils.helpers import (parse_json_response, process_content,
                      clean_response)
 import time
 import threading
 
-from flow.utils.task_utils import track_task
+from flow.utils.task_utils import CompiledScript, track_task
+from flow.utils.crew_runner import run_crew_async, run_structured_async, output_tokens
+from flow.utils.crew_pool import get_crew_pool
+from flow.utils.timing import PhaseTimer
+from flow.utils.spans import span
+from flow.utils import metrics
 from flow.utils.socket_utils import (send_message_via_socketio, 
                           send_agent_status_via_socketio, 
                           send_stage_update_via_socketio, 
                           send_system_status)
-from flow.utils.helpers import save_to_log_file
+from flow.utils.helpers import save_to_log_file, estimate_tokens, is_trivial_message
+from flow.utils.traces import TurnTrace
+from flow.utils.conversation import Conversation
 # Import socketio from the main app module to use its sleep function
 load_dotenv()
 
+# Suy nghĩ thay thế khi thinker của một agent lỗi hoặc quá deadline: agent đó chỉ lắng nghe lượt này
+LISTEN_FALLBACK_THOUGHT = json.dumps({"stimuli": [], "thought": "", "action": "listen"})
+
 class DialogueState(BaseModel):
-    conversation: str = ""
+    conversation: Conversation = Field(default_factory=Conversation)
     inner_thought: deque[list[dict]] = deque(maxlen=5)
     participants: list[str] = []
     evaluation: list[dict] = [] 
@@ -43,33 +55,70 @@ class DialogueFlow(Flow[DialogueState]):
     def __init__(self, socketio, **kwargs):
         super().__init__()
         self.socketio = socketio
-        self.state.conversation = kwargs["conversation"]
-        save_to_log_file(f"Conversation: {self.state.conversation}\n", "test.txt")
+        # Danh sách tin nhắn + văn bản đã render sẵn (văn bản chỉ được ghép lại khi hội thoại thay đổi)
+        self.state.conversation = Conversation.parse(kwargs["conversation"])
+        # Bản ghi hội thoại để debug (trước đây luôn ghi vào test.txt): chỉ khi DIALOGUE_DEBUG_DUMP là đường dẫn file
+        debug_dump = os.getenv("DIALOGUE_DEBUG_DUMP", "")
+        if debug_dump:
+            save_to_log_file(f"Conversation: {self.state.conversation}\n", debug_dump)
         self.filename = kwargs["filename"]
         self.state.problem = kwargs["problem"]
+        # Kịch bản được biên dịch một lần cho cả phiên, mỗi lượt chỉ tra các task của stage hiện tại
+        self.compiled_script = CompiledScript(kwargs["script"])
         current_stage_description, completed_task_ids, current_stage_id = track_task(kwargs["stage_state"], 
                                                           kwargs["current_stage_id"],
-                                                          kwargs["script"])
+                                                          self.compiled_script)
         self.state.current_stage_description = current_stage_description
         self.state.completed_task_ids = completed_task_ids
         self.state.current_stage_id = current_stage_id
         self.state.participants = kwargs["participants"]
         self.state.script = kwargs["script"]
-        self.thinker_list = [Participant(agent_name, "think") for agent_name in self.state.participants]    
-        self.talker_list = [Participant(agent_name, "talk") for agent_name in self.state.participants]
+        self.roles = kwargs.get("roles")
+        self.thinker_list = [Participant(agent_name, "think", self.roles) for agent_name in self.state.participants]    
+        self.talker_list = [Participant(agent_name, "talk", self.roles) for agent_name in self.state.participants]
+        # Tạo một lần cho cả phiên; crew đã biên dịch được tái sử dụng qua crew pool
+        self.stage_manager = StageManager()
+        self.evaluator = Evaluator()
         self.state.turn_number = kwargs["turn_number"]
         self.state.inner_thought = kwargs["inner_thought"]
         self.session_id = kwargs.get("session_id", "")  # Lưu session_id để gửi thông báo đến đúng phòng
         self.user_name = kwargs.get("user_name", "User")
-        self.roles = kwargs.get("roles")
         self.processing_lock = threading.Lock()  # Lock để đảm bảo chỉ có một luồng xử lý cùng lúc
         self._is_cancelled = False # Thêm cờ hủy
+        # Speculative talk: bắt đầu gọi 'talk' cho các agent muốn 'speak' song song với Evaluator
+        self.speculative_talk = kwargs.get(
+            "speculative_talk",
+            os.getenv("DIALOGUE_SPECULATIVE_TALK", "0").lower() in ("1", "true", "yes")
+        )
+        self.speculation_width = int(kwargs.get("speculation_width", os.getenv("DIALOGUE_SPECULATION_WIDTH", 2)))
+        self._speculative_talks = {}  # agent_name -> {"task", "inputs", "started_at", "finished_at"}
+        # Pipelined stage: StageManager và các thinker chạy đồng thời, chỉ chạy lại thinker khi stage chuyển
+        self.pipelined_stage = kwargs.get(
+            "pipelined_stage",
+            os.getenv("DIALOGUE_PIPELINED_STAGE", "1").lower() in ("1", "true", "yes")
+        )
+        self._stage_ready = None
+        self._stage_advanced = False
+        # Mỗi phase của lượt cũng là một span "dialogue.<phase>" (histogram trên /metrics)
+        self.timer = PhaseTimer(span_prefix="dialogue")
+        # Trace JSONL của phiên: mỗi phase của lượt là một bản ghi, kèm số token và thời gian
+        self.trace = TurnTrace(self.filename, self.session_id)
+        self.turn_tokens = {}  # phase -> số token đã dùng trong lượt
+        self._speculation = {}  # kết quả speculative talk của lượt, ghi vào bản ghi 'talk'
+        # Think mode: 'parallel' = một lần gọi LLM cho mỗi agent, 'batched' = một lần gọi cho cả nhóm
+        self.think_mode = kwargs.get("think_mode", os.getenv("DIALOGUE_THINK_MODE", "parallel")).lower()
+        if self.think_mode not in ("parallel", "batched"):
+            raise ValueError(f"Invalid think mode '{self.think_mode}', expected 'parallel' or 'batched'")
+        self.batch_thinker = BatchThinker() if self.think_mode == "batched" else None
+        # Early exit: bỏ qua các lần gọi LLM không thể thay đổi kết quả của lượt (StageManager với tin nhắn xác nhận,
+        # Evaluator khi có tối đa một agent muốn nói, talk khi không ai nói)
+        self.early_exit = kwargs.get(
+            "early_exit",
+            os.getenv("DIALOGUE_EARLY_EXIT", "1").lower() in ("1", "true", "yes")
+        )
         
         if self.state.turn_number == 0:
-            with open(self.filename, "w") as f:  # Use append mode to accumulate turns
-                script = "\n\n".join([f"{k}: {v}" for key, value in self.state.script.items() for k, v in value.items()])
-                f.write(f'Script:\n{script}\n\n')
-                f.write(f"Conversation:\n{self.state.conversation}\n")
+            self.trace.start(self.state.script, self.state.participants, self.state.conversation.text)
             
         # print("--- DIALOGUE FLOW INITIALIZED WITH ---")
         # print(f"Conversation: {self.state.conversation}")
@@ -89,49 +138,199 @@ class DialogueFlow(Flow[DialogueState]):
         """Sets the cancellation flag."""
         print(f"--- DIALOGUE FLOW [{self.session_id}]: Cancellation requested.")
         self._is_cancelled = True
+        get_crew_pool().evict_session(self.session_id)
         # Có thể thêm logic để cố gắng dừng các tác vụ con nếu cần (phức tạp hơn)
 
-    @start()    
-    def manage_stage(self):
-        if self._is_cancelled: # Kiểm tra cờ hủy
-            print(f"--- DIALOGUE FLOW [{self.session_id}]: manage_stage cancelled.")
-            return # Dừng xử lý
+    def start_turn(self):
+        '''Reset the per-turn state (stage event, timings, token counts, speculation, trace records) before kickoff().'''
+        self._stage_ready = None
+        self._stage_advanced = False
+        self.timer.start_turn()
+        self.turn_tokens = {}
+        self._speculation = {}
+        self.trace.discard_turn()
+
+    def _stage_ready_event(self):
+        # Tạo event trong event loop của lượt hiện tại (mỗi lần kickoff là một loop mới)
+        if self._stage_ready is None:
+            self._stage_ready = asyncio.Event()
+        return self._stage_ready
+
+    def _count_tokens(self, phase, result, inputs):
+        self.turn_tokens[phase] = self.turn_tokens.get(phase, 0) + output_tokens(result, inputs)
+
+    @start()
+    async def manage_stage(self):
+        try:
+            if self._is_cancelled: # Kiểm tra cờ hủy
+                print(f"--- DIALOGUE FLOW [{self.session_id}]: manage_stage cancelled.")
+                return # Dừng xử lý
+
+            message_text = self.state.new_message.split("TEXT=", 1)[-1]
+            if self.early_exit and self.state.stage_state and is_trivial_message(message_text):
+                # Tin nhắn xác nhận ngắn không hoàn thành được task nào: giữ nguyên stage
+                print(f"--- DIALOGUE FLOW [{self.session_id}]: Trivial message, skipping StageManager.")
+                metrics.inc("dialogue_shortcuts_total", phase="stage")
+                self.trace.add("stage", stage_id=self.state.current_stage_id, stage_changed=False, skipped=True)
+                return
+
+            print("Managing stage")
+            if self.session_id:
+                send_system_status("Đang cập nhật trạng thái nhiệm vụ...", self.session_id)
+
+            inputs = {
+                "conversation": self.state.conversation.text,
+                "problem": self.state.problem,
+                "current_stage_description": self.state.current_stage_description
+            }
+            try:
+                with self.timer.phase("stage"):
+                    result, stage_state = await run_structured_async(self.stage_manager, inputs, self.session_id)
+            except Exception as e:
+                # Giữ nguyên trạng thái stage hiện tại, lượt hội thoại vẫn tiếp tục
+                print(f"--- DIALOGUE FLOW [{self.session_id}]: StageManager failed, keeping current stage: {e}")
+                metrics.inc("dialogue_phase_fallbacks_total", phase="stage")
+                self.trace.add("stage", stage_id=self.state.current_stage_id, stage_changed=False, error=str(e))
+                return
+            self._count_tokens("stage", result, inputs)
 
-        print("Managing stage")
-        if self.session_id:
-            send_system_status("Đang cập nhật trạng thái nhiệm vụ...", self.session_id)
-            
-        stage_manager = StageManager()
-        stage_manager_result = stage_manager.crew().kickoff(inputs={
-            "conversation": self.state.conversation,
-            "problem": self.state.problem,
-            "current_stage_description": self.state.current_stage_description
-        })
-        
-        stage_state = parse_json_response(clean_response(stage_manager_result.raw))
-        if stage_state is not None:
             self.state.stage_state = stage_state
-        else:
-            print("Warning: Stage state is None")
-            
-        current_stage_description, completed_task_ids, current_stage_id = track_task(self.state.stage_state, 
-                                                          self.state.current_stage_id, 
-                                                          self.state.script)
 
-        self.state.current_stage_description = current_stage_description
-        self.state.completed_task_ids = completed_task_ids
-        if int(current_stage_id) != int(self.state.current_stage_id):
-            self.state.current_stage_id = current_stage_id
-            save_to_log_file(f"Stage changed to {current_stage_id}\n", self.filename)
-        
-        if self.session_id:
-            send_stage_update_via_socketio({
-                'current_stage_id': self.state.current_stage_id,
-                'completed_task_ids': self.state.completed_task_ids
-            }, self.session_id)
+            current_stage_description, completed_task_ids, current_stage_id = track_task(self.state.stage_state, 
+                                                              self.state.current_stage_id, 
+                                                              self.compiled_script)
+
+            self.state.current_stage_description = current_stage_description
+            self.state.completed_task_ids = completed_task_ids
+            if int(current_stage_id) != int(self.state.current_stage_id):
+                self.state.current_stage_id = current_stage_id
+                self._stage_advanced = True
+            self.trace.add("stage", stage_state=stage_state, stage_id=self.state.current_stage_id,
+                           stage_changed=self._stage_advanced)
+
+            if self.session_id:
+                send_stage_update_via_socketio({
+                    'current_stage_id': self.state.current_stage_id,
+                    'completed_task_ids': self.state.completed_task_ids
+                }, self.session_id)
+        finally:
+            self._stage_ready_event().set()
+
+    def _previous_thoughts(self, agent_name):
+        return [
+            d["inner_thought"]
+            for turn in self.state.inner_thought
+            for d in turn
+            if d["agent"] == agent_name
+        ]
+
+    async def _think_batched(self, current_stage_description, phase="think"):
+        '''
+        Ask for the inner thoughts of all participants in one structured-output call.
+        Return {agent_name: inner_thought} for the entries that pass the inner-thought schema;
+        the inner thought is serialized the same way as the output of the per-agent 'think' task.
+        '''
+        personas = {
+            name: {key: value for key, value in (self.roles or {}).get(name, {}).items() if key != "llm"}
+            for name in self.state.participants
+        }
+        inputs = {
+            "problem": self.state.problem,
+            "current_stage_description": current_stage_description,
+            "conversation": self.state.conversation.text,
+            "participants": self.state.participants,
+            "personas": json.dumps(personas, ensure_ascii=False, indent=2),
+            "previous_thoughts": json.dumps(
+                {name: self._previous_thoughts(name) for name in self.state.participants},
+                ensure_ascii=False, indent=2
+            )
+        }
+        try:
+            with span("dialogue.think_batch"):
+                result = await run_crew_async(self.batch_thinker, inputs, self.session_id)
+        except Exception as e:
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: Batched think failed: {e}")
+            return {}
+        self._count_tokens(phase, result, inputs)
+
+        entries = parse_json_response(clean_response(result.raw))
+        if not isinstance(entries, list):
+            metrics.inc("batched_think_invalid_total")
+            return {}
+
+        thoughts = {}
+        for entry in entries:
+            try:
+                validated = BatchedInnerThought.model_validate(entry)
+            except ValidationError as e:
+                print(f"--- DIALOGUE FLOW [{self.session_id}]: Invalid batched thought: {e}")
+                continue
+            if validated.agent in self.state.participants and validated.agent not in thoughts:
+                thoughts[validated.agent] = json.dumps(validated.model_dump(exclude={"agent"}), ensure_ascii=False)
+        return thoughts
+
+    async def _run_thinkers(self, current_stage_description, phase="think"):
+        '''
+        Run the thinkers against the given stage description, either one call per agent in parallel
+        or one batched call for everyone (agents missing from the batched output fall back to their own call).
+        Return the list of inner thoughts for this turn (one dict per agent); tokens are counted under `phase`.
+        '''
+        self._discard_speculative_talks()
+
+        thoughts = {}
+        if self.think_mode == "batched":
+            thoughts = await self._think_batched(current_stage_description, phase)
+            if self.speculative_talk:
+                for agent_name, inner_thought in thoughts.items():
+                    self._start_speculative_talk(agent_name, inner_thought)
+
+        async def think(agent):
+            inputs = {
+                "problem": self.state.problem,
+                "current_stage_description": current_stage_description,
+                "conversation": self.state.conversation.text,
+                "participants": self.state.participants,
+                "previous_thoughts": self._previous_thoughts(agent.agent_name)
+            }
+            try:
+                with span("dialogue.think_agent", agent=agent.agent_name):
+                    result = await run_crew_async(agent, inputs, self.session_id)
+            except Exception as e:
+                print(f"--- DIALOGUE FLOW [{self.session_id}]: Think failed for {agent.agent_name}, listening this turn: {e}")
+                metrics.inc("dialogue_phase_fallbacks_total", phase="think")
+                return LISTEN_FALLBACK_THOUGHT
+            self._count_tokens(phase, result, inputs)
+            inner_thought = clean_response(result.raw)
+            if self.speculative_talk:
+                self._start_speculative_talk(agent.agent_name, inner_thought)
+            return inner_thought
+
+        remaining = [agent for agent in self.thinker_list if agent.agent_name not in thoughts]
+        if remaining and self.think_mode == "batched":
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: Batched think missing {[a.agent_name for a in remaining]}, "
+                  "falling back to per-agent think.")
+            metrics.inc("batched_think_fallbacks_total", len(remaining))
+
+        # Chờ tất cả coroutine hoàn thành
+        results = await asyncio.gather(*[think(agent) for agent in remaining])
+        for agent, inner_thought in zip(remaining, results):
+            thoughts[agent.agent_name] = inner_thought
+
+        return [
+            {
+                "agent": agent.agent_name,
+                "inner_thought": thoughts[agent.agent_name]
+            }
+            for agent in self.thinker_list
+        ]
 
-    @listen(manage_stage)
+    @start()
     async def generate_inner_thought(self):
+        # Ở chế độ pipelined, thinker chạy song song với StageManager trên mô tả stage trước lượt.
+        # Ở chế độ tuần tự, đợi StageManager xong như trước.
+        if not self.pipelined_stage:
+            await self._stage_ready_event().wait()
+
         if self._is_cancelled: # Kiểm tra cờ hủy
             print(f"--- DIALOGUE FLOW [{self.session_id}]: generate_inner_thought cancelled.")
             return # Dừng xử lý
@@ -140,64 +339,180 @@ class DialogueFlow(Flow[DialogueState]):
         if self.session_id:
             for agent in self.thinker_list:
                 send_agent_status_via_socketio(agent.agent_name, "thinking", self.session_id)
-        
-        # Tạo danh sách các coroutine
-        tasks = [
-            agent.crew().kickoff_async(inputs={
-                "problem": self.state.problem,
-                "current_stage_description": self.state.current_stage_description,
-                "conversation": self.state.conversation,
-                "participants": self.state.participants,
-                "previous_thoughts": [
-                    d["inner_thought"]
-                    for turn in self.state.inner_thought
-                    for d in turn
-                    if d["agent"] == agent.agent_name
-                ]
-            })
-            for agent in self.thinker_list
-        ]
-
-        # Chờ tất cả coroutine hoàn thành
-        results = await asyncio.gather(*tasks)
 
+        with self.timer.phase("think"):
+            inner_thought_list = await self._run_thinkers(self.state.current_stage_description)
         # Lưu kết quả vào self.state.inner_thought dưới dạng list các dict (one per agent)
-        inner_thought_list = [
-            {
-                "agent": agent.agent_name,
-                "inner_thought": clean_response(result.raw)
-            }
-            for agent, result in zip(self.thinker_list, results)
-        ]
         self.state.inner_thought.append(inner_thought_list)  # Append the list for this turn
+        self.trace.add("think", mode=self.think_mode, thoughts=inner_thought_list)
 
 
-    @listen(generate_inner_thought)
+    @listen(and_(manage_stage, generate_inner_thought))
     async def evaluate_inner_thought(self):
         if self._is_cancelled: # Kiểm tra cờ hủy
             print(f"--- DIALOGUE FLOW [{self.session_id}]: evaluate_inner_thought cancelled.")
             return # Dừng xử lý
 
-        evaluator = Evaluator()
+        if self.pipelined_stage and self._stage_advanced:
+            # Hiếm khi xảy ra: stage đã chuyển trong lúc thinker đang chạy, suy nghĩ lại với stage mới
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: Stage advanced, re-running thinkers.")
+            metrics.inc("dialogue_thinker_reruns_total")
+            with self.timer.phase("think_rerun"):
+                self.state.inner_thought[-1] = await self._run_thinkers(self.state.current_stage_description,
+                                                                        "think_rerun")
+            self.trace.add("think", mode=self.think_mode, thoughts=self.state.inner_thought[-1], rerun=True,
+                           tokens=self.turn_tokens.get("think_rerun", 0),
+                           duration=self.timer.durations()["think_rerun"])
+
         # Take the latest list of inner thoughts (for this turn)
         latest_inner_thought_list = self.state.inner_thought[-1]
-        evaluation = evaluator.crew().kickoff(inputs={
+        speakers = self._speaking_agents(latest_inner_thought_list)
+        if self.early_exit and len(speakers) <= 1:
+            # Không cần so sánh: không ai hoặc chỉ một agent muốn nói
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: {len(speakers)} candidate(s), skipping Evaluator.")
+            metrics.inc("dialogue_shortcuts_total", phase="evaluate")
+            # Không có điểm nào được chấm: đánh dấu ứng viên là skipped thay vì ghi điểm giả vào state và trace
+            self.state.evaluation = [{"name": name, "action": "speak", "skipped": True} for name in speakers]
+            self.trace.add("evaluate", evaluation=self.state.evaluation, skipped=True)
+            if self.session_id:
+                for participant in self.state.participants:
+                    send_agent_status_via_socketio(participant, "idle", self.session_id)
+            return
+
+        inputs = {
             "problem": self.state.problem,
             "current_stage_description": self.state.current_stage_description,
-            "conversation": self.state.conversation,
+            "conversation": self.state.conversation.text,
             "thoughts": json.dumps(latest_inner_thought_list), # evaluate all agents' thoughts in this turn
             "roles": self.roles
-        })
-        self.state.evaluation = parse_json_response(clean_response(evaluation.raw)) # [{}]
+        }
+        try:
+            with self.timer.phase("evaluate"):
+                result, self.state.evaluation = await run_structured_async(self.evaluator, inputs, self.session_id) # [{}]
+            self._count_tokens("evaluate", result, inputs)
+            self.trace.add("evaluate", evaluation=self.state.evaluation)
+        except Exception as e:
+            # Không có đánh giá thì không ai được chọn nói trong lượt này
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: Evaluator failed, nobody speaks this turn: {e}")
+            metrics.inc("dialogue_phase_fallbacks_total", phase="evaluate")
+            self.state.evaluation = []
+            self.trace.add("evaluate", evaluation=[], error=str(e))
         
         # Done thinking, set all agents to idle
-        for participant in self.state.participants:
-            send_agent_status_via_socketio(participant, "idle", self.session_id)
+        if self.session_id:
+            for participant in self.state.participants:
+                send_agent_status_via_socketio(participant, "idle", self.session_id)
         
+    @staticmethod
+    def _speaking_agents(inner_thought_list):
+        '''Names of the agents whose inner thought chose 'speak' this turn.'''
+        speakers = []
+        for item in inner_thought_list:
+            thought = parse_json_response(item["inner_thought"])
+            if isinstance(thought, dict) and thought.get("action") == "speak":
+                speakers.append(item["agent"])
+        return speakers
+
+    def _talk_inputs(self, thought):
+        return {
+            "problem": self.state.problem,
+            "current_stage_description": self.state.current_stage_description,
+            "conversation": self.state.conversation.text,
+            "participants": self.state.participants,
+            "thought": thought
+        }
+
+    def _start_speculative_talk(self, agent_name, inner_thought):
+        '''
+        Start the 'talk' call for an agent whose inner thought chose 'speak', while the Evaluator is still running.
+        At most `speculation_width` talks are started per turn.
+        '''
+        if self._is_cancelled or len(self._speculative_talks) >= self.speculation_width:
+            return
+        thought = parse_json_response(inner_thought)
+        if not isinstance(thought, dict) or thought.get("action") != "speak":
+            return
+        talker = next((t for t in self.talker_list if t.agent_name == agent_name), None)
+        if talker is None:
+            return
+
+        inputs = self._talk_inputs(inner_thought)
+        entry = {"inputs": inputs, "started_at": time.perf_counter(), "finished_at": None}
+
+        async def talk():
+            try:
+                with span("dialogue.speculative_talk", agent=agent_name):
+                    return await run_structured_async(talker, inputs, self.session_id)
+            finally:
+                entry["finished_at"] = time.perf_counter()
+
+        entry["task"] = asyncio.ensure_future(talk())
+        self._speculative_talks[agent_name] = entry
+        metrics.inc("speculative_talk_launched_total")
+        print(f"--- DIALOGUE FLOW [{self.session_id}]: Speculative talk started for {agent_name}")
+
+    def _discard_speculative_talks(self):
+        '''
+        Cancel every pending speculative talk and return the tokens spent on them.
+        Completed losers report their real usage; in-flight ones are charged the estimated prompt tokens.
+        '''
+        wasted_tokens = 0
+        for agent_name, entry in list(self._speculative_talks.items()):
+            task = entry["task"]
+            if task.done() and not task.cancelled() and task.exception() is None:
+                result, _ = task.result()
+                wasted_tokens += output_tokens(result, entry["inputs"])
+            else:
+                task.cancel()
+                wasted_tokens += estimate_tokens(json.dumps(entry["inputs"], ensure_ascii=False, default=str))
+            del self._speculative_talks[agent_name]
+        if wasted_tokens:
+            metrics.inc("speculative_talk_wasted_tokens_total", wasted_tokens)
+        return wasted_tokens
+
+    async def _resolve_speculative_talk(self, talker, inputs):
+        '''
+        Return the speculative (result, parsed) 'talk' output for the selected talker, or None if there is no usable one
+        (not started, failed, or started on a conversation that has changed since). Only called when a talker was chosen,
+        so every None counts as a miss.
+        '''
+        selected_at = time.perf_counter()
+        entry = self._speculative_talks.pop(talker, None)
+        wasted_tokens = self._discard_speculative_talks()
+        self._speculation = {"speculative": False, "wasted_tokens": wasted_tokens}
+        if entry is None:
+            if self.speculative_talk:
+                metrics.inc("speculative_talk_misses_total")
+            return None
+        if entry["inputs"] != inputs:
+            self._speculative_talks[talker] = entry
+            self._speculation["wasted_tokens"] += self._discard_speculative_talks()
+            metrics.inc("speculative_talk_misses_total")
+            return None
+        try:
+            result = await entry["task"]
+        except Exception as e:
+            print(f"--- DIALOGUE FLOW [{self.session_id}]: Speculative talk for {talker} failed: {e}")
+            metrics.inc("speculative_talk_misses_total")
+            return None
+
+        # Thời gian tiết kiệm = thời điểm kết thúc nếu gọi talk tuần tự - thời điểm kết thúc thực tế
+        self.timer.record("talk", entry["started_at"], entry["finished_at"])
+        duration = entry["finished_at"] - entry["started_at"]
+        latency_saved = max(0.0, (selected_at + duration) - max(selected_at, entry["finished_at"]))
+        metrics.inc("speculative_talk_hits_total")
+        metrics.inc("speculative_talk_latency_saved_seconds_total", latency_saved)
+        self._count_tokens("talk", result[0], inputs)
+        self._speculation.update(speculative=True, latency_saved=latency_saved)
+        print(f"--- DIALOGUE FLOW [{self.session_id}]: Speculative talk: hit for {talker}, "
+              f"latency saved {latency_saved:.2f}s, wasted tokens {wasted_tokens}")
+        return result
+
     @listen(evaluate_inner_thought)
-    def generate_speech(self):
+    async def generate_speech(self):
         if self._is_cancelled: # Kiểm tra cờ hủy
             print(f"--- DIALOGUE FLOW [{self.session_id}]: generate_speech cancelled.")
+            self._discard_speculative_talks()
             return # Dừng xử lý
 
         try:
@@ -205,13 +520,21 @@ class DialogueFlow(Flow[DialogueState]):
             self.state.talker = self.select_talker(self.state.evaluation)
 
             if self.state.talker is None:
-                # Trường hợp 1: Không có agent nào chọn 'speak' (tất cả chọn nghe)
+                # Trường hợp 1: Không có agent nào chọn 'speak' (tất cả chọn nghe), không gọi talk.
+                # Không có người nói thì không có gì để đoán trúng/trượt: chỉ bỏ các speculative talk còn chạy
+                self._speculation = {"speculative": False, "wasted_tokens": self._discard_speculative_talks()}
                 if self.session_id:
                     send_system_status("Các agent đang lắng nghe. Chưa có ai muốn nói.", self.session_id)
                 # Đặt trạng thái speech và talker để đảm bảo các bước sau không xử lý nhầm
                 self.state.speech = ""
+                metrics.inc("dialogue_shortcuts_total", phase="talk")
+                self.trace.add("talk", talker=None, speech="", **self._speculation)
+                return
 
             # Trường hợp 2: Đã chọn được người nói thành công
+            thought = next((item["inner_thought"] for item in self.state.inner_thought[-1] if item["agent"] == self.state.talker), "")
+            talk_inputs = self._talk_inputs(thought)
+            speech = await self._resolve_speculative_talk(self.state.talker, talk_inputs)
             # Lệnh print đã được chuyển vào select_talker
 
             # Chỉ người nói đang gõ
@@ -220,14 +543,13 @@ class DialogueFlow(Flow[DialogueState]):
 
             agent = next(talker for talker in self.talker_list if talker.agent_name == self.state.talker)
 
-            speech = agent.crew().kickoff(inputs={
-                "problem": self.state.problem,
-                "current_stage_description": self.state.current_stage_description,
-                "conversation": self.state.conversation,
-                "participants": self.state.participants,
-                "thought": next((item["inner_thought"] for item in self.state.inner_thought[-1] if item["agent"] == self.state.talker), "")
-            })
-            self.state.speech = parse_output(speech.raw, "spoken_message")
+            if speech is None:
+                with self.timer.phase("talk", agent=self.state.talker):
+                    speech = await run_structured_async(agent, talk_inputs, self.session_id)
+                self._count_tokens("talk", speech[0], talk_inputs)
+            _, spoken = speech
+            self.state.speech = process_content(spoken["spoken_message"])
+            self.trace.add("talk", talker=self.state.talker, speech=self.state.speech, **self._speculation)
 
             self.state.turn_number += 1 # Tăng số lượt khi agent nói xong
 
@@ -241,40 +563,22 @@ class DialogueFlow(Flow[DialogueState]):
 
         except Exception as e:
             # Xử lý các lỗi không mong muốn khác trong quá trình tạo lời nói (không phải từ select_talker)
+            self._discard_speculative_talks()
             print(f"--- DIALOGUE FLOW [{self.session_id}]: Unexpected error during speech generation (outside of talker selection): {e}")
             if self.session_id:
                 send_system_status(f"Đã xảy ra lỗi không mong muốn khi tạo lời nói: {e}", self.session_id)
             self.state.speech = ""
             self.state.talker = None
+            self.trace.add("talk", talker=None, speech="", error=str(e))
             return # Thoát khỏi hàm
 
     @listen(generate_speech)
     def save_final_answers(self):
-        stage_state = "\n".join([f"{key}: {value}" for key, value in self.state.stage_state.items()])
-        # Find the inner thought for the talker in the latest turn
-        latest_inner_thought_list = self.state.inner_thought[-1] if self.state.inner_thought else []
-        inner_thoughts = "\n".join([f"{item['agent']}: {item['inner_thought']}" for item in latest_inner_thought_list])
-        # Get the evaluation for this turn
-        evaluation = "\n\n".join([
-            "\n".join([f"{key}: {value}" for key, value in item.items()])
-            for item in self.state.evaluation
-        ])
-        with open(self.filename, "a") as f:  # Use append mode to accumulate turns
-            f.write(f'''Turn: {self.state.turn_number}.
-================================================= 
-Stage state:\n {stage_state}
-
-Inner thoughts:\n{inner_thoughts}
-
-Evaluation:\n{evaluation}
-=================================================
-''')
-            if self.state.talker:
-                f.write(self.state.new_message)
-            else:
-                f.write(f"TIME={time.time()} | CON#{self.state.turn_number} | SENDER=System | TEXT=No agent chose to speak.\n")
-            f.write("\n")
-        
+        print(f"--- DIALOGUE FLOW [{self.session_id}]: {self.timer.format_summary()}")
+        # Các bản ghi phase của lượt và bản ghi tổng kết được ghi một lần, qua luồng ghi log nền
+        self.trace.write_turn(self.state.turn_number, self.timer.summary(), self.turn_tokens,
+                              talker=self.state.talker or None)
+
         # Set talker to idle
         if self.session_id and self.state.talker: # Only set status if a talker was selected
             send_agent_status_via_socketio(self.state.talker, "idle", self.session_id)
@@ -294,29 +598,16 @@ Evaluation:\n{evaluation}
                  send_system_status("Phiên trò chuyện đã kết thúc hoặc đang được đóng. Vui lòng tạo phiên mới.", self.session_id)
             return # Bỏ qua tin nhắn nếu flow đã bị hủy
 
-        new_message_str = (
-            f"TIME={time.time()} | "
-            f"CON#{self.state.turn_number} | "
-            f"SENDER={sender_name} | "
-            f"TEXT={text}\n"
-        )
-        
-        # Save the new message to the log file if the sender is not a participant (means it's the user)
+        timestamp = time.time()
+
+        # Save the new message to the trace if the sender is not a participant (means it's the user)
         # and update turn number. This happens immediately.
         if sender_name not in self.state.participants:
             self.state.turn_number += 1
-            # Update the new message string with the new turn number
-            new_message_str = (
-                f"TIME={time.time()} | "
-                f"CON#{self.state.turn_number} | "
-                f"SENDER={sender_name} | "
-                f"TEXT={text}\n"
-            )
-            save_to_log_file(f"Turn: {self.state.turn_number}.\n{new_message_str}\n", 
-                                  self.filename)
+            self.trace.record("message", self.state.turn_number, sender=sender_name, text=text, time=timestamp)
 
         # Append to conversation history immediately
-        self.state.conversation += new_message_str
+        new_message_str = self.state.conversation.append(sender_name, text, self.state.turn_number, timestamp).line
 
         should_start_flow = False
 
@@ -357,10 +648,14 @@ Evaluation:\n{evaluation}
 
                 # Add the non-blocking sleep here before kicking off the main flow
                 print(f"--- DIALOGUE FLOW [{self.session_id}]: Waiting for 10 seconds before starting flow...")
-                self.socketio.sleep(10) # Use socketio.sleep for non-blocking delay
+                with span("dialogue.delay"):
+                    self.socketio.sleep(10) # Use socketio.sleep for non-blocking delay
                 print(f"--- DIALOGUE FLOW [{self.session_id}]: Starting flow after delay.")
 
-                self.kickoff()
+                self.start_turn()
+                with span("dialogue.turn") as turn_span:
+                    self.kickoff()
+                    turn_span.labels["agent"] = self.state.talker or ""
                 self.state.is_processing = False
 
                 # Send the agent's message after the flow completes, if a talker was selected
@@ -391,7 +686,7 @@ Evaluation:\n{evaluation}
             "script": self.state.script,
             "roles": self.roles,
             "current_stage_id": self.state.current_stage_id,
-            "conversation": self.state.conversation,
+            "conversation": self.state.conversation.text,
             "log_file": self.filename,
             "stage_state": self.state.stage_state if self.state.stage_state 
                                                     else 
@@ -406,7 +701,8 @@ Evaluation:\n{evaluation}
     def select_talker(self, evaluation_results, lambda_weight=0.5):
         '''
         Select the talker based on the evaluation results.
-        Only agents with action 'speak' and valid numeric scores are considered.
+        Only agents with action 'speak' and valid numeric scores are considered; an unscored entry marked 'skipped'
+        (Evaluator shortcut) is only chosen when no scored agent wants to speak.
         The selection is based on a weighted average of internal and external scores.
 
         Returns:
@@ -419,7 +715,10 @@ Evaluation:\n{evaluation}
             potential_talkers_details = []
             evaluation_results = evaluation_results or []
             for result in evaluation_results:
-                if result.get('action') == 'speak':
+                if result.get('action') == 'speak' and result.get('skipped'):
+                    # Evaluator bị bỏ qua (chỉ một ứng viên): không có điểm, xếp sau mọi ứng viên đã được chấm
+                    potential_talkers_details.append({"name": result.get('name'), "final_score": float("-inf")})
+                elif result.get('action') == 'speak':
                     agent_name = result.get('name')
                     internal_score = result.get('internal_score')
                     external_score = result.get('external_score')
@@ -2,8 +2,9 @@ import os
 from pydantic import BaseModel
 from crewai.flow import Flow, start
 from dotenv import load_dotenv
-from flow.utils.helpers import parse_yaml, save_yaml
+from flow.utils.helpers import parse_yaml, persist_yaml
 from flow.crews.scriptPlannerCrew import ScriptPlannerCrew
+from flow.utils.crew_runner import run_crew
 
 load_dotenv()
 
@@ -18,21 +19,22 @@ class ScriptGenerationFlow(Flow[ScriptGenerationState]):
         self.problem = kwargs["problem"]
         self.solution = kwargs["solution"]
         self.keywords = kwargs["keywords"]
+        self.on_progress = kwargs.get("on_progress") or (lambda step: None)
         self.script_writer = ScriptPlannerCrew(agent_name="ScriptWriter", task_name="write_script")
         self.roles_writer = ScriptPlannerCrew(agent_name="RolesWriter", task_name="write_roles")
 
     @start()
     def generate_script_and_roles(self):
-        script_writer = self.script_writer.crew()
-        roles_writer = self.roles_writer.crew()
-        script = script_writer.kickoff(inputs={
+        self.on_progress("write_script")
+        script = run_crew(self.script_writer, {
             "problem": self.problem,
             "solution": self.solution,
             "keywords": self.keywords
         })
         self.state.script = script.raw.replace("```yaml", "").replace("```", "")
-        
-        roles = roles_writer.kickoff(inputs={
+
+        self.on_progress("write_roles")
+        roles = run_crew(self.roles_writer, {
             "problem": self.problem,
             "solution": self.solution,
             "keywords": self.keywords,
@@ -42,29 +44,31 @@ class ScriptGenerationFlow(Flow[ScriptGenerationState]):
         
         return self.state.script, self.state.roles
     
-def generate_script_and_roles(folder_path: str, **kwargs: dict) -> tuple[dict, dict]:
+def generate_script_and_roles(output_dir: str = None, output_name: str = None, **kwargs: dict) -> tuple[dict, dict]:
     '''
-    Generate script and roles for the given problem and solution and save them to the given folder
+    Generate script and roles for the given problem and solution.
+    Nothing is written to shared files: the result is returned in memory, so concurrent calls are independent.
     Input:
-        folder_path: The path to the folder where the script and roles will be saved
+        output_dir (optional): Also save the script and roles in this folder, as script-<name>.yaml and
+            participants-<name>.yaml (written atomically)
+        output_name (optional): <name> of the saved files, e.g. the session id; defaults to the hash of their content
         kwargs: The keyword arguments for the ScriptGenerationFlow 
             - problem: The problem for the script generation
             - solution: The solution for the script generation
             - keywords: The keywords for the script generation
+            - on_progress (optional): Called with the name of each step ('write_script', 'write_roles') as it starts
     Output:
         script: The script for the given problem and solution
         roles: The roles for the given problem and solution
     '''
-    dynamic_script_path = f"{folder_path}/dynamic_script.yaml"
-    dynamic_participants_path = f"{folder_path}/dynamic_participants.yaml"
     scriptFlow = ScriptGenerationFlow(**kwargs)
     
     script, roles = scriptFlow.kickoff()
     script = parse_yaml(script)
     roles = parse_yaml(roles)
     
-    save_yaml(dynamic_script_path, script)
-    save_yaml(dynamic_participants_path, roles)
-
+    if output_dir:
+        persist_yaml(output_dir, "script", script, output_name)
+        persist_yaml(output_dir, "participants", roles, output_name)
 
-    return script, roles
\ No newline at end of file
+    return script, roles
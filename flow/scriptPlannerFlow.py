@@ -4,19 +4,64 @@ os.environ['CREWAI_DISABLE_TELEMETRY'] = 'true'
 os.environ['OTEL_SDK_DISABLED'] = 'true'
 os.environ['OTEL_EXPORTER_OTLP_ENDPOINT'] = ''
 
+import asyncio
+import difflib
+import json
+import time
 from pydantic import BaseModel
 from crewai.flow import Flow, start, listen
 from flow.crews.scriptPlannerCrew import ScriptPlannerCrew
+from flow.utils.crew_runner import run_crew, run_crew_async
+from flow.utils import metrics
 from dotenv import load_dotenv
-from flow.utils.helpers import parse_yaml, save_yaml
+from flow.utils.helpers import parse_yaml, persist_yaml, estimate_tokens
 import re
 load_dotenv()
 
+SEARCH_MODES = ("sequential", "beam")
+
+
+CRITERIA = ("clarity", "integrity", "depth", "practicality", "pertinence")
+
+
+def parse_overall_score(feedback_text):
+    match = re.search(r"overall_score:\s*\[?(\d+)\]?", feedback_text)
+    return int(match.group(1)) if match else 0
+
+
+def summarize_evaluation(feedback_text, max_chars=300):
+    '''Compact form of an older evaluation: overall score, score per CIDPP criterion and focus areas.'''
+    parsed = parse_yaml(feedback_text)
+    evaluation = parsed.get("evaluation") if isinstance(parsed, dict) else None
+    if not isinstance(evaluation, dict):
+        return f"overall_score: {parse_overall_score(feedback_text)}"
+    scores = ", ".join(
+        f"{name} {evaluation[name].get('score')}" for name in CRITERIA if isinstance(evaluation.get(name), dict)
+    )
+    focus_areas = str(evaluation.get("focus_areas", "")).strip()
+    if len(focus_areas) > max_chars:
+        focus_areas = focus_areas[:max_chars] + "..."
+    return f"overall_score: {evaluation.get('overall_score')} | {scores} | focus_areas: {focus_areas}"
+
+
+def script_diff(before, after, max_lines=40):
+    '''Changed lines between two versions of a script (unified diff without context), truncated to `max_lines`.'''
+    lines = [
+        line for line in difflib.unified_diff(before.splitlines(), after.splitlines(), lineterm="", n=0)
+        if not line.startswith(("---", "+++", "@@"))
+    ]
+    if len(lines) > max_lines:
+        lines = lines[:max_lines] + [f"... (+{len(lines) - max_lines} dòng thay đổi)"]
+    return "\n".join(lines) or "(không thay đổi)"
+
 class ScriptPlannerState(BaseModel):
     script: dict = {}
     roles: dict = {}
     evaluation_history: list = []
     optimization_history: list = []
+    base_script: str = ""
+    overall_score: int = 0
+    iteration_log: list[dict] = []  # thời gian và điểm của từng vòng tối ưu
 
 class ScriptPlannerFlow(Flow[ScriptPlannerState]):
     def __init__(self, **kwargs):
@@ -25,6 +70,20 @@ class ScriptPlannerFlow(Flow[ScriptPlannerState]):
         self.solution = kwargs["solution"]
         self.keywords = kwargs["keywords"]
         self.skill_tree = kwargs["skill_tree"]
+        # Search: 'sequential' = một ứng viên mỗi vòng, 'beam' = beam_width ứng viên song song, giữ ứng viên tốt nhất
+        self.search = kwargs.get("search", os.getenv("SCRIPT_PLANNER_SEARCH", "sequential")).lower()
+        if self.search not in SEARCH_MODES:
+            raise ValueError(f"Invalid search mode '{self.search}', expected one of {SEARCH_MODES}")
+        self.beam_width = int(kwargs.get("beam_width", os.getenv("SCRIPT_PLANNER_BEAM_WIDTH", 3)))
+        self.target_score = int(kwargs.get("target_score", os.getenv("SCRIPT_PLANNER_TARGET_SCORE", 90)))
+        self.max_iterations = int(kwargs.get("max_iterations", os.getenv("SCRIPT_PLANNER_MAX_ITERATIONS", 10)))
+        # Dừng sớm (beam): số vòng liên tiếp không cải thiện điểm, ngân sách thời gian (giây, 0 = không giới hạn)
+        self.plateau_patience = int(kwargs.get("plateau_patience", os.getenv("SCRIPT_PLANNER_PLATEAU_PATIENCE", 2)))
+        self.time_budget = float(kwargs.get("time_budget", os.getenv("SCRIPT_PLANNER_TIME_BUDGET", 600)))
+        # Bộ nhớ phản hồi có giới hạn: chỉ giữ nguyên văn lần đánh giá gần nhất và diff của memory_rounds lần tối ưu
+        # gần nhất, các vòng cũ hơn chỉ còn điểm số / số dòng thay đổi
+        self.memory_rounds = int(kwargs.get("memory_rounds", os.getenv("SCRIPT_PLANNER_MEMORY_ROUNDS", 2)))
+        self._round_tokens = {}
         self.script_writer = ScriptPlannerCrew(agent_name="ScriptWriter", task_name="write_script")
         self.script_evaluator = ScriptPlannerCrew(agent_name="ScriptEvaluator", task_name="evaluate_script")
         self.script_optimizer = ScriptPlannerCrew(agent_name="ScriptOptimizer", task_name="optimize_script")
@@ -33,89 +92,195 @@ class ScriptPlannerFlow(Flow[ScriptPlannerState]):
 
     @start()
     def generate_base_script(self):
-        script = self.script_writer.crew().kickoff(inputs={
+        script = run_crew(self.script_writer, {
             "problem": self.problem,
             "solution": self.solution,
             "keywords": self.keywords
         })
         self.state.script = script.raw.replace("```yaml", "").replace("```", "")
 
-    @listen(generate_base_script)
-    def optimize_script(self):
-        # Step 2: E₀ ← EVALUATOR(S, L₀) - Initial evaluation
-        current_script = self.state.script
-        print(f"----------------CURRENT SCRIPT-----------------:\n {current_script}")
-        
-        # Prepare evaluation history (empty for first evaluation)
-        previous_evaluations = "\n".join([f"Lần đánh giá {i+1}:\n{eval_text}" for i, eval_text in enumerate(self.state.evaluation_history)]) if self.state.evaluation_history else "Chưa có lần đánh giá nào trước đó."
-                
-        
-        feedback = self.script_evaluator.crew().kickoff(inputs={
+    def _previous_evaluations(self):
+        '''The last evaluation verbatim, one summary line for each older one.'''
+        history = self.state.evaluation_history
+        if not history:
+            return "Chưa có lần đánh giá nào trước đó."
+        lines = [f"Lần đánh giá {i+1}: {summarize_evaluation(eval_text)}" for i, eval_text in enumerate(history[:-1])]
+        lines.append(f"Lần đánh giá {len(history)}:\n{history[-1]}")
+        return "\n".join(lines)
+
+    def _previous_optimizations(self):
+        '''
+        What each optimization changed, as a diff against the script it started from (the current script is passed
+        verbatim as `original_script`). Only the last `memory_rounds` diffs are kept, older rounds are one line.
+        '''
+        history = self.state.optimization_history
+        if not history:
+            return "Chưa có lần tối ưu nào trước đó."
+        scripts = [self.state.base_script] + history
+        entries = []
+        for i in range(len(history)):
+            diff = script_diff(scripts[i], scripts[i + 1])
+            if i < len(history) - self.memory_rounds:
+                changed = sum(1 for line in diff.splitlines() if line.startswith(("+", "-")))
+                entries.append(f"Lần tối ưu {i+1}: thay đổi khoảng {changed} dòng.")
+            else:
+                entries.append(f"Lần tối ưu {i+1} (các dòng thay đổi):\n{diff}\n")
+        return "\n".join(entries)
+
+    def _count_prompt(self, task_name, inputs):
+        tokens = estimate_tokens(json.dumps(inputs, ensure_ascii=False, default=str))
+        self._round_tokens[task_name] = self._round_tokens.get(task_name, 0) + tokens
+        metrics.observe("script_planner_prompt_tokens", tokens, buckets=metrics.TOKEN_BUCKETS, task=task_name)
+
+    async def _evaluate(self, script):
+        '''Step E ← EVALUATOR(S, L): return (feedback_text, overall_score).'''
+        inputs = {
             "original_problem": self.problem,
             "original_solution": self.solution,
-            "original_script": current_script,
+            "original_script": script,
             "skill_tree": self.skill_tree,
-            "previous_evaluations": previous_evaluations
-        })
+            "previous_evaluations": self._previous_evaluations()
+        }
+        self._count_prompt("evaluate_script", inputs)
+        feedback = await run_crew_async(self.script_evaluator, inputs)
         feedback_text = feedback.raw.replace("```yaml", "").replace("```", "")
+        return feedback_text, parse_overall_score(feedback_text)
+
+    async def _optimize(self, script, feedback_text, candidate=0):
+        '''Step L ← OPTIMIZER(S, L, E); `candidate` tells apart the concurrent candidates of a beam.'''
+        inputs = {
+            "original_problem": self.problem,
+            "original_solution": self.solution,
+            "original_script": script,
+            "evaluator_feedback": feedback_text,
+            "previous_optimizations": self._previous_optimizations(),
+            "skill_tree": self.skill_tree
+        }
+        if candidate:
+            # Khác khóa cache/crew pool để các ứng viên được sinh độc lập
+            inputs["candidate"] = candidate
+        self._count_prompt("optimize_script", inputs)
+        optimized_result = await run_crew_async(self.script_optimizer, inputs)
+        return optimized_result.raw.replace("```yaml", "").replace("```", "")
+
+    def _log_iteration(self, iteration, started_at, scores, best_score, accepted):
+        entry = {
+            "iteration": iteration,
+            "search": self.search,
+            "seconds": round(time.perf_counter() - started_at, 3),
+            "scores": scores,
+            "best_score": best_score,
+            "accepted": accepted,
+            "prompt_tokens": self._round_tokens,  # ước lượng số token đầu vào của vòng, theo task
+        }
+        self._round_tokens = {}
+        self.state.iteration_log.append(entry)
+        metrics.observe("script_planner_iteration_seconds", entry["seconds"], search=self.search)
+        print(f"----------------ITERATION {iteration}-----------------: {entry}")
+
+    @listen(generate_base_script)
+    async def optimize_script(self):
+        # Step 2: E₀ ← EVALUATOR(S, L₀) - Initial evaluation
+        current_script = self.state.script
+        self.state.base_script = current_script
+        print(f"----------------CURRENT SCRIPT-----------------:\n {current_script}")
+        started_at = time.perf_counter()
+        feedback_text, overall_score = await self._evaluate(current_script)
         print(f"----------------FEEDBACK-----------------:\n {feedback_text}")
-        
         # Store evaluation in history
         self.state.evaluation_history.append(feedback_text)
-        
-        match = re.search(r"overall_score:\s*\[?(\d+)\]?", feedback_text)
-        overall_score = int(match.group(1)) if match and match.group(1) != "N/A" else 0
+        self._log_iteration(0, started_at, [overall_score], overall_score, True)
+
+        if self.search == "beam":
+            current_script, overall_score = await self._optimize_beam(current_script, feedback_text, overall_score)
+        else:
+            current_script, overall_score = await self._optimize_sequential(current_script, feedback_text, overall_score)
 
+        self.state.script = current_script
+        self.state.overall_score = overall_score
+
+    async def _optimize_sequential(self, current_script, feedback_text, overall_score):
         # Steps 3-4: L ← L₀, E ← E₀, while E.score < τ
         loop_count = 0
-        while overall_score < 90 and loop_count < 10:
+        while overall_score < self.target_score and loop_count < self.max_iterations:
             loop_count += 1
+            started_at = time.perf_counter()
             # Step 5: L ← OPTIMIZER(S, L, E) - với memory
-            # Prepare optimization history
-            previous_optimizations = "\n".join([f"Lần tối ưu {i+1}:\n{opt_text}\n\n" for i, opt_text in enumerate(self.state.optimization_history)]) if self.state.optimization_history else "Chưa có lần tối ưu nào trước đó."
-            
-            
-            optimized_result = self.script_optimizer.crew().kickoff(inputs={
-                "original_problem": self.problem,
-                "original_solution": self.solution,
-                "original_script": current_script,  
-                "evaluator_feedback": feedback_text,
-                "previous_optimizations": previous_optimizations,
-                "skill_tree": self.skill_tree
-            })
-            optimized_script = optimized_result.raw.replace("```yaml", "").replace("```", "")
-            
+            optimized_script = await self._optimize(current_script, feedback_text)
             # Store optimization in history (what was changed and why)
             self.state.optimization_history.append(optimized_script)
-            
             current_script = optimized_script
             print("----------------CURRENT SCRIPT-----------------:\n ", current_script)
-            
+
             # Step 6: E ← EVALUATOR(S, L) - với memory
-            previous_evaluations = "\n".join([f"Lần đánh giá {i+1}:\n{eval_text}" for i, eval_text in enumerate(self.state.evaluation_history)])
-                        
-            feedback = self.script_evaluator.crew().kickoff(inputs={
-                "original_problem": self.problem,
-                "original_solution": self.solution,
-                "original_script": current_script,
-                "skill_tree": self.skill_tree,
-                "previous_evaluations": previous_evaluations
-            })
-            feedback_text = feedback.raw.replace("```yaml", "").replace("```", "")
-            
+            feedback_text, overall_score = await self._evaluate(current_script)
             # Store evaluation in history
             self.state.evaluation_history.append(feedback_text)
-            
-            match = re.search(r"overall_score:\s*\[?(\d+)\]?", feedback_text)
-            overall_score = int(match.group(1)) if match and match.group(1) != "N/A" else 0
-            
             print("----------------FEEDBACK-----------------:\n ", feedback_text)
+            self._log_iteration(loop_count, started_at, [overall_score], overall_score, True)
+        return current_script, overall_score
 
-        self.state.script = current_script
+    async def _beam_step(self, current_script, feedback_text):
+        '''Generate `beam_width` optimized candidates concurrently, then evaluate them concurrently.'''
+        candidates = await asyncio.gather(
+            *[self._optimize(current_script, feedback_text, candidate=i + 1) for i in range(self.beam_width)],
+            return_exceptions=True
+        )
+        candidates = [candidate for candidate in candidates if isinstance(candidate, str) and candidate.strip()]
+        evaluations = await asyncio.gather(*[self._evaluate(candidate) for candidate in candidates],
+                                           return_exceptions=True)
+        return [
+            (candidate, evaluation[0], evaluation[1])
+            for candidate, evaluation in zip(candidates, evaluations)
+            if not isinstance(evaluation, BaseException)
+        ]
+
+    async def _optimize_beam(self, best_script, best_feedback, best_score):
+        '''
+        Beam search: each iteration expands the best script so far into `beam_width` candidates and keeps the best one.
+        Stops at the target score, after `max_iterations`, after `plateau_patience` iterations without improvement,
+        or when the wall-clock `time_budget` runs out (the iteration in flight is abandoned).
+        '''
+        deadline = time.perf_counter() + self.time_budget if self.time_budget > 0 else None
+        plateau = 0
+        iteration = 0
+        while best_score < self.target_score and iteration < self.max_iterations:
+            remaining = deadline - time.perf_counter() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                print("----------------BEAM: time budget exhausted-----------------")
+                metrics.inc("script_planner_early_stops_total", reason="time_budget")
+                break
+            iteration += 1
+            started_at = time.perf_counter()
+            try:
+                scored = await asyncio.wait_for(self._beam_step(best_script, best_feedback), remaining)
+            except asyncio.TimeoutError:
+                print("----------------BEAM: time budget exhausted-----------------")
+                metrics.inc("script_planner_early_stops_total", reason="time_budget")
+                self._log_iteration(iteration, started_at, [], best_score, False)
+                break
+
+            scores = [score for _, _, score in scored]
+            accepted = False
+            if scored:
+                script, feedback_text, score = max(scored, key=lambda item: item[2])
+                if score > best_score:
+                    best_script, best_feedback, best_score = script, feedback_text, score
+                    self.state.optimization_history.append(script)
+                    self.state.evaluation_history.append(feedback_text)
+                    accepted = True
+            self._log_iteration(iteration, started_at, scores, best_score, accepted)
+
+            plateau = 0 if accepted else plateau + 1
+            if plateau >= self.plateau_patience:
+                print(f"----------------BEAM: no improvement for {plateau} iterations-----------------")
+                metrics.inc("script_planner_early_stops_total", reason="plateau")
+                break
+        return best_script, best_score
 
     @listen(optimize_script)
     def annotate_script(self) -> dict:
-        annotated_script = self.script_analyst.crew().kickoff(inputs={
+        annotated_script = run_crew(self.script_analyst, {
             "optimized_script": self.state.script,
             "skill_tree": self.skill_tree
         })
@@ -135,11 +300,15 @@ class ScriptPlannerFlow(Flow[ScriptPlannerState]):
 
 
     
-def generate_script(folder_path: str, **kwargs: dict) -> dict:
-    dynamic_script_path = f"{folder_path}/dynamic_script.yaml"
+def generate_script(output_dir: str = None, output_name: str = None, **kwargs: dict) -> dict:
+    '''
+    Plan a script with ScriptPlannerFlow and return it in memory.
+    With output_dir it is also saved atomically to <output_dir>/script-<output_name or content hash>.yaml.
+    '''
     scriptFlow = ScriptPlannerFlow(**kwargs)
     script = scriptFlow.kickoff()
-    save_yaml(dynamic_script_path, script)
+    if output_dir:
+        persist_yaml(output_dir, "script", script, output_name)
 
     return script
 
@@ -172,7 +341,7 @@ if __name__ == "__main__":
         **Kết Luận:**
         Hàm số đồng biến trên khoảng $(-\infty; -1)$ và trên khoảng $(-1; +\infty)$.
     """
-    script = generate_script(folder_path="test/scripts", 
+    script = generate_script(output_dir="test/scripts", 
                              problem=problem,
                              solution=solution,
                              keywords="",
@@ -0,0 +1,125 @@
+import copy
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import yaml
+
+from flow.utils import metrics
+
+# LibYAML (C) khi có, nhanh hơn ~15 lần so với loader thuần Python
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def safe_load(text):
+    return yaml.load(text, Loader=YAML_LOADER)
+
+
+def parse_yaml_text(yaml_string):
+    '''YAML (optionally wrapped in a ```yaml fence) to Python objects; {} when it is not valid YAML.'''
+    try:
+        return safe_load(yaml_string.replace("```yaml", "").replace("```", ""))
+    except yaml.YAMLError as e:
+        print(f"Error parsing YAML: {e}")
+        return {}
+
+
+def freeze(value):
+    '''Read-only view of parsed YAML: dicts become MappingProxyType, lists become tuples.'''
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ConfigCache:
+    '''
+    Process-wide cache of parsed YAML config files keyed by (path, mtime, size).
+    A file is parsed again only when it changed on disk or after reload(). Callers get either a shared immutable
+    view (get) or their own mutable copy (get_copy); the cached objects themselves are never handed out.
+    '''
+
+    def __init__(self):
+        self._entries = {}  # realpath -> (mtime_ns, size, data, frozen view or None)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "parse_seconds": 0.0}
+
+    def _entry(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == signature:
+                self._stats["hits"] += 1
+                metrics.inc("config_cache_lookups_total", hit=True)
+                return path, entry
+            if entry is not None:
+                self._stats["reloads"] += 1
+        started_at = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            data = parse_yaml_text(f.read())
+        elapsed = time.perf_counter() - started_at
+        entry = (*signature, data, None)
+        with self._lock:
+            self._entries[path] = entry
+            self._stats["misses"] += 1
+            self._stats["parse_seconds"] += elapsed
+        metrics.inc("config_cache_lookups_total", hit=False)
+        return path, entry
+
+    def get(self, path):
+        '''Immutable view of the parsed file, shared by all callers.'''
+        path, entry = self._entry(path)
+        if entry[3] is None:
+            entry = (*entry[:3], freeze(entry[2]))
+            with self._lock:
+                if self._entries.get(path, entry)[:2] == entry[:2]:
+                    self._entries[path] = entry
+        return entry[3]
+
+    def get_copy(self, path):
+        '''A fresh mutable copy of the parsed file (for callers that modify it, e.g. CrewAI).'''
+        return copy.deepcopy(self._entry(path)[1][2])
+
+    def reload(self, path=None):
+        '''Drop one file (or every file) so it is parsed again on the next access.'''
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.realpath(path), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "files": len(self._entries),
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_config_cache():
+    '''Process-wide config cache.'''
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ConfigCache()
+    return _cache
+
+
+def cached_crew_config(crew_class):
+    '''
+    Class decorator for @CrewBase crews: CrewAI reads agents/tasks YAML through `load_yaml` on every crew
+    construction; serve it from the config cache instead (a copy, since CrewAI fills in agents and tools in place).
+    '''
+    crew_class.load_yaml = staticmethod(lambda config_path: get_config_cache().get_copy(str(config_path)))
+    return crew_class
@@ -0,0 +1,137 @@
+import io
+import re
+import time as _time
+
+# Đầu một tin nhắn: "TIME=... | CON#n | SENDER=... | TEXT=" ở đầu dòng; các dòng khác thuộc về TEXT của tin nhắn trước
+_HEADER_RE = re.compile(r"^TIME=([0-9.]+) \| CON#(\d+) \| SENDER=([^|\n]*) \| TEXT=", re.MULTILINE)
+
+
+class TurnRecord:
+    '''One message of the conversation; `line` is its text form as it appears in prompts and in the database.'''
+
+    __slots__ = ("time", "turn", "sender", "text", "line")
+
+    def __init__(self, time, turn, sender, text, line=None):
+        self.time = time
+        self.turn = turn
+        self.sender = sender
+        self.text = text
+        self.line = line if line is not None else f"TIME={time} | CON#{turn} | SENDER={sender} | TEXT={text}\n"
+
+    def __repr__(self):
+        return f"TurnRecord(turn={self.turn}, sender={self.sender!r}, text={self.text[:40]!r})"
+
+
+class Conversation:
+    '''
+    The conversation of a session as a list of TurnRecords plus its rendered text.
+
+    append() is O(1): each record keeps its rendered line, which is also written to a text buffer, so the full text
+    is never re-joined from the records; `text` (and str()) reads the buffer at most once per change. tail(n) renders
+    the last n messages without touching the rest. parse() reads the stored text format back in one pass,
+    multi-line messages included.
+    '''
+
+    def __init__(self, records=(), preamble=""):
+        self.preamble = preamble  # văn bản trước tin nhắn đầu tiên (nếu có), giữ nguyên khi render
+        self._records = []
+        self._buffer = io.StringIO()
+        self._buffer.write(preamble)
+        self._text = preamble
+        self._stale = False
+        for record in records:
+            self.add(record)
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        Records of a conversation stored in the TIME=... | CON#... | SENDER=... | TEXT=... format.
+        A Conversation is copied, so the parsed state never shares records with the caller.
+        '''
+        if isinstance(text, Conversation):
+            return text.copy()
+        text = text or ""
+        matches = list(_HEADER_RE.finditer(text))
+        conversation = cls(preamble=text[:matches[0].start()] if matches else text)
+        for index, match in enumerate(matches):
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+            message = text[match.end():end]
+            conversation.add(TurnRecord(
+                float(match.group(1)), int(match.group(2)), match.group(3).strip(),
+                message[:-1] if message.endswith("\n") else message,
+                line=text[match.start():end]
+            ))
+        # Các dòng ghép lại đúng bằng `text`: dùng luôn chuỗi gốc thay vì đọc lại buffer
+        conversation._text = text
+        conversation._stale = False
+        return conversation
+
+    def copy(self):
+        return Conversation(
+            [TurnRecord(record.time, record.turn, record.sender, record.text, record.line) for record in self._records],
+            preamble=self.preamble,
+        )
+
+    def add(self, record):
+        # Tin nhắn cuối (hoặc phần mở đầu) được lưu không có xuống dòng: tách nó khỏi tin nhắn mới
+        if self._records and not self._records[-1].line.endswith("\n"):
+            self._records[-1].line += "\n"
+            self._buffer.write("\n")
+        elif not self._records and self.preamble and not self.preamble.endswith("\n"):
+            self.preamble += "\n"
+            self._buffer.write("\n")
+        self._records.append(record)
+        self._buffer.write(record.line)
+        self._stale = True
+        return record
+
+    def append(self, sender, text, turn, time=None):
+        '''Add a message and return its record.'''
+        return self.add(TurnRecord(_time.time() if time is None else time, turn, sender, text))
+
+    @property
+    def text(self):
+        '''The whole conversation in the stored text format (what the prompts receive).'''
+        if self._stale:
+            self._text = self._buffer.getvalue()
+            self._stale = False
+        return self._text
+
+    def tail(self, count):
+        '''Text of the last `count` messages.'''
+        if count <= 0:
+            return ""
+        return "".join(record.line for record in self._records[-count:])
+
+    @property
+    def records(self):
+        return self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __str__(self):
+        return self.text
+
+    def __eq__(self, other):
+        if isinstance(other, Conversation):
+            return self.text == other.text
+        if isinstance(other, str):
+            return self.text == other
+        return NotImplemented
+
+    __hash__ = None
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        '''Pydantic state fields accept the stored text or a Conversation and serialize back to the text.'''
+        from pydantic_core import core_schema
+        return core_schema.no_info_plain_validator_function(
+            cls.parse, serialization=core_schema.plain_serializer_function_ser_schema(str)
+        )
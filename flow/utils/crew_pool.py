@@ -0,0 +1,193 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+
+load_dotenv()
+
+
+def agent_config(crew_base):
+    '''The config of a crew's agent: the session roles it was given (Participant) first, then its agents_config
+    (base_participants.yaml for participants, meta_agents.yaml for the meta crews).'''
+    roles = getattr(crew_base, "roles", None) or {}
+    if crew_base.agent_name in roles:
+        return roles[crew_base.agent_name]
+    agents_config = crew_base.agents_config if isinstance(crew_base.agents_config, dict) else {}
+    return agents_config.get(crew_base.agent_name)
+
+
+def config_version(crew_base):
+    '''
+    Hash of the agent and task config a crew was compiled from, computed once per crew instance.
+    A session with other roles gets a new version, hence new crews.
+    '''
+    version = getattr(crew_base, "_crew_config_version", None)
+    if version is None:
+        tasks_config = crew_base.tasks_config if isinstance(crew_base.tasks_config, dict) else {}
+        payload = json.dumps(
+            [agent_config(crew_base), tasks_config.get(crew_base.task_name)],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        version = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        crew_base._crew_config_version = version
+    return version
+
+
+def crew_usage(crew):
+    '''Cumulative token usage of a crew's agents, None when CrewAI does not expose it.'''
+    calculate = getattr(crew, "calculate_usage_metrics", None)
+    return calculate() if calculate else None
+
+
+def usage_delta(after, before):
+    '''Token usage of one kickoff on a reused crew (CrewAI accumulates usage on the agents across kickoffs).'''
+    if after is None or before is None:
+        return after
+    return after.model_copy(update={
+        field: getattr(after, field) - getattr(before, field)
+        for field in type(after).model_fields
+        if isinstance(getattr(after, field), (int, float))
+    })
+
+
+def set_model(crew, model):
+    '''
+    Point every agent of a (copied) crew at `model`, e.g. the tier model chosen by the model router.
+    The agent's LLM is copied with only the model changed, so temperature, base_url, api keys... are kept.
+    '''
+    from crewai import LLM
+
+    for crew_agent in crew.agents:
+        llm = crew_agent.llm
+        if isinstance(llm, LLM):
+            # Bản sao nông: các crew khác dùng chung LLM của template vẫn giữ model cũ
+            llm = copy.copy(llm)
+            llm.model = model
+        else:
+            llm = LLM(model=model)
+        crew_agent.llm = llm
+
+
+class CrewPool:
+    '''
+    Compiled Crew objects (agents, tasks, LLM clients) reused across turns instead of rebuilt per call.
+    Crews are keyed by (session, crew class, agent, task, config version, model); only the inputs change per kickoff.
+    Each key keeps a pristine template crew that is never kicked off (a kicked-off crew holds interpolated
+    task descriptions, so it cannot be copied); leased crews are copies of it, and a key whose crews are all
+    busy (parallel thinkers, hedged requests) gets one more copy.
+    Crews whose kickoff failed or was cancelled are dropped, since the kickoff thread may still be running.
+    '''
+
+    def __init__(self, max_keys=512):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {"template": Crew, "idle": [Crew], "busy": int}
+
+    @staticmethod
+    def key(crew_base, session_id="", model=None):
+        return (session_id or "", type(crew_base).__name__, crew_base.agent_name, crew_base.task_name,
+                config_version(crew_base), model)
+
+    def _checkout(self, crew_base, key, model):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry["idle"]:
+                    entry["busy"] += 1
+                    metrics.inc("crew_pool_hits_total", task=crew_base.task_name)
+                    return entry["idle"].pop()
+            template = entry["template"] if entry is not None else None
+
+        # Dựng crew ngoài lock: đọc config, tạo Agent/Task/LLM có thể mất vài chục ms
+        if template is None:
+            template = crew_base.crew()
+            metrics.inc("crew_pool_misses_total", task=crew_base.task_name)
+        else:
+            metrics.inc("crew_pool_copies_total", task=crew_base.task_name)
+        crew = template.copy()
+        if model:
+            set_model(crew, model)
+
+        with self._lock:
+            entry = self._entries.setdefault(key, {"template": template, "idle": [], "busy": 0})
+            entry["busy"] += 1
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        return crew
+
+    def _checkin(self, key, crew, healthy):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["busy"] -= 1
+            if healthy:
+                entry["idle"].append(crew)
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_keys:
+            key, entry = next(iter(self._entries.items()))
+            if entry["busy"]:
+                break
+            del self._entries[key]
+
+    @contextmanager
+    def lease(self, crew_base, session_id="", model=None):
+        '''
+        Borrow a compiled crew for one kickoff (a fresh one when the pool is disabled),
+        running on `model` instead of the agent's configured `llm` when given.
+        '''
+        if self.max_keys <= 0:
+            crew = crew_base.crew()
+            if model:
+                crew = crew.copy()
+                set_model(crew, model)
+            yield crew
+            return
+        key = self.key(crew_base, session_id, model)
+        crew = self._checkout(crew_base, key, model)
+        healthy = False
+        try:
+            yield crew
+            healthy = True
+        finally:
+            self._checkin(key, crew, healthy)
+
+    def evict_session(self, session_id):
+        '''Drop the crews of a finished session.'''
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "idle": sum(len(entry["idle"]) for entry in self._entries.values()),
+                "busy": sum(entry["busy"] for entry in self._entries.values()),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_crew_pool():
+    '''
+    Process-wide crew pool configured from the environment:
+        CREW_POOL_MAX_KEYS  số (session, crew, config) được giữ tối đa (mặc định: 512, 0 = tắt pool)
+    '''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CrewPool(max_keys=int(os.getenv("CREW_POOL_MAX_KEYS", 512)))
+    return _pool
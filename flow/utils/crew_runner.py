@@ -0,0 +1,254 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from flow.crews.schemas import TASK_SCHEMAS
+from flow.utils import metrics
+from flow.utils.crew_pool import agent_config as crew_agent_config, crew_usage, get_crew_pool, usage_delta
+from flow.utils.fake_llm import get_fake_llm, use_fake_llm
+from flow.utils.helpers import estimate_tokens
+from flow.utils.llm_cache import CacheMiss, CachedOutput, LLMResponseCache, get_llm_cache
+from flow.utils.llm_scheduler import get_scheduler, priority_for_task
+from flow.utils.model_router import get_model_router
+from flow.utils.resilience import DeadlineExceeded, get_call_policy
+from flow.utils.structured_output import OutputValidationError, parse_structured
+
+# Phần token dự trù cho câu trả lời khi ước lượng trước một request
+COMPLETION_TOKEN_ALLOWANCE = 512
+
+# Thread chạy crew.kickoff cho các lời gọi async; số thread thực sự bận bị giới hạn bởi scheduler
+_kickoff_executor = ThreadPoolExecutor(thread_name_prefix="crew-kickoff")
+
+
+def describe_crew(crew_base):
+    '''
+    Return (agent_name, task_name, agent_config, task_config, model) for a crew class instance
+    (Participant, Evaluator, StageManager, ScriptPlannerCrew). `model` is the primary model of the task's tier
+    when the model router assigns one, otherwise the agent's `llm`.
+    '''
+    agent_name = crew_base.agent_name
+    task_name = crew_base.task_name
+    tasks_config = crew_base.tasks_config if isinstance(crew_base.tasks_config, dict) else {}
+    agent_config = crew_agent_config(crew_base) or {}
+    task_config = tasks_config.get(task_name, {})
+    model = agent_config.get("llm") if isinstance(agent_config, dict) else None
+    tier = route(crew_base)
+    if tier is not None:
+        model = tier.models[0]
+    return agent_name, task_name, agent_config, task_config, model
+
+
+def route(crew_base):
+    '''
+    The model tier of a crew's task. A Participant whose persona (session role) sets its own `llm` keeps that model;
+    the meta crews share the `llm` of meta_agents.yaml, so the router decides for them.
+    '''
+    persona = (getattr(crew_base, "roles", None) or {}).get(crew_base.agent_name)
+    persona_llm = persona.get("llm") if isinstance(persona, dict) else None
+    return get_model_router().tier_for(crew_base.task_name, persona_llm)
+
+
+def output_tokens(result, inputs=None):
+    '''
+    Total tokens spent on a crew result: the reported usage when available,
+    otherwise an estimate from the inputs and the raw output. Cached results cost nothing.
+    '''
+    if getattr(result, "cached", False):
+        return 0
+    usage = getattr(result, "token_usage", None)
+    total = getattr(usage, "total_tokens", None)
+    if total:
+        return total
+    prompt = json.dumps(inputs, ensure_ascii=False, default=str) if inputs else ""
+    return estimate_tokens(prompt) + estimate_tokens(getattr(result, "raw", ""))
+
+
+def _record_usage(crew_base, inputs, result):
+    cached = getattr(result, "cached", False)
+    metrics.inc("llm_requests_total", task=crew_base.task_name, cached=cached)
+    metrics.inc("llm_tokens_total", output_tokens(result, inputs), task=crew_base.task_name)
+
+
+def estimate_request_tokens(crew_base, inputs):
+    '''Rough token cost of a kickoff before it runs: prompt (task template + inputs) plus a completion allowance.'''
+    _, _, agent_config, task_config, _ = describe_crew(crew_base)
+    prompt = json.dumps([agent_config, task_config, inputs], ensure_ascii=False, default=str)
+    return estimate_tokens(prompt) + COMPLETION_TOKEN_ALLOWANCE
+
+
+def _kickoff(crew_base, inputs, session_id, model=None):
+    with get_crew_pool().lease(crew_base, session_id, model) as crew:
+        before = crew_usage(crew)
+        result = crew.kickoff(inputs=inputs)
+    result.token_usage = usage_delta(result.token_usage, before)
+    return result
+
+
+async def _kickoff_async(crew_base, inputs, session_id, model=None, slots=()):
+    '''
+    Kickoff in a worker thread (what crew.kickoff_async does). Cancelling the await does not stop the thread,
+    so its Future is handed to the scheduler `slots`, which stay taken until the orphaned kickoff finishes.
+    '''
+    # Request hedge chạy song song với request gốc: pool cấp một bản sao riêng khi crew đang bận
+    with get_crew_pool().lease(crew_base, session_id, model) as crew:
+        before = crew_usage(crew)
+        future = _kickoff_executor.submit(crew.kickoff, inputs=inputs)
+        for usage in slots:
+            usage["hold"] = future
+        result = await asyncio.wrap_future(future)
+    result.token_usage = usage_delta(result.token_usage, before)
+    return result
+
+
+def _tier_slot(tier, priority, session_id, is_async=False):
+    if tier is None:
+        return nullcontext({})
+    return tier.limiter.slot_async(priority, session_id) if is_async else tier.limiter.slot(priority, session_id)
+
+
+def _record_tier(tier, model, started_at, output):
+    if tier is not None:
+        tier.record(model, time.perf_counter() - started_at, getattr(output, "token_usage", None))
+
+
+def _fallback(crew_base, models, index, error):
+    '''True when the next model of the tier should be tried after `error`.'''
+    if index == len(models) - 1 or isinstance(error, (DeadlineExceeded, CacheMiss)):
+        return False
+    print(f"Model {models[index]} failed on '{crew_base.task_name}', falling back to {models[index + 1]}: {error}")
+    metrics.inc("llm_fallbacks_total", task=crew_base.task_name, model=models[index])
+    return True
+
+
+def _cache_key(crew_base, inputs):
+    agent_name, task_name, agent_config, task_config, model = describe_crew(crew_base)
+    key = LLMResponseCache.make_key(agent_config, task_name, task_config, inputs, model)
+    return key, {"agent_name": agent_name, "task_name": task_name, "model": model}
+
+
+def _lookup(cache, key, metadata):
+    raw = cache.get(key)
+    if raw is not None:
+        return CachedOutput(raw)
+    if cache.mode == "replay":
+        raise CacheMiss(f"No recorded response for {metadata['agent_name']}/{metadata['task_name']} ({key[:12]})")
+    return None
+
+
+def run_crew(crew_base, inputs, session_id=""):
+    '''
+    Kickoff the crew of `crew_base` with `inputs`, going through the LLM response cache
+    and, on a miss, the process-wide LLM scheduler (priority from the task, fairness by `session_id`).
+    Transient provider errors are retried with backoff.
+    Returns the CrewOutput (or a CachedOutput exposing the same `.raw`).
+    '''
+    cache = get_llm_cache()
+    result = None
+    if cache.enabled:
+        key, metadata = _cache_key(crew_base, inputs)
+        result = _lookup(cache, key, metadata)
+    if result is None:
+        priority = priority_for_task(crew_base.task_name)
+        estimated_tokens = estimate_request_tokens(crew_base, inputs)
+        tier = route(crew_base)
+        models = tier.models if tier is not None else [None]
+
+        for index, model in enumerate(models):
+            def call():
+                with _tier_slot(tier, priority, session_id), \
+                        get_scheduler().slot(priority, session_id, estimated_tokens) as usage:
+                    started_at = time.perf_counter()
+                    if use_fake_llm():
+                        output = get_fake_llm().complete(crew_base.agent_name, crew_base.task_name, inputs)
+                    else:
+                        output = _kickoff(crew_base, inputs, session_id, model)
+                    _record_tier(tier, model, started_at, output)
+                    usage["tokens"] = output_tokens(output, inputs)
+                    return output
+
+            try:
+                result = get_call_policy().run_sync(crew_base.task_name, call)
+                break
+            except Exception as e:
+                if not _fallback(crew_base, models, index, e):
+                    raise
+        if cache.enabled:
+            cache.put(key, result.raw, **metadata)
+    _record_usage(crew_base, inputs, result)
+    return result
+
+
+async def run_crew_async(crew_base, inputs, session_id="", refresh=False):
+    '''
+    Async counterpart of `run_crew`, used for the parallel thinker fan-out.
+    The call is bounded by the deadline of its task and may be retried or hedged (see resilience.CallPolicy).
+    `refresh=True` skips the cache lookup (the new response still replaces the cached one).
+    '''
+    cache = get_llm_cache()
+    result = None
+    if cache.enabled:
+        key, metadata = _cache_key(crew_base, inputs)
+        if not refresh or cache.mode == "replay":
+            result = _lookup(cache, key, metadata)
+    if result is None:
+        priority = priority_for_task(crew_base.task_name)
+        estimated_tokens = estimate_request_tokens(crew_base, inputs)
+        tier = route(crew_base)
+        models = tier.models if tier is not None else [None]
+
+        for index, model in enumerate(models):
+            async def attempt(duplicate, model=model):
+                async with _tier_slot(tier, priority, session_id, is_async=True) as tier_usage, \
+                        get_scheduler().slot_async(priority, session_id, estimated_tokens) as usage:
+                    started_at = time.perf_counter()
+                    if use_fake_llm():
+                        output = await get_fake_llm().complete_async(crew_base.agent_name, crew_base.task_name, inputs)
+                    else:
+                        output = await _kickoff_async(crew_base, inputs, session_id, model, (usage, tier_usage))
+                    _record_tier(tier, model, started_at, output)
+                    usage["tokens"] = output_tokens(output, inputs)
+                    return output
+
+            try:
+                result = await get_call_policy().run(crew_base.task_name, attempt)
+                break
+            except Exception as e:
+                if not _fallback(crew_base, models, index, e):
+                    raise
+        if cache.enabled:
+            cache.put(key, result.raw, **metadata)
+    _record_usage(crew_base, inputs, result)
+    return result
+
+
+async def run_structured_async(crew_base, inputs, session_id=""):
+    '''
+    Run a crew whose task has an output schema (flow.crews.schemas.TASK_SCHEMAS) and return (result, parsed).
+    An output that fails validation is re-asked once, bypassing the cache; if the second answer is invalid too,
+    the turn is counted as wasted and OutputValidationError is raised.
+    '''
+    task_name = crew_base.task_name
+    schema = TASK_SCHEMAS[task_name]
+    wasted_tokens = 0
+    for attempt in range(2):
+        result = await run_crew_async(crew_base, inputs, session_id, refresh=attempt > 0)
+        try:
+            parsed = parse_structured(result.raw, schema, getattr(result, "pydantic", None))
+        except ValueError as e:
+            metrics.inc("llm_structured_outputs_total", task=task_name, valid=False)
+            wasted_tokens += output_tokens(result, inputs)
+            error = e
+            if attempt == 0:
+                print(f"Invalid '{task_name}' output, asking again: {e}")
+                metrics.inc("llm_reasks_total", task=task_name)
+            continue
+        metrics.inc("llm_structured_outputs_total", task=task_name, valid=True)
+        if wasted_tokens:
+            metrics.inc("llm_reask_tokens_total", wasted_tokens, task=task_name)
+        return result, parsed
+
+    metrics.inc("llm_wasted_turns_total", task=task_name)
+    metrics.inc("llm_wasted_tokens_total", wasted_tokens, task=task_name)
+    raise OutputValidationError(f"'{task_name}' output does not match its schema: {error}")
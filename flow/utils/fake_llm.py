@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import yaml
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+from flow.utils.helpers import estimate_tokens
+
+load_dotenv()
+
+PROVIDERS = ("live", "fake")
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "crews", "config")
+
+_TASK_ID_RE = re.compile(r'\b\d+(?:\.\d+)+\b')
+_CON_ID_RE = re.compile(r'CON#\d+')
+
+
+class FakeProviderError(RuntimeError):
+    '''Error injected by the fake provider; it carries a 429 status code like a provider rate limit, so it is retried.'''
+
+    status_code = 429
+
+
+class FakeOutput:
+    '''Same surface as a CrewOutput for the code in crew_runner and the flows.'''
+    __slots__ = ("raw", "token_usage", "pydantic")
+    cached = False
+
+    def __init__(self, raw, total_tokens):
+        self.raw = raw
+        self.token_usage = SimpleNamespace(total_tokens=total_tokens)
+        self.pydantic = None
+
+
+def _load_template(filename):
+    with open(os.path.join(CONFIG_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class FakeLLM:
+    '''
+    Deterministic local provider used instead of the real LLMs (LLM_PROVIDER=fake).
+    - Outputs: canned/templated, schema-valid answers for every task in tasks.yaml, derived
+      from a hash of (seed, agent, task, inputs) so the same call always gets the same answer.
+    - Latency: log-normal time to first token plus streaming at `tokens_per_second`.
+    - Errors: injected transient failures (`error_rate`) and malformed outputs (`malformed_rate`).
+    '''
+
+    def __init__(self, seed=0, latency_ms=800.0, latency_sigma=0.5, tokens_per_second=60.0,
+                 error_rate=0.0, malformed_rate=0.0):
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        # Độ trễ và lỗi lấy từ một dãy ngẫu nhiên riêng, tất định theo seed và thứ tự gọi
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._script_template = _load_template("base_script.yaml")
+        self._roles_template = _load_template("base_participants.yaml")
+
+    # --- Nội dung -----------------------------------------------------------------
+
+    def _content_rng(self, agent_name, task_name, inputs):
+        payload = json.dumps([self.seed, agent_name, task_name, inputs], sort_keys=True, ensure_ascii=False, default=str)
+        return random.Random(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+    def respond(self, agent_name, task_name, inputs):
+        '''Return the raw text answer of `agent_name` for `task_name` with `inputs`; KeyError for an unknown task.'''
+        builder = getattr(self, f"_{task_name}", None)
+        if builder is None:
+            # Task mới trong tasks.yaml cần một câu trả lời giả lập riêng, không trả về nội dung vô nghĩa
+            raise KeyError(task_name)
+        return builder(self._content_rng(agent_name, task_name, inputs), agent_name, inputs)
+
+    def _thought(self, rng, agent_name, inputs):
+        stimuli = _CON_ID_RE.findall(str(inputs.get("conversation", "")))[-2:]
+        action = rng.choice(["speak", "listen"])
+        thought = (f"{agent_name} thấy nhóm đang ở bước này, mình muốn góp ý về nhiệm vụ hiện tại."
+                   if action == "speak" else f"{agent_name} muốn nghe thêm ý kiến của các bạn trước.")
+        return {"stimuli": stimuli, "thought": thought, "action": action}
+
+    def _think(self, rng, agent_name, inputs):
+        return json.dumps(self._thought(rng, agent_name, inputs), ensure_ascii=False)
+
+    def _think_batch(self, rng, agent_name, inputs):
+        return json.dumps(
+            [{"agent": name, **self._thought(rng, name, inputs)} for name in inputs.get("participants", [])],
+            ensure_ascii=False
+        )
+
+    def _evaluate(self, rng, agent_name, inputs):
+        try:
+            thoughts = json.loads(inputs.get("thoughts", "[]"))
+        except (TypeError, ValueError):
+            thoughts = []
+        evaluations = []
+        for item in thoughts:
+            try:
+                action = json.loads(item["inner_thought"]).get("action", "listen")
+            except (TypeError, ValueError, KeyError, AttributeError):
+                action = "listen"
+            evaluations.append({
+                "name": item.get("agent", ""),
+                "action": action,
+                "score": "Đánh giá giả lập.",
+                "internal_score": round(rng.uniform(1.0, 5.0), 1),
+                "external_score": round(rng.uniform(1.0, 5.0), 1),
+            })
+        return json.dumps(evaluations, ensure_ascii=False)
+
+    def _talk(self, rng, agent_name, inputs):
+        try:
+            thought = json.loads(inputs.get("thought", "{}")).get("thought", "")
+        except (TypeError, ValueError, AttributeError):
+            thought = ""
+        opener = rng.choice(["Mình nghĩ", "Theo mình", "Các bạn ơi,"])
+        return json.dumps({"spoken_message": f"{opener} {thought or 'chúng ta làm tiếp bước này nhé.'}"},
+                          ensure_ascii=False)
+
+    def _manage_stage(self, rng, agent_name, inputs):
+        task_ids = list(dict.fromkeys(_TASK_ID_RE.findall(str(inputs.get("current_stage_description", "")))))
+        completed = task_ids[:rng.randint(0, len(task_ids))]
+        signal = ["3", "Chuyển stage mới"] if task_ids and len(completed) == len(task_ids) else ["2", "Tiếp tục"]
+        return json.dumps({
+            "explain": "Trạng thái giả lập của nhóm.",
+            "signal": signal,
+            "completed_task_ids": completed,
+        }, ensure_ascii=False)
+
+    def _write_script(self, rng, agent_name, inputs):
+        return f"```yaml\n{self._script_template}\n```"
+
+    _optimize_script = _write_script
+
+    def _evaluate_script(self, rng, agent_name, inputs):
+        # Điểm tăng dần theo số lần đánh giá trước đó để vòng tối ưu luôn dừng
+        rounds = str(inputs.get("previous_evaluations", "")).count("Lần đánh giá")
+        overall = min(95, 70 + 10 * rounds + rng.randint(0, 5))
+        criteria = {
+            name: {"score": overall, "comment": "Nhận xét giả lập.", "improvement": "Lần đánh giá giả lập"}
+            for name in ("clarity", "integrity", "depth", "practicality", "pertinence")
+        }
+        evaluation = {"evaluation": {
+            **criteria,
+            "overall_score": overall,
+            "progress_summary": "Tiến độ giả lập.",
+            "advantages": ["Cấu trúc rõ ràng."],
+            "disadvantages": ["Chưa có."],
+            "focus_areas": "Không có.",
+        }}
+        return f"```yaml\n{yaml.dump(evaluation, allow_unicode=True, sort_keys=False)}```"
+
+    def _annotate_script(self, rng, agent_name, inputs):
+        task_ids = dict.fromkeys(re.findall(r'id:\s*"?(\d+(?:\.\d+)+)"?', str(inputs.get("optimized_script", ""))))
+        notes = {"AnalystNotes": {
+            task_id: {"pitfall": "Lỗi giả lập.", "tip": "Mẹo giả lập."} for task_id in task_ids
+        }}
+        return f"```yaml\n{yaml.dump(notes, allow_unicode=True, sort_keys=False)}```"
+
+    def _write_roles(self, rng, agent_name, inputs):
+        return f"```yaml\n{self._roles_template}\n```"
+
+    def sdk_turn(self, prompt, participants):
+        '''Final answer of a Claude SDK turn (AgentTurn schema) choosing one of `participants` for the given prompt.'''
+        if not participants:
+            raise ValueError("sdk_turn needs at least one participant")
+        rng = self._content_rng("sdk", "sdk_turn", prompt)
+        selected = rng.choice(list(participants))
+        return json.dumps({
+            "selected_agent": selected,
+            "response": f"Mình là {selected}, mình nghĩ chúng ta nên đọc kỹ lại đề bài.",
+            "reasoning": "Lựa chọn giả lập.",
+        }, ensure_ascii=False)
+
+    # --- Độ trễ, streaming và lỗi -------------------------------------------------------
+
+    def _plan(self):
+        '''Draw (time to first token, failure kind) for one call; chunk pacing comes from `_chunk_delay`.'''
+        with self._lock:
+            ttft = self._rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000.0
+            roll = self._rng.random()
+        failure = None
+        if roll < self.error_rate:
+            failure = "error"
+        elif roll < self.error_rate + self.malformed_rate:
+            failure = "malformed"
+        return ttft, failure
+
+    def chunks(self, text, size=16):
+        '''Split `text` into stream chunks of about `size` characters.'''
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def _chunk_delay(self, chunk):
+        return estimate_tokens(chunk) / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _finish(self, task_name, text, failure):
+        if failure == "error":
+            metrics.inc("fake_llm_injected_errors_total", task=task_name)
+            raise FakeProviderError(f"429 rate limit exceeded (injected by fake provider for '{task_name}')")
+        if failure == "malformed":
+            metrics.inc("fake_llm_malformed_outputs_total", task=task_name)
+            return text[: max(1, len(text) // 2)]
+        return text
+
+    def complete(self, agent_name, task_name, inputs):
+        '''Blocking call: sleep through the simulated latency and stream, then return a FakeOutput.'''
+        text = self.respond(agent_name, task_name, inputs)
+        ttft, failure = self._plan()
+        time.sleep(ttft)
+        for chunk in self.chunks(text):
+            time.sleep(self._chunk_delay(chunk))
+        text = self._finish(task_name, text, failure)
+        return FakeOutput(text, estimate_tokens(json.dumps(inputs, ensure_ascii=False, default=str)) + estimate_tokens(text))
+
+    async def complete_async(self, agent_name, task_name, inputs):
+        text = self.respond(agent_name, task_name, inputs)
+        ttft, failure = self._plan()
+        await asyncio.sleep(ttft)
+        for chunk in self.chunks(text):
+            await asyncio.sleep(self._chunk_delay(chunk))
+        text = self._finish(task_name, text, failure)
+        return FakeOutput(text, estimate_tokens(json.dumps(inputs, ensure_ascii=False, default=str)) + estimate_tokens(text))
+
+    async def stream(self, task_name, text):
+        '''Async iterator over the chunks of `text`, paced like a streaming provider.'''
+        ttft, failure = self._plan()
+        await asyncio.sleep(ttft)
+        text = self._finish(task_name, text, failure)
+        for chunk in self.chunks(text):
+            await asyncio.sleep(self._chunk_delay(chunk))
+            yield chunk
+
+
+class FakeClaudeSDKClient:
+    '''
+    Drop-in replacement for claude_agent_sdk.ClaudeSDKClient backed by FakeLLM:
+    `query()` then `receive_response()` yields messages whose content blocks carry the streamed text.
+    `participants` are the agents a turn may select.
+    '''
+
+    def __init__(self, options=None, llm=None, participants=()):
+        self.options = options
+        self.llm = llm or get_fake_llm()
+        self.participants = list(participants)
+        self._prompt = None
+        self._turn_prompt = ""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    async def query(self, prompt):
+        # Câu hỏi lại (re-ask) được trả lời dựa trên prompt của lượt ban đầu
+        if not self._turn_prompt:
+            self._turn_prompt = prompt
+        self._prompt = prompt
+
+    async def receive_response(self):
+        text = self.llm.sdk_turn(self._turn_prompt, self.participants)
+        async for chunk in self.llm.stream("sdk_turn", text):
+            yield SimpleNamespace(content=[SimpleNamespace(text=chunk)])
+
+
+def get_provider():
+    '''Selected LLM provider: LLM_PROVIDER=live (default) or fake.'''
+    provider = os.getenv("LLM_PROVIDER", "live").lower()
+    if provider not in PROVIDERS:
+        raise ValueError(f"Invalid LLM_PROVIDER '{provider}', expected one of {PROVIDERS}")
+    return provider
+
+
+def use_fake_llm():
+    return get_provider() == "fake"
+
+
+_fake_llm = None
+_fake_llm_lock = threading.Lock()
+
+
+def get_fake_llm():
+    '''
+    Process-wide fake provider configured from the environment:
+        FAKE_LLM_SEED               seed cho nội dung, độ trễ và lỗi (mặc định: 0)
+        FAKE_LLM_LATENCY_MS         trung vị thời gian tới token đầu tiên, ms (mặc định: 800)
+        FAKE_LLM_LATENCY_SIGMA      độ lệch của phân phối log-normal (mặc định: 0.5)
+        FAKE_LLM_TOKENS_PER_SECOND  tốc độ stream token (mặc định: 60, 0 = trả về ngay)
+        FAKE_LLM_ERROR_RATE         tỉ lệ lỗi tạm thời giả lập (mặc định: 0)
+        FAKE_LLM_MALFORMED_RATE     tỉ lệ đầu ra hỏng giả lập (mặc định: 0)
+    '''
+    global _fake_llm
+    if _fake_llm is None:
+        with _fake_llm_lock:
+            if _fake_llm is None:
+                _fake_llm = FakeLLM(
+                    seed=int(os.getenv("FAKE_LLM_SEED", 0)),
+                    latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", 800)),
+                    latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", 0.5)),
+                    tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 60)),
+                    error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", 0)),
+                    malformed_rate=float(os.getenv("FAKE_LLM_MALFORMED_RATE", 0)),
+                )
+    return _fake_llm
+
+
+def set_fake_llm(llm):
+    global _fake_llm
+    with _fake_llm_lock:
+        _fake_llm = llm
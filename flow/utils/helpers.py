@@ -1,3 +1,4 @@
+import hashlib
 import os
 import random
 import yaml
@@ -7,6 +8,10 @@ import uuid
 import json
 import re
 
+from flow.utils.config_cache import get_config_cache, parse_yaml_text
+from flow.utils.json_extract import extract_json
+from flow.utils.session_log import get_session_log
+
 
 def get_timestamp():
     return int(time.time() * 1000)
@@ -14,19 +19,36 @@ def get_timestamp():
 def generate_uuid():
     return str(uuid.uuid4())
 
+def estimate_tokens(text):
+    """Ước lượng số token của một đoạn text (~4 ký tự / token), dùng khi LLM không trả về usage"""
+    if not text:
+        return 0
+    return max(1, len(str(text)) // 4)
+
+# Các pattern được biên dịch một lần; mỗi bước chỉ chạy khi chuỗi có ký tự mà bước đó cần,
+# thứ tự các bước giữ nguyên vì bước trước có thể tạo ra đầu vào cho bước sau
+_FENCE_RE = re.compile(r'```(json|yaml|html|markdown)?')
+# Dấu \ không phải escape JSON hợp lệ. Pattern bắt đầu bằng ký tự \ (lookbehind đặt sau) để re tìm nhanh theo ký tự đó
+_LONE_BACKSLASH_RE = re.compile(r'\\(?<!\\\\)(?!["\\/bfnrt]|u[0-9a-fA-F]{4})')
+
 def clean_response(raw_response):
     """Xử lý các ký tự đặc biệt json, yaml, html, markdown artifacts"""
-    cleaned = re.sub(r'```(json|yaml|html|markdown)?', '', raw_response)
-    cleaned = cleaned.replace('<\html>', '').replace('</html>', '')
-    cleaned = cleaned.replace('\r\n', '\n').replace('\r', '\n')
+    cleaned = raw_response
+    if '```' in cleaned:
+        cleaned = _FENCE_RE.sub('', cleaned)
+    if 'html>' in cleaned:
+        cleaned = cleaned.replace('<\\html>', '').replace('</html>', '')
+    if '\r' in cleaned:
+        cleaned = cleaned.replace('\r\n', '\n').replace('\r', '\n')
     # Remove double curly braces at start/end
-    cleaned = re.sub(r'^\s*\{\{', '{', cleaned)
-    cleaned = re.sub(r'\}\}\s*$', '}', cleaned)
-    cleaned = re.sub(
-        r'(?<!\\)\\(?!["\\/bfnrt]|u[0-9a-fA-F]{4})', 
-        r'\\\\', 
-        cleaned
-    )
+    stripped = cleaned.lstrip()
+    if stripped.startswith('{{'):
+        cleaned = '{' + stripped[2:]
+    stripped = cleaned.rstrip()
+    if stripped.endswith('}}'):
+        cleaned = stripped[:-1]
+    if '\\' in cleaned:
+        cleaned = _LONE_BACKSLASH_RE.sub(r'\\\\', cleaned)
     return cleaned.strip()
 
 def fix_missing_commas(s):
@@ -41,39 +63,114 @@ def parse_json_response(cleaned_response):
     try:
         return json.loads(cleaned_response)
     except Exception as e:
-        try:
-            print(f"Error parsing JSON, trying to fix...")
-            return json.loads(fix_missing_commas(cleaned_response))
-        except Exception as e:
-            print(f"Still error parsing JSON: {e}")
-            return None
+        print(f"Error parsing JSON, trying to fix...")
+    # Tìm giá trị JSON đầu tiên trong câu trả lời (một lượt quét), chỉ sửa dấu phẩy trên đoạn JSON tìm được
+    data = extract_json(cleaned_response, repair=fix_missing_commas)
+    if data is None:
+        print(f"Still error parsing JSON: no complete JSON value in {cleaned_response[:200]!r}")
+    return data
+
+_NUMBER_END_RE = re.compile(r'\.\s')
+_LIST_BULLET_RE = re.compile(r'•\s')
+_SQRT_RE = re.compile(r'\\sqrt(\w+)')
+_BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+_INDENT_RE = re.compile(r'\n\s{2,}')
+BULLET_REPLACEMENTS = {'◦': '○', '■': '▪', '‣': '▸'}
+
+def _mark_list_numbers(content):
+    '''Same as re.sub(r'(\d+\.)\s', ...) but scans for the literal ". " and walks back over the digits.'''
+    pieces = []
+    last = 0
+    for match in _NUMBER_END_RE.finditer(content):
+        end = match.start()
+        start = end
+        while start > last and content[start - 1].isdecimal():
+            start -= 1
+        if start == end:
+            continue
+        pieces += [content[last:start], '<span class="list-number">', content[start:end + 1], '</span> ']
+        last = match.end()
+    if not pieces:
+        return content
+    pieces.append(content[last:])
+    return "".join(pieces)
+
+def _pad_dollars(content):
+    '''
+    Một lượt thay cho hai bước cũ: thêm khoảng trắng sau $ (nếu chưa có) rồi trước $ (nếu chưa có).
+    $ đứng ngay sau một $ khác không cần thêm vì bước đầu đã chèn khoảng trắng vào giữa.
+    '''
+    parts = content.split('$')
+    pieces = [parts[0]]
+    for k in range(1, len(parts)):
+        before = parts[k - 1]
+        if before:
+            pieces.append('$' if before[-1] == ' ' else ' $')
+        else:
+            pieces.append('$' if k > 1 else ' $')
+        after = parts[k]
+        pieces.append(after if after.startswith(' ') else ' ' + after)
+    return "".join(pieces)
 
 def process_content(content):
     """Chuyển đổi định dạng markdown sang HTML"""
     # Xử lý bullet points và số thứ tự
-    content = re.sub(r'(\d+\.)\s', r'<span class="list-number">\1</span> ', content)
-    content = re.sub(r'•\s', r'<span class="list-bullet">•</span> ', content)
+    if '.' in content:
+        content = _mark_list_numbers(content)
+    if '•' in content:
+        content = _LIST_BULLET_RE.sub(r'<span class="list-bullet">•</span> ', content)
     
     # Fix căn bậc 2
-    content = re.sub(r'\\sqrt(\w+)', r'\\sqrt{\1}', content)
+    if '\\sqrt' in content:
+        content = _SQRT_RE.sub(r'\\sqrt{\1}', content)
     
     # Xử lý in đậm với dấu **
-    content = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', content)
+    if '**' in content:
+        content = _BOLD_RE.sub(r'<strong>\1</strong>', content)
     
-    # Thêm khoảng trắng sau dấu $
-    content = re.sub(r'\$(?! )', '$ ', content)
-    content = re.sub(r'(?<! )\$', ' $', content)
+    # Thêm khoảng trắng trước và sau dấu $
+    if '$' in content:
+        content = _pad_dollars(content)
     
     # Xử lý thụt đầu dòng
-    content = re.sub(r'\n\s{2,}', lambda m: '\n' + ' ' * (len(m.group(0))//2), content)
+    if '\n' in content:
+        content = _INDENT_RE.sub(lambda m: '\n' + ' ' * (len(m.group(0))//2), content)
     
     # Thay thế các ký tự bullet đặc biệt
-    bullet_replacements = {'◦': '○', '■': '▪', '‣': '▸'}
-    for k, v in bullet_replacements.items():
-        content = content.replace(k, v)
+    for k, v in BULLET_REPLACEMENTS.items():
+        if k in content:
+            content = content.replace(k, v)
     
     return content
     
+# Từ đệm, tiếng cười và lời cảm ơn: không trả lời được câu hỏi nào, không mang nội dung giải bài (bỏ qua StageManager).
+# Không gồm các câu trả lời (ok, ừ, đúng, được, rồi, hiểu rồi, yes/no...): chúng có thể hoàn thành một task.
+ACKNOWLEDGEMENTS = {
+    "ừm", "uh", "uhm", "ờ", "à", "ạ", "hmm", "hm", "haha", "hihi", "hehe", "wow", "nhé", "nha",
+    "cảm ơn", "cám ơn", "thanks", "thank you", "bạn",
+}
+
+def is_trivial_message(text, max_words=4):
+    """
+    Tin nhắn không thể hoàn thành một task của kịch bản: chỉ gồm dấu câu/emoji,
+    hoặc chỉ gồm từ đệm/lời cảm ơn ngắn (ừm, haha, cảm ơn, ...). Tin nhắn rỗng hoặc có chữ số không được tính.
+    """
+    if not text or not text.strip() or re.search(r'\d', text):
+        return False
+    words = re.sub(r'[^\w\s]', ' ', text.lower()).split()
+    if len(words) > max_words:
+        return False
+    i = 0
+    while i < len(words):
+        # Ưu tiên khớp cụm hai từ ("cảm ơn", "thank you") trước từ đơn
+        if " ".join(words[i:i + 2]) in ACKNOWLEDGEMENTS and i + 1 < len(words):
+            i += 2
+        elif words[i] in ACKNOWLEDGEMENTS:
+            i += 1
+        else:
+            return False
+    return True
+
 def parse_output(content, key):
     try:
         # Remove prefix and suffix
@@ -89,40 +186,52 @@ def parse_output(content, key):
 
 
 def parse_yaml(yaml_string: str) -> dict:
-    try:
-        data = yaml_string.replace("```yaml", "").replace("```", "")
-        data = yaml.safe_load(data)
-        
-        return data
-    except yaml.YAMLError as e:
-        print(f"Error parsing YAML: {e}")
-        return {}
+    return parse_yaml_text(yaml_string)
 
 def load_yaml(yaml_path: str) -> dict:
-    with open(yaml_path, "r", encoding="utf-8") as f:
-        yaml_data = parse_yaml(f.read())
-    return yaml_data
+    '''Parsed YAML file as a mutable copy, served from the process-wide config cache (re-parsed when the file changes).'''
+    return get_config_cache().get_copy(yaml_path)
+
+def load_config(yaml_path: str):
+    '''Parsed YAML file as a shared read-only view (MappingProxyType/tuple), for configs that are only read.'''
+    return get_config_cache().get(yaml_path)
 
 def save_yaml(yaml_path: str, yaml_data: dict):
-    if not os.path.exists(os.path.dirname(yaml_path)):
+    if os.path.dirname(yaml_path):
         os.makedirs(os.path.dirname(yaml_path), exist_ok=True)
-    with open(yaml_path, "w") as f:
-        yaml.dump(yaml_data, f, indent=2, sort_keys=False, allow_unicode=True)
+    # Ghi vào file tạm rồi đổi tên: người đọc đồng thời không bao giờ thấy file ghi dở
+    tmp_path = f"{yaml_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yaml.dump(yaml_data, f, indent=2, sort_keys=False, allow_unicode=True)
+        os.replace(tmp_path, yaml_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def persist_yaml(folder_path: str, prefix: str, yaml_data: dict, name: str = None) -> str:
+    '''
+    Atomically save yaml_data to <folder_path>/<prefix>-<name>.yaml and return the path.
+    Without a name (e.g. a session id) the file is named by the hash of its content, so concurrent writers never
+    overwrite each other: the same content always lands in the same file.
+    '''
+    if name is None:
+        content = json.dumps(yaml_data, sort_keys=True, ensure_ascii=False, default=str)
+        name = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    yaml_path = os.path.join(folder_path, f"{prefix}-{name}.yaml")
+    save_yaml(yaml_path, yaml_data)
+    return yaml_path
 
   
 def create_agent_config(participants_path, meta_agents_path, output_path):
     '''
     Create agent config from participants and meta agents to output file: agents.yaml cause crewai only support agents.yaml.
     '''
-    with open(participants_path, "r") as f:
-        participants_config = parse_yaml(f.read())
-
-    with open(meta_agents_path, "r") as f:
-        meta_agents_config = parse_yaml(f.read())
+    participants_config = load_yaml(participants_path)
+    meta_agents_config = load_yaml(meta_agents_path)
     combined_agents_config = {**participants_config, **meta_agents_config}
 
-    with open(output_path, "w") as f:
-        yaml.dump(combined_agents_config, f, indent=2, sort_keys=False, allow_unicode=True)
+    save_yaml(output_path, combined_agents_config)
         
 def dummy_llm_call(data_type):
     if data_type == "yaml":
@@ -137,8 +246,5 @@ def dummy_llm_call(data_type):
         return "Hello, world!"
 
 def save_to_log_file(message, filename):
-    dir_name = os.path.dirname(filename)
-    if dir_name and not os.path.exists(dir_name):
-        os.makedirs(dir_name, exist_ok=True)
-    with open(filename, "a") as f:
-        f.write(message)
+    '''Append message to a log file via the background session log writer (returns without touching the disk).'''
+    get_session_log().write(filename, message)
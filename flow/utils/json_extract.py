@@ -0,0 +1,119 @@
+import json
+import re
+
+# Các ký tự duy nhất làm thay đổi trạng thái của bộ quét; phần còn lại được bỏ qua bằng re (tốc độ C)
+_STRUCTURAL_RE = re.compile(r'["\\{}\[\]]')
+_CLOSERS = {"}": "{", "]": "["}
+_INVALID = object()
+
+
+class JSONStreamExtractor:
+    '''
+    Finds complete top-level JSON objects/arrays in text that may arrive in pieces (a streaming LLM response).
+
+    One linear, string-aware pass: braces inside JSON strings and escaped quotes are ignored, prose between values
+    is skipped, and a value split across chunks completes on the chunk that closes it. A balanced span that is not
+    valid JSON (prose such as "{note}" or "[X]") is retried with `repair` when given, otherwise scanning resumes
+    just after its opening bracket, so a valid value nested in it is still found.
+
+    Cost: valid JSON and prose are scanned once. Each abandoned candidate is rescanned once from its opening bracket,
+    so the worst case is O(n·d), d being how many abandoned candidates enclose a position (the nesting depth of
+    invalid "{...}" spans), which stays small for LLM outputs. Text before the current candidate (or before the scan
+    position when there is none) is dropped after each feed(), so the buffer never holds more than the open value.
+    '''
+
+    def __init__(self, repair=None):
+        self.repair = repair
+        self.values = []
+        self._text = ""
+        self._pos = 0
+        self._reset()
+
+    def _reset(self):
+        self._stack = []      # các ngoặc đang mở của giá trị hiện tại
+        self._start = None    # vị trí ngoặc mở đầu tiên của giá trị hiện tại
+        self._in_string = False
+
+    @property
+    def pending(self):
+        '''True while a value has been opened but not closed yet (the stream stopped in the middle of it).'''
+        return self._start is not None
+
+    def feed(self, chunk, limit=None):
+        '''
+        Add a chunk of text; return the values completed by it, in order.
+        With `limit`, scanning pauses after that many values; the rest is scanned by the next feed().
+        '''
+        self._text += chunk
+        completed = []
+        text = self._text
+        pos = self._pos
+        while limit is None or len(completed) < limit:
+            match = _STRUCTURAL_RE.search(text, pos)
+            if match is None:
+                pos = len(text)  # phần còn lại không có ký tự cấu trúc: không cần quét lại
+                break
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == "\\":
+                    if pos >= len(text):
+                        # Ký tự được escape chưa tới: đọc lại dấu \ ở chunk sau
+                        pos -= 1
+                        break
+                    pos += 1
+                elif char == '"':
+                    self._in_string = False
+            elif char in "{[":
+                if self._start is None:
+                    self._start = pos - 1
+                self._stack.append(char)
+            elif self._start is None:
+                continue  # dấu nháy/ngoặc đóng trong văn bản ngoài JSON
+            elif char == '"':
+                self._in_string = True
+            elif char in _CLOSERS:
+                if self._stack.pop() != _CLOSERS[char]:
+                    pos = self._abandon()
+                elif not self._stack:
+                    value = self._decode(text[self._start:pos])
+                    if value is _INVALID:
+                        pos = self._abandon()
+                    else:
+                        completed.append(value)
+                        self._reset()
+        # Bỏ phần đã quét xong: chỉ giữ từ ngoặc mở của giá trị đang dở (có thể phải quét lại khi bị bỏ)
+        keep = self._start if self._start is not None else pos
+        self._text = text[keep:]
+        self._pos = pos - keep
+        if self._start is not None:
+            self._start = 0
+        self.values.extend(completed)
+        return completed
+
+    def _abandon(self):
+        '''Drop the current candidate and resume scanning right after its opening bracket.'''
+        resume = self._start + 1
+        self._reset()
+        return resume
+
+    def _decode(self, candidate):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+        if self.repair is not None:
+            try:
+                return json.loads(self.repair(candidate))
+            except ValueError:
+                pass
+        return _INVALID
+
+
+def extract_json(text, repair=None):
+    '''
+    The first complete JSON object or array embedded in `text` (code fences and prose around it are skipped),
+    or None when there is none. `repair(candidate)` may fix a balanced but invalid candidate before giving up on it.
+    '''
+    values = JSONStreamExtractor(repair).feed(text, limit=1)
+    return values[0] if values else None
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# off    : không dùng cache, mọi lời gọi đều tới LLM
+# record : đọc cache nếu có, nếu không thì gọi LLM và lưu lại kết quả
+# replay : chỉ đọc từ cache, thiếu thì báo lỗi (chạy offline / benchmark)
+CACHE_MODES = ("off", "record", "replay")
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+class CachedOutput:
+    """Minimal stand-in for a CrewOutput served from the cache (only `.raw` is used by the flows)."""
+    __slots__ = ("raw", "token_usage", "cached")
+
+    def __init__(self, raw, token_usage=None):
+        self.raw = raw
+        self.token_usage = token_usage
+        self.cached = True
+
+    def __str__(self):
+        return self.raw
+
+
+class LLMResponseCache:
+    '''
+    Disk-backed, content-addressed cache for LLM responses.
+    Each entry is stored as <cache_dir>/<key[:2]>/<key>.json; the key is a sha256 of
+    (agent config, task name, task config, rendered inputs, model).
+    A small in-memory LRU sits in front of the disk so replayed sessions run at memory speed.
+    '''
+
+    def __init__(self, cache_dir, mode="off", ttl=None, max_bytes=256 * 1024 * 1024, memory_entries=512):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode '{mode}', expected one of {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (created_at, raw)
+        self._index = None  # key -> [size, last_access, created_at], được dựng lại từ đĩa khi cần
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @staticmethod
+    def make_key(agent_config, task_name, task_config, inputs, model):
+        payload = json.dumps({
+            "agent": agent_config,
+            "task_name": task_name,
+            "task": task_config,
+            "inputs": inputs,
+            "model": model,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _is_expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                # File chỉ được ghi một lần mỗi khi put: mtime là thời điểm tạo entry
+                self._index[name[:-5]] = [stat.st_size, stat.st_mtime, stat.st_mtime]
+                self._total_bytes += stat.st_size
+
+    def _remember(self, key, created_at, raw):
+        self._memory[key] = (created_at, raw)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _drop(self, key):
+        self._memory.pop(key, None)
+        entry = self._index.pop(key, None) if self._index is not None else None
+        if entry is not None:
+            self._total_bytes -= entry[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _touch(self, key):
+        if self._index is not None and key in self._index:
+            self._index[key][1] = time.time()
+
+    def get(self, key):
+        '''
+        Return the cached raw response for `key`, or None on a miss / expired entry.
+        '''
+        with self._lock:
+            if key in self._memory:
+                created_at, raw = self._memory[key]
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    # Entry nóng nhất luôn được đọc từ bộ nhớ: vẫn phải cập nhật lần truy cập cho LRU trên đĩa
+                    self._touch(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return raw
+                self._stats["expired"] += 1
+                self._drop(key)
+                self._stats["misses"] += 1
+                return None
+
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._stats["misses"] += 1
+                return None
+
+            if self._is_expired(entry.get("created_at", 0)):
+                self._stats["expired"] += 1
+                self._load_index()
+                self._drop(key)
+                self._stats["misses"] += 1
+                return None
+
+            self._touch(key)
+            self._remember(key, entry["created_at"], entry["raw"])
+            self._stats["hits"] += 1
+            return entry["raw"]
+
+    def put(self, key, raw, **metadata):
+        '''
+        Store a raw response under `key`; evicts least recently used entries when over `max_bytes`.
+        '''
+        created_at = time.time()
+        entry = {"key": key, "created_at": created_at, "raw": raw, **metadata}
+        data = json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8")
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            previous = self._index.get(key)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._index[key] = [len(data), created_at, created_at]
+            self._total_bytes += len(data)
+            self._remember(key, created_at, raw)
+            self._stats["writes"] += 1
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Xóa các entry đã hết hạn trước, sau đó mới xóa theo LRU
+        if self.ttl is not None:
+            now = time.time()
+            for key, (_, _, created_at) in list(self._index.items()):
+                if now - created_at > self.ttl:
+                    self._drop(key)
+                    self._stats["expired"] += 1
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._drop(key)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._load_index()
+            for key in list(self._index.keys()):
+                self._drop(key)
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "mode": self.mode,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    '''
+    Process-wide cache configured from the environment:
+        LLM_CACHE_MODE     off | record | replay (mặc định: off)
+        LLM_CACHE_DIR      thư mục lưu cache (mặc định: .cache/llm)
+        LLM_CACHE_TTL      thời gian sống của một entry, tính bằng giây (mặc định: 7 ngày, 0 = không hết hạn)
+        LLM_CACHE_MAX_MB   dung lượng tối đa trên đĩa (mặc định: 256)
+    '''
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ttl = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+                _cache = LLMResponseCache(
+                    cache_dir=os.getenv("LLM_CACHE_DIR", ".cache/llm"),
+                    mode=os.getenv("LLM_CACHE_MODE", "off").strip().lower(),
+                    ttl=ttl if ttl > 0 else None,
+                    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", 256)) * 1024 * 1024),
+                )
+    return _cache
+
+
+def set_llm_cache(cache):
+    '''Replace the process-wide cache (e.g. to switch to replay mode for a benchmark run).'''
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+
+load_dotenv()
+
+# Số càng nhỏ càng được ưu tiên: lời nói của agent > suy nghĩ/đánh giá > stage > sinh kịch bản
+PRIORITY_TALK = 0
+PRIORITY_THINK = 1
+PRIORITY_STAGE = 2
+PRIORITY_SCRIPT = 3
+
+TASK_PRIORITIES = {
+    "talk": PRIORITY_TALK,
+    "think": PRIORITY_THINK,
+    "think_batch": PRIORITY_THINK,
+    "evaluate": PRIORITY_THINK,
+    "manage_stage": PRIORITY_STAGE,
+}
+
+PRIORITY_NAMES = {
+    PRIORITY_TALK: "talk",
+    PRIORITY_THINK: "think",
+    PRIORITY_STAGE: "stage",
+    PRIORITY_SCRIPT: "script",
+}
+
+
+def priority_for_task(task_name):
+    '''Priority class of a task from tasks.yaml; every script generation task falls in the lowest class.'''
+    return TASK_PRIORITIES.get(task_name, PRIORITY_SCRIPT)
+
+
+class TokenBucket:
+    '''
+    Token bucket refilled continuously at `rate_per_minute`, holding at most one minute of budget.
+    The level may go negative when actual usage exceeds the estimate; later requests then wait longer.
+    A rate of 0 (or less) means unlimited.
+    '''
+
+    def __init__(self, rate_per_minute):
+        # 0 = không giới hạn: bucket vô hạn thì wait_time luôn bằng 0
+        self.capacity = float(rate_per_minute) if rate_per_minute > 0 else float("inf")
+        self.level = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        if self.level < self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        # Không bao giờ đòi nhiều hơn dung lượng bucket, tránh chờ vô hạn với request quá lớn
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= amount
+
+
+class Ticket:
+    __slots__ = ("id", "priority", "session_id", "tokens", "enqueued_at", "granted_at",
+                 "granted", "abandoned", "loop", "future")
+
+    def __init__(self, ticket_id, priority, session_id, tokens):
+        self.id = ticket_id
+        self.priority = priority
+        self.session_id = session_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.granted = False
+        self.abandoned = False
+        self.loop = None
+        self.future = None
+
+
+class LLMScheduler:
+    '''
+    Process-wide scheduler that every LLM request goes through.
+    - Token buckets for requests per minute and tokens per minute.
+    - Strict priority between classes (talk > think/evaluate > stage > script generation).
+    - Round-robin between sessions inside a class, so one busy classroom cannot monopolize the budget.
+    - Optional cap on the number of in-flight requests.
+    Works for both threads (Flask handlers, crew kickoff) and asyncio tasks (thinker fan-out, ClaudeSDKClient).
+    '''
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=0, name="global"):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._queues = {}  # priority -> OrderedDict(session_id -> deque[Ticket])
+        self._ids = itertools.count()
+
+    # --- Hàng đợi -----------------------------------------------------------------
+
+    def _enqueue(self, ticket):
+        sessions = self._queues.setdefault(ticket.priority, OrderedDict())
+        sessions.setdefault(ticket.session_id, deque()).append(ticket)
+
+    def _remove(self, ticket):
+        sessions = self._queues.get(ticket.priority, {})
+        queue = sessions.get(ticket.session_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del sessions[ticket.session_id]
+
+    def _head(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                session_id, queue = next(iter(sessions.items()))
+                return priority, session_id, queue[0]
+        return None
+
+    def _next_wait_locked(self):
+        head = self._head()
+        if head is None:
+            return 1.0
+        ticket = head[2]
+        wait = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+        return min(max(wait, 0.01), 1.0)
+
+    def _dispatch_locked(self):
+        '''Grant queued tickets in priority / round-robin order while the budget allows.'''
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        granted_any = False
+        while True:
+            head = self._head()
+            if head is None:
+                break
+            priority, session_id, ticket = head
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                break
+            if self.requests.wait_time(1) > 0 or self.tokens.wait_time(ticket.tokens) > 0:
+                break
+
+            sessions = self._queues[priority]
+            queue = sessions.pop(session_id)
+            queue.popleft()
+            if queue:
+                sessions[session_id] = queue  # chuyển session xuống cuối để xoay vòng
+
+            self.requests.consume(1)
+            self.tokens.consume(ticket.tokens)
+            self.in_flight += 1
+            ticket.granted = True
+            ticket.granted_at = now
+            granted_any = True
+
+            queue_time = now - ticket.enqueued_at
+            priority_name = PRIORITY_NAMES.get(priority, str(priority))
+            metrics.observe("llm_queue_seconds", queue_time, scheduler=self.name, priority=priority_name)
+            metrics.inc("llm_scheduled_total", scheduler=self.name, priority=priority_name)
+            if ticket.future is not None:
+                ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+        if granted_any:
+            self._condition.notify_all()
+
+    # --- API ------------------------------------------------------------------------
+
+    def _new_ticket(self, priority, session_id, estimated_tokens):
+        return Ticket(next(self._ids), priority, session_id or "", max(0, int(estimated_tokens)))
+
+    def acquire(self, priority, session_id="", estimated_tokens=0):
+        '''Block the calling thread until the request may be sent; returns the ticket to `release`.'''
+        ticket = self._new_ticket(priority, session_id, estimated_tokens)
+        with self._condition:
+            self._enqueue(ticket)
+            while True:
+                self._dispatch_locked()
+                if ticket.granted:
+                    return ticket
+                self._condition.wait(timeout=self._next_wait_locked())
+
+    async def acquire_async(self, priority, session_id="", estimated_tokens=0):
+        '''Asyncio counterpart of `acquire`; waiting does not block the event loop nor use a worker thread.'''
+        loop = asyncio.get_running_loop()
+        ticket = self._new_ticket(priority, session_id, estimated_tokens)
+        ticket.loop = loop
+        ticket.future = loop.create_future()
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._lock:
+                    self._dispatch_locked()
+                    if ticket.granted:
+                        return ticket
+                    wait = self._next_wait_locked()
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket):
+        with self._condition:
+            ticket.abandoned = True
+            if ticket.granted:
+                self._release_locked(ticket, None)
+            else:
+                self._remove(ticket)
+
+    def _release_locked(self, ticket, actual_tokens):
+        self.in_flight -= 1
+        if actual_tokens is not None:
+            # Điều chỉnh bucket theo số token thực tế so với ước lượng
+            self.tokens.consume(actual_tokens - ticket.tokens)
+        self._dispatch_locked()
+        self._condition.notify_all()
+
+    def release(self, ticket, actual_tokens=None):
+        with self._condition:
+            self._release_locked(ticket, actual_tokens)
+
+    @contextmanager
+    def slot(self, priority, session_id="", estimated_tokens=0):
+        ticket = self.acquire(priority, session_id, estimated_tokens)
+        usage = {"tokens": None}
+        try:
+            yield usage
+        finally:
+            self.release(ticket, usage["tokens"])
+
+    @asynccontextmanager
+    async def slot_async(self, priority, session_id="", estimated_tokens=0):
+        '''
+        Async slot. A call running in a worker thread sets `usage["hold"]` to its concurrent Future: if the awaiting
+        task is cancelled (deadline, hedge loser) the thread keeps running, so the slot is released only when it ends.
+        '''
+        ticket = await self.acquire_async(priority, session_id, estimated_tokens)
+        usage = {"tokens": None, "hold": None}
+        try:
+            yield usage
+        finally:
+            hold = usage["hold"]
+            if hold is not None and not hold.done():
+                metrics.inc("llm_orphaned_calls_total", scheduler=self.name)
+                hold.add_done_callback(lambda _: self.release(ticket, usage["tokens"]))
+            else:
+                self.release(ticket, usage["tokens"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": {
+                    PRIORITY_NAMES.get(priority, str(priority)): sum(len(q) for q in sessions.values())
+                    for priority, sessions in self._queues.items()
+                },
+                "sessions_waiting": len({sid for sessions in self._queues.values() for sid in sessions}),
+                "request_budget": self.requests.level,
+                "token_budget": self.tokens.level,
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    '''
+    Process-wide scheduler configured from the environment:
+        LLM_RPM              số request tối đa mỗi phút, 0 = không giới hạn (mặc định: 0)
+        LLM_TPM              số token tối đa mỗi phút, 0 = không giới hạn (mặc định: 0)
+        LLM_MAX_CONCURRENCY  số request đồng thời tối đa, 0 = không giới hạn (mặc định: 0)
+    '''
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler(
+                    requests_per_minute=float(os.getenv("LLM_RPM", 0)),
+                    tokens_per_minute=float(os.getenv("LLM_TPM", 0)),
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 0)),
+                )
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    '''Replace the process-wide scheduler (e.g. to give each batch worker its share of the global limit).'''
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
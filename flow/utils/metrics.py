@@ -0,0 +1,141 @@
+import threading
+
+# Bucket mặc định cho các histogram đo thời gian (giây)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Bucket cho các histogram đếm token của một prompt
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRegistry:
+    '''
+    Process-wide registry of counters, gauges and histograms.
+    Metrics are identified by name plus a sorted tuple of label pairs.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        '''Set a gauge to its current value (sizes, counts of stored items...).'''
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+                self._histograms[key] = histogram
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def get(self, name, **labels):
+        '''Return the current value of a counter (0 if it was never incremented).'''
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._gauges.items()
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h["count"], "sum": h["sum"],
+                     "buckets": list(zip(h["buckets"], h["counts"]))}
+                    for (name, labels), h in self._histograms.items()
+                ],
+            }
+
+    def render_prometheus(self):
+        '''All metrics in the Prometheus text exposition format (served on /metrics).'''
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, dict(h, counts=list(h["counts"]))) for key, h in self._histograms.items())
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges:
+            if name != last_name:
+                lines.append(f"# TYPE {name} gauge")
+                last_name = name
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), h in histograms:
+            if name != last_name:
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+            # Số đếm của mỗi bucket đã là luỹ kế (observe tăng mọi bucket có cận trên >= giá trị)
+            for bound, count in zip(h["buckets"], h["counts"]):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {h['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(h['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    registry.set_gauge(name, value, **labels)
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    registry.observe(name, value, buckets, **labels)
+
+
+def render_prometheus():
+    return registry.render_prometheus()
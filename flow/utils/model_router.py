@@ -0,0 +1,100 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+from flow.utils.helpers import load_yaml
+from flow.utils.llm_scheduler import LLMScheduler
+
+load_dotenv()
+
+DEFAULT_ROUTING_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "crews", "config", "model_routing.yaml")
+
+
+class ModelTier:
+    '''A model tier: primary model, ordered fallbacks, concurrency limit and prices for cost reporting.'''
+
+    def __init__(self, name, model, fallbacks=None, max_concurrency=0,
+                 cost_per_1m_input_tokens=0.0, cost_per_1m_output_tokens=0.0):
+        self.name = name
+        self.models = [model] + list(fallbacks or [])
+        self.input_price = float(cost_per_1m_input_tokens)
+        self.output_price = float(cost_per_1m_output_tokens)
+        # Giới hạn số request đồng thời của tier, dùng lại scheduler (ưu tiên, công bằng giữa các phiên)
+        self.limiter = LLMScheduler(
+            requests_per_minute=float("inf"), tokens_per_minute=float("inf"),
+            max_concurrency=int(max_concurrency or 0), name=f"tier:{name}"
+        )
+
+    def cost(self, token_usage):
+        '''USD cost of a call from its token usage (total tokens are priced as input when the split is unknown).'''
+        prompt = getattr(token_usage, "prompt_tokens", 0) or 0
+        completion = getattr(token_usage, "completion_tokens", 0) or 0
+        if not prompt and not completion:
+            prompt = getattr(token_usage, "total_tokens", 0) or 0
+        return (prompt * self.input_price + completion * self.output_price) / 1_000_000
+
+    def record(self, model, seconds, token_usage):
+        metrics.inc("llm_tier_requests_total", tier=self.name, model=model)
+        metrics.observe("llm_tier_seconds", seconds, tier=self.name, model=model)
+        metrics.inc("llm_tier_tokens_total", getattr(token_usage, "total_tokens", 0) or 0, tier=self.name)
+        metrics.inc("llm_tier_cost_usd_total", self.cost(token_usage), tier=self.name)
+
+
+class ModelRouter:
+    '''
+    Routes each task to a model tier (model_routing.yaml next to meta_agents.yaml/tasks.yaml).
+    Tasks without a tier, and personas that set their own `llm`, keep the `llm` of their agent.
+    '''
+
+    def __init__(self, tiers=None, tasks=None, default_tier=None):
+        self.tiers = tiers or {}
+        self.tasks = tasks or {}
+        self.default_tier = default_tier
+
+    @classmethod
+    def from_yaml(cls, path):
+        config = load_yaml(path) or {}
+        tiers = {name: ModelTier(name, **tier) for name, tier in (config.get("tiers") or {}).items()}
+        tasks = config.get("tasks") or {}
+        default_tier = config.get("default_tier")
+        for task_name, tier in [*tasks.items(), ("default_tier", default_tier)]:
+            if tier is not None and tier not in tiers:
+                raise ValueError(f"Unknown model tier '{tier}' for '{task_name}' in {path}")
+        return cls(tiers, tasks, default_tier)
+
+    def tier_for(self, task_name, persona_llm=None):
+        '''The ModelTier of a task, or None when the task keeps its agent's model (`persona_llm` always wins).'''
+        if persona_llm:
+            return None
+        tier = self.tasks.get(task_name, self.default_tier)
+        return self.tiers.get(tier) if tier else None
+
+    def stats(self):
+        return {name: tier.limiter.stats() for name, tier in self.tiers.items()}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    '''
+    Process-wide model router configured from the environment:
+        MODEL_ROUTING_CONFIG  đường dẫn file định tuyến (mặc định: flow/crews/config/model_routing.yaml,
+                              không có file = mọi task dùng model của agent)
+    '''
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                path = os.getenv("MODEL_ROUTING_CONFIG", DEFAULT_ROUTING_PATH)
+                _router = ModelRouter.from_yaml(path) if os.path.exists(path) else ModelRouter()
+    return _router
+
+
+def set_model_router(router):
+    global _router
+    with _router_lock:
+        _router = router
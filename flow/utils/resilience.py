@@ -0,0 +1,237 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+
+load_dotenv()
+
+# Deadline (giây) cho mỗi lần gọi LLM theo task, tính cả thời gian chờ scheduler và các lần thử lại.
+# Task không có trong bảng (sinh kịch bản) không bị giới hạn thời gian.
+DEADLINE_ENV = {
+    "think": "DIALOGUE_DEADLINE_THINK",
+    "think_batch": "DIALOGUE_DEADLINE_THINK",
+    "evaluate": "DIALOGUE_DEADLINE_EVALUATE",
+    "manage_stage": "DIALOGUE_DEADLINE_STAGE",
+    "talk": "DIALOGUE_DEADLINE_TALK",
+}
+DEFAULT_DEADLINES = {
+    "DIALOGUE_DEADLINE_THINK": 30,
+    "DIALOGUE_DEADLINE_EVALUATE": 30,
+    "DIALOGUE_DEADLINE_STAGE": 30,
+    "DIALOGUE_DEADLINE_TALK": 45,
+}
+
+# Lỗi tạm thời từ provider (rate limit, quá tải, mất kết nối), nhận diện theo mã HTTP/gRPC...
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+TRANSIENT_CODE_NAMES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL"}
+# ... hoặc theo tên lớp lỗi của SDK (litellm, openai, anthropic, google), không cần import các thư viện đó
+TRANSIENT_ERROR_TYPES = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "Timeout", "ServiceUnavailableError",
+    "InternalServerError", "OverloadedError", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+}
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+def _status_code(exc):
+    '''HTTP status or gRPC code name of a provider error (`status_code`/`code`, also on its `response`).'''
+    for owner in (exc, getattr(exc, "response", None)):
+        for attribute in ("status_code", "code"):
+            code = getattr(owner, attribute, None)
+            if isinstance(code, int) or isinstance(code, str) and code:
+                return code
+    return None
+
+
+def is_transient(exc):
+    '''
+    True for errors worth retrying: timeouts, connection errors, provider errors whose type is a known
+    rate-limit/overload/connection error, and errors carrying a 408/429/5xx status code. The message is not inspected.
+    '''
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_TYPES for cls in type(exc).__mro__):
+        return True
+    code = _status_code(exc)
+    if isinstance(code, str):
+        code = int(code) if code.isdigit() else code.upper()
+    if code in TRANSIENT_STATUS_CODES or code in TRANSIENT_CODE_NAMES:
+        return True
+    # CrewAI có thể bọc lỗi của provider: xét lỗi gốc
+    cause = exc.__cause__
+    return cause is not None and cause is not exc and is_transient(cause)
+
+
+class LatencyTracker:
+    '''Sliding window of successful call latencies per task, used to decide when to hedge.'''
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, task_name, seconds):
+        with self._lock:
+            self._samples.setdefault(task_name, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, task_name):
+        with self._lock:
+            return len(self._samples.get(task_name, ()))
+
+    def percentile(self, task_name, q):
+        with self._lock:
+            samples = sorted(self._samples.get(task_name, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class CallPolicy:
+    '''
+    Deadline, retry and hedging policy applied to every LLM call made through crew_runner.
+    - Deadline per dialogue phase: the call (retries included) is cancelled when it is exceeded.
+    - Retries with full-jitter exponential backoff on transient errors.
+    - Hedging (opt-in): when an attempt is still running after the task's p95 latency,
+      a duplicate is sent and whichever finishes first is used; the other is cancelled.
+    A cancelled crew kickoff keeps running in its worker thread; it holds its scheduler slots until it ends
+    (see LLMScheduler.slot_async), so deadlines and hedging never push more requests than the limits allow.
+    '''
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=20.0, hedge=False,
+                 hedge_quantile=0.95, hedge_min_samples=20, deadlines=None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.deadlines = deadlines or {}
+        self.latencies = LatencyTracker()
+
+    def deadline_for(self, task_name):
+        deadline = self.deadlines.get(task_name)
+        return deadline if deadline and deadline > 0 else None
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _hedge_after(self, task_name):
+        if not self.hedge or self.latencies.count(task_name) < self.hedge_min_samples:
+            return None
+        return self.latencies.percentile(task_name, self.hedge_quantile)
+
+    async def _attempt(self, task_name, attempt_factory):
+        '''One attempt, possibly hedged. `attempt_factory(duplicate)` returns a new coroutine for the call.'''
+        started_at = time.perf_counter()
+        primary = asyncio.ensure_future(attempt_factory(False))
+        hedge_after = self._hedge_after(task_name)
+        if hedge_after is None:
+            result = await primary
+            self.latencies.record(task_name, time.perf_counter() - started_at)
+            return result
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                metrics.inc("llm_hedges_total", task=task_name)
+                pending.add(asyncio.ensure_future(attempt_factory(True)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            metrics.inc("llm_hedge_wins_total", task=task_name)
+                        self.latencies.record(task_name, time.perf_counter() - started_at)
+                        return task.result()
+                if not pending:
+                    raise next(iter(done)).exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _retrying(self, task_name, attempt_factory):
+        for attempt in range(self.max_attempts):
+            try:
+                return await self._attempt(task_name, attempt_factory)
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not is_transient(e):
+                    raise
+                delay = self.backoff(attempt)
+                metrics.inc("llm_retries_total", task=task_name)
+                print(f"Transient error on '{task_name}' (attempt {attempt + 1}/{self.max_attempts}): {e}. "
+                      f"Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def run(self, task_name, attempt_factory):
+        '''Run an async LLM call under the deadline of its task, with retries and optional hedging.'''
+        deadline = self.deadline_for(task_name)
+        try:
+            return await asyncio.wait_for(self._retrying(task_name, attempt_factory), timeout=deadline)
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded) or deadline is None:
+                raise
+            metrics.inc("llm_deadline_exceeded_total", task=task_name)
+            raise DeadlineExceeded(f"'{task_name}' exceeded its {deadline:g}s deadline") from e
+
+    def run_sync(self, task_name, call):
+        '''Blocking counterpart of `run` for the script generation flows: retries only (threads cannot be cancelled).'''
+        for attempt in range(self.max_attempts):
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not is_transient(e):
+                    raise
+                delay = self.backoff(attempt)
+                metrics.inc("llm_retries_total", task=task_name)
+                print(f"Transient error on '{task_name}' (attempt {attempt + 1}/{self.max_attempts}): {e}. "
+                      f"Retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_call_policy():
+    '''
+    Process-wide call policy configured from the environment:
+        LLM_RETRY_ATTEMPTS     số lần thử tối đa cho mỗi lần gọi (mặc định: 3)
+        LLM_RETRY_BASE_DELAY   độ trễ cơ sở của backoff, giây (mặc định: 1)
+        LLM_RETRY_MAX_DELAY    độ trễ tối đa giữa hai lần thử, giây (mặc định: 20)
+        LLM_HEDGE              gửi request trùng khi vượt p95 độ trễ (mặc định: 0)
+        DIALOGUE_DEADLINE_*    deadline cho THINK, EVALUATE, STAGE, TALK, giây, 0 = không giới hạn
+    '''
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                deadlines = {
+                    task_name: float(os.getenv(env, DEFAULT_DEADLINES[env]))
+                    for task_name, env in DEADLINE_ENV.items()
+                }
+                _policy = CallPolicy(
+                    max_attempts=int(os.getenv("LLM_RETRY_ATTEMPTS", 3)),
+                    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", 1.0)),
+                    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", 20.0)),
+                    hedge=os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes"),
+                    deadlines=deadlines,
+                )
+    return _policy
+
+
+def set_call_policy(policy):
+    global _policy
+    with _policy_lock:
+        _policy = policy
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+
+load_dotenv()
+
+# Trạng thái của một job sinh kịch bản
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"          # kịch bản sinh thành công
+JOB_FALLBACK = "fallback"  # lỗi hoặc quá deadline, dùng kịch bản mặc định
+FINAL_STATUSES = (JOB_DONE, JOB_FALLBACK)
+
+
+class ScriptJob:
+    __slots__ = ("job_id", "status", "step", "error", "created_at", "started_at", "finished_at", "lock")
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.step = ""
+        self.error = None
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in FINAL_STATUSES
+
+    def to_dict(self):
+        return {"job_id": self.job_id, "status": self.status, "step": self.step, "error": self.error}
+
+
+class ScriptJobQueue:
+    '''
+    Runs script generation jobs on a pool of worker threads, off the HTTP request.
+    Each job has a deadline counted from submission (queueing included): when it passes, or when generation fails,
+    the job completes with the fallback result instead. A generation that finishes after its deadline is discarded.
+    '''
+
+    def __init__(self, workers=2, deadline=180.0):
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="script-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, generate, fallback, on_progress=None, on_complete=None):
+        '''
+        Queue a job.
+            generate(progress)  chạy trên worker; progress(step) báo bước đang chạy, trả về kết quả của job
+            fallback()          kết quả thay thế khi generate lỗi hoặc quá deadline
+            on_progress(job)    gọi mỗi khi trạng thái/bước của job thay đổi
+            on_complete(job, result)  gọi đúng một lần khi job kết thúc (status là 'done' hoặc 'fallback')
+        '''
+        job = ScriptJob(job_id)
+        with self._lock:
+            self._jobs[job_id] = job
+        callbacks = (fallback, on_progress or (lambda job: None), on_complete or (lambda job, result: None))
+        if self.deadline and self.deadline > 0:
+            timer = threading.Timer(self.deadline, self._expire, args=(job, callbacks))
+            timer.daemon = True
+            timer.start()
+        metrics.inc("script_jobs_submitted_total")
+        callbacks[1](job)
+        self._executor.submit(self._run, job, generate, callbacks)
+        return job
+
+    def _run(self, job, generate, callbacks):
+        fallback, on_progress, on_complete = callbacks
+        with job.lock:
+            if job.finished:
+                # Quá deadline khi còn trong hàng đợi: không chạy nữa
+                return
+            job.status = JOB_RUNNING
+            job.started_at = time.monotonic()
+        metrics.observe("script_job_queue_seconds", job.started_at - job.created_at)
+        on_progress(job)
+
+        def progress(step):
+            with job.lock:
+                if job.finished:
+                    return
+                job.step = step
+            on_progress(job)
+
+        try:
+            result = generate(progress)
+        except Exception as e:
+            print(f"--- SCRIPT JOB [{job.job_id}]: Generation failed, using the fallback script: {e}")
+            self._finish(job, JOB_FALLBACK, fallback, on_complete, error=str(e))
+            return
+        if not self._finish(job, JOB_DONE, lambda: result, on_complete):
+            metrics.inc("script_jobs_discarded_total")
+
+    def _expire(self, job, callbacks):
+        fallback, _, on_complete = callbacks
+        if self._finish(job, JOB_FALLBACK, fallback, on_complete, error="deadline exceeded"):
+            print(f"--- SCRIPT JOB [{job.job_id}]: Deadline of {self.deadline:g}s exceeded, using the fallback script.")
+
+    def _finish(self, job, status, result_factory, on_complete, error=None):
+        '''Complete the job once; return False when it had already completed (deadline vs. worker race).'''
+        with job.lock:
+            if job.finished:
+                return False
+            job.status = status
+            job.error = error
+            job.finished_at = time.monotonic()
+        metrics.inc("script_jobs_total", outcome=status if error != "deadline exceeded" else "deadline")
+        metrics.observe("script_job_seconds", job.finished_at - job.created_at, outcome=status)
+        try:
+            on_complete(job, result_factory())
+        except Exception as e:
+            print(f"!!! ERROR completing script job {job.job_id}: {e}")
+        finally:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(job.status == JOB_QUEUED for job in jobs),
+            "running": sum(job.status == JOB_RUNNING for job in jobs),
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_script_jobs():
+    '''
+    Process-wide script generation queue configured from the environment:
+        SCRIPT_JOB_WORKERS   số job sinh kịch bản chạy đồng thời (mặc định: 2)
+        SCRIPT_JOB_DEADLINE  số giây tối đa cho một job, kể cả thời gian chờ (mặc định: 180, 0 = không giới hạn)
+    '''
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = ScriptJobQueue(
+                    workers=int(os.getenv("SCRIPT_JOB_WORKERS", 2)),
+                    deadline=float(os.getenv("SCRIPT_JOB_DEADLINE", 180)),
+                )
+    return _queue
@@ -0,0 +1,248 @@
+"""
+Library of pre-generated scripts and roles, keyed by (problem_id, normalized keywords, prompt version).
+
+Warm it for every problem in problems.yaml:
+    python -m flow.utils.script_store --variants 3
+    python -m flow.utils.script_store --problems 1 2 --keywords "đạo hàm, bảng biến thiên"
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+from flow.utils.helpers import load_yaml
+
+load_dotenv()
+
+CONFIG_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "crews", "config")
+# Agent và task dùng để sinh kịch bản: đổi prompt của chúng = phiên bản mới, kịch bản cũ không được dùng lại
+SCRIPT_PROMPTS = (("ScriptWriter", "write_script"), ("RolesWriter", "write_roles"))
+# Kịch bản của ScriptPlannerFlow còn qua các vòng đánh giá/tối ưu và chú thích
+PLANNER_PROMPTS = SCRIPT_PROMPTS + (
+    ("ScriptEvaluator", "evaluate_script"), ("ScriptOptimizer", "optimize_script"), ("ScriptAnalyst", "annotate_script"),
+)
+FLOW_PROMPTS = {"generation": SCRIPT_PROMPTS, "planner": PLANNER_PROMPTS}
+
+
+def normalize_keywords(keywords):
+    '''Keywords as a sorted, de-duplicated, lower-case tuple: "Đạo hàm,  bảng biến thiên" == ["bảng biến thiên", "đạo hàm"].'''
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    return tuple(sorted({" ".join(str(keyword).lower().split()) for keyword in keywords or []} - {""}))
+
+
+def prompt_version(config_folder=CONFIG_FOLDER, flow="generation"):
+    '''Hash of the agent and task configs that write scripts and roles with `flow` ('generation' or 'planner').'''
+    if flow not in FLOW_PROMPTS:
+        raise ValueError(f"Invalid script flow '{flow}', expected one of {tuple(FLOW_PROMPTS)}")
+    agents_config = load_yaml(os.path.join(config_folder, "meta_agents.yaml")) or {}
+    tasks_config = load_yaml(os.path.join(config_folder, "tasks.yaml")) or {}
+    payload = json.dumps(
+        [flow] + [[agents_config.get(agent_name), tasks_config.get(task_name)]
+                  for agent_name, task_name in FLOW_PROMPTS[flow]],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+class ScriptStore:
+    '''
+    Disk-backed store of (script, roles) variants.
+    Each key is a directory <store_dir>/<key>/ holding up to `variants` files named by the sha256 of their content,
+    so generating the same script twice stores it once. New sessions sample one variant at random.
+    '''
+
+    def __init__(self, store_dir, variants=3, flow="generation", version=None):
+        self.store_dir = store_dir
+        self.variants = variants
+        self.flow = flow
+        self.version = version or prompt_version(flow=flow)
+        self._index = None  # key -> [variant file names]
+        self._bytes = 0  # tổng kích thước các biến thể trên đĩa, cập nhật khi thêm
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    def key(self, problem_id, keywords):
+        payload = json.dumps([str(problem_id), normalize_keywords(keywords), self.version], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if not os.path.isdir(self.store_dir):
+            self._publish_locked()
+            return
+        for key in os.listdir(self.store_dir):
+            folder = os.path.join(self.store_dir, key)
+            if os.path.isdir(folder):
+                self._index[key] = sorted(name for name in os.listdir(folder) if name.endswith(".json"))
+                for name in self._index[key]:
+                    try:
+                        self._bytes += os.path.getsize(os.path.join(folder, name))
+                    except OSError:
+                        pass
+        self._publish_locked()
+
+    def _publish_locked(self):
+        '''Export the size of the store as gauges on /metrics.'''
+        metrics.set_gauge("script_store_keys", len(self._index), flow=self.flow)
+        metrics.set_gauge("script_store_variants", sum(len(names) for names in self._index.values()), flow=self.flow)
+        metrics.set_gauge("script_store_bytes", self._bytes, flow=self.flow)
+
+    def publish_metrics(self):
+        '''Load the index if needed and refresh the script_store_* gauges (called by /metrics).'''
+        with self._lock:
+            self._load_index()
+            self._publish_locked()
+
+    def count(self, problem_id, keywords=()):
+        with self._lock:
+            self._load_index()
+            return len(self._index.get(self.key(problem_id, keywords), []))
+
+    def sample(self, problem_id, keywords=()):
+        '''Return a random stored (script, roles) for the key, or None on a miss.'''
+        key = self.key(problem_id, keywords)
+        with self._lock:
+            self._load_index()
+            names = list(self._index.get(key, []))
+        random.shuffle(names)
+        for name in names:
+            try:
+                with open(os.path.join(self.store_dir, key, name), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            with self._lock:
+                self._stats["hits"] += 1
+            metrics.inc("script_store_lookups_total", hit=True)
+            return entry["script"], entry["roles"]
+        with self._lock:
+            self._stats["misses"] += 1
+        metrics.inc("script_store_lookups_total", hit=False)
+        return None
+
+    def add(self, problem_id, keywords, script, roles, variants=None):
+        '''Store a generated variant; return False when it is a duplicate or the key already has enough variants.'''
+        key = self.key(problem_id, keywords)
+        content = json.dumps({"script": script, "roles": roles}, sort_keys=True, ensure_ascii=False)
+        name = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16] + ".json"
+        entry = {
+            "problem_id": str(problem_id),
+            "keywords": normalize_keywords(keywords),
+            "prompt_version": self.version,
+            "created_at": time.time(),
+            "script": script,
+            "roles": roles,
+        }
+        with self._lock:
+            self._load_index()
+            names = self._index.setdefault(key, [])
+            if name in names or len(names) >= (variants or self.variants):
+                return False
+            folder = os.path.join(self.store_dir, key)
+            os.makedirs(folder, exist_ok=True)
+            tmp_path = os.path.join(folder, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, os.path.join(folder, name))
+            names.append(name)
+            self._bytes += os.path.getsize(os.path.join(folder, name))
+            self._stats["writes"] += 1
+            self._publish_locked()
+        return True
+
+    def warm(self, problems, generate, keywords=(), variants=None):
+        '''
+        Generate the missing variants for each problem id in `problems` ({id: {"problem", "solution"}}).
+        generate(problem, solution, keywords) returns (script, roles). Return the number of variants added.
+        '''
+        variants = variants or self.variants
+        added = 0
+        for problem_id, problem_data in problems.items():
+            # Số lần thử giới hạn: kịch bản trùng lặp không được tính là biến thể mới
+            for _ in range(max(0, variants - self.count(problem_id, keywords)) * 2):
+                if self.count(problem_id, keywords) >= variants:
+                    break
+                try:
+                    script, roles = generate(problem_data.get("problem", ""), problem_data.get("solution", ""),
+                                             list(normalize_keywords(keywords)))
+                except Exception as e:
+                    print(f"--- SCRIPT STORE: Generation failed for problem {problem_id}: {e}")
+                    continue
+                if script and roles and self.add(problem_id, keywords, script, roles, variants):
+                    added += 1
+                    print(f"--- SCRIPT STORE: Problem {problem_id}: {self.count(problem_id, keywords)}/{variants} variants")
+        return added
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "flow": self.flow,
+                "prompt_version": self.version,
+                "keys": len(self._index),
+                "variants": sum(len(names) for names in self._index.values()),
+                "bytes": self._bytes,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_script_store():
+    '''
+    Process-wide script store configured from the environment:
+        SCRIPT_STORE_DIR       thư mục lưu kịch bản sinh sẵn (mặc định: .cache/scripts)
+        SCRIPT_STORE_VARIANTS  số biến thể tối đa cho mỗi (bài toán, từ khóa, phiên bản prompt) (mặc định: 3)
+        SCRIPT_STORE_FLOW      flow đã sinh các kịch bản được dùng: generation | planner (mặc định: generation)
+    '''
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ScriptStore(
+                    store_dir=os.getenv("SCRIPT_STORE_DIR", ".cache/scripts"),
+                    variants=int(os.getenv("SCRIPT_STORE_VARIANTS", 3)),
+                    flow=os.getenv("SCRIPT_STORE_FLOW", "generation"),
+                )
+    return _store
+
+
+def generate_variant(problem, solution, keywords):
+    '''Generate one (script, roles) variant with the script generation flow.'''
+    from flow.scriptGenerationFlow import generate_script_and_roles
+
+    return generate_script_and_roles(problem=problem, solution=solution, keywords=keywords)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate scripts and roles for the problems in problems.yaml.")
+    parser.add_argument("--problems", nargs="*", help="Problem ids to warm (default: all)")
+    parser.add_argument("--keywords", default="", help="Comma-separated keywords the variants are generated for")
+    parser.add_argument("--variants", type=int, default=None, help="Variants per problem (default: SCRIPT_STORE_VARIANTS)")
+    args = parser.parse_args()
+
+    problems = load_yaml(os.path.join(CONFIG_FOLDER, "problems.yaml")) or {}
+    if args.problems:
+        problems = {problem_id: problems[problem_id] for problem_id in args.problems if problem_id in problems}
+    store = get_script_store()
+    if store.flow != "generation":
+        parser.error(f"SCRIPT_STORE_FLOW={store.flow}: use `python -m flow.batch_scripts --flow {store.flow}` instead")
+    added = store.warm(problems, generate_variant, keywords=args.keywords, variants=args.variants)
+    print(f"Added {added} variants. Store: {store.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+
+load_dotenv()
+
+# Các thao tác được gửi tới luồng ghi
+_WRITE = "write"
+_TRUNCATE = "truncate"
+_CLOSE = "close"
+_FLUSH = "flush"
+
+
+class SessionLogWriter:
+    '''
+    Writes session logs on one background thread, so turn processing never touches the disk.
+
+    Callers only enqueue (write/truncate return immediately). The writer keeps one open handle per log file
+    (at most `max_open_files`, least recently used are closed), flushes and fsyncs every `fsync_interval` seconds,
+    and rotates a file to <name>.1 ... <name>.<backup_count> when it grows past `max_bytes`.
+    The queue holds at most `max_pending` messages; when the disk cannot keep up, new messages are dropped and counted
+    rather than blocking the turn.
+    '''
+
+    def __init__(self, max_pending=10000, fsync_interval=5.0, max_bytes=10 * 1024 * 1024, backup_count=3,
+                 max_open_files=64):
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_open_files = max_open_files
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._handles = OrderedDict()  # path -> file, chỉ luồng ghi truy cập
+        self._dirty = set()
+        self._stats = {"writes": 0, "bytes": 0, "dropped": 0, "rotations": 0, "fsyncs": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="session-log-writer", daemon=True)
+        self._thread.start()
+
+    # --- API cho luồng xử lý lượt hội thoại (không chặn) ---
+
+    def write(self, path, text):
+        '''Append text to the log file at path.'''
+        self._enqueue((_WRITE, path, text, None))
+
+    def truncate(self, path, text=""):
+        '''Replace the content of the log file at path with text (e.g. the header of a new session).'''
+        self._enqueue((_TRUNCATE, path, text, None))
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+            metrics.inc("session_log_dropped_total")
+
+    # --- Đồng bộ: dùng khi xóa phiên, khi tắt ứng dụng hoặc trong test ---
+
+    def close(self, path, timeout=5.0):
+        '''Write what is pending for path and close its handle (before the file is deleted or moved).'''
+        return self._barrier(_CLOSE, path, timeout)
+
+    def flush(self, timeout=5.0):
+        '''Block until every message queued so far is written and fsynced; return False on timeout.'''
+        return self._barrier(_FLUSH, None, timeout)
+
+    def _barrier(self, op, path, timeout):
+        done = threading.Event()
+        try:
+            self._queue.put((op, path, None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    # --- Luồng ghi ---
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            timeout = max(0.0, self.fsync_interval - (time.monotonic() - last_sync)) if self.fsync_interval else None
+            try:
+                op, path, text, done = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                op = None
+            try:
+                if op == _WRITE:
+                    self._append(path, text)
+                elif op == _TRUNCATE:
+                    self._close_handle(path)
+                    self._append(path, text, mode="w")
+                elif op == _CLOSE:
+                    self._close_handle(path)
+                elif op == _FLUSH:
+                    self._sync()
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                print(f"!!! ERROR writing session log {path}: {e}")
+            finally:
+                if op is not None and done is not None:
+                    done.set()
+            if self.fsync_interval and time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync()
+                last_sync = time.monotonic()
+
+    def _handle(self, path, mode="a"):
+        handle = self._handles.get(path)
+        if handle is None:
+            dir_name = os.path.dirname(path)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            handle = open(path, mode, encoding="utf-8")
+            self._handles[path] = handle
+            while len(self._handles) > self.max_open_files:
+                self._close_handle(next(iter(self._handles)))
+        self._handles.move_to_end(path)
+        return handle
+
+    def _append(self, path, text, mode="a"):
+        handle = self._handle(path, mode)
+        if text:
+            handle.write(text)
+            self._dirty.add(path)
+            with self._stats_lock:
+                self._stats["writes"] += 1
+                self._stats["bytes"] += len(text)
+        if self.max_bytes and handle.tell() > self.max_bytes:
+            self._rotate(path)
+
+    def _rotate(self, path):
+        self._close_handle(path)
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        with self._stats_lock:
+            self._stats["rotations"] += 1
+
+    def _close_handle(self, path):
+        handle = self._handles.pop(path, None)
+        if handle is not None:
+            handle.flush()
+            os.fsync(handle.fileno())
+            handle.close()
+            self._dirty.discard(path)
+
+    def _sync(self):
+        for path in list(self._dirty):
+            handle = self._handles.get(path)
+            if handle is not None:
+                handle.flush()
+                os.fsync(handle.fileno())
+        if self._dirty:
+            with self._stats_lock:
+                self._stats["fsyncs"] += 1
+        self._dirty.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            return {**self._stats, "pending": self._queue.qsize(), "open_files": len(self._handles)}
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_session_log():
+    '''
+    Process-wide session log writer configured from the environment:
+        SESSION_LOG_MAX_PENDING     số dòng log tối đa đang chờ ghi, vượt quá thì bỏ và đếm (mặc định: 10000)
+        SESSION_LOG_FSYNC_INTERVAL  số giây giữa hai lần flush + fsync (mặc định: 5, 0 = chỉ khi đóng file)
+        SESSION_LOG_MAX_BYTES       kích thước tối đa của một file log trước khi xoay vòng (mặc định: 10MB, 0 = không xoay)
+        SESSION_LOG_BACKUP_COUNT    số file cũ giữ lại khi xoay vòng: <log>.1 ... <log>.N (mặc định: 3)
+    '''
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = SessionLogWriter(
+                    max_pending=int(os.getenv("SESSION_LOG_MAX_PENDING", 10000)),
+                    fsync_interval=float(os.getenv("SESSION_LOG_FSYNC_INTERVAL", 5)),
+                    max_bytes=int(os.getenv("SESSION_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                    backup_count=int(os.getenv("SESSION_LOG_BACKUP_COUNT", 3)),
+                )
+                atexit.register(_writer.flush)
+    return _writer
@@ -1,6 +1,9 @@
 import time
 from flask_socketio import emit
 
+from flow.utils.spans import traced
+
+@traced("socketio.emit", event="new_message")
 def send_message_via_socketio(message_data, session_id):
     """
     Send a message via Socket.IO to clients in the session room.
@@ -16,6 +19,7 @@ def send_message_via_socketio(message_data, session_id):
         'timestamp': int(time.time() * 1000)
     }, room=session_id, namespace='/')
 
+@traced("socketio.emit", event="agent_status")
 def send_agent_status_via_socketio(agent_name, status, session_id):
     """
     Send an agent status update via Socket.IO to clients in the session room.
@@ -36,6 +40,7 @@ def send_agent_status_via_socketio(agent_name, status, session_id):
     
     emit('agent_status', status_data, room=session_id, namespace='/')
 
+@traced("socketio.emit", event="stage_update")
 def send_stage_update_via_socketio(stage_data, session_id):
     """
     Send a stage update via Socket.IO to clients in the session room.
@@ -52,6 +57,7 @@ def send_stage_update_via_socketio(stage_data, session_id):
     
     emit('stage_update', update_data, room=session_id, namespace='/')
     
+@traced("socketio.emit", event="system_status")
 def send_system_status(message, session_id):
     """
     Send a system status message via Socket.IO to clients in the session room.
@@ -68,4 +74,21 @@ def send_system_status(message, session_id):
         'timestamp': int(time.time() * 1000)
     }
     
-    emit('system_status', status_data, room=session_id, namespace='/')
\ No newline at end of file
+    emit('system_status', status_data, room=session_id, namespace='/')
+
+@traced("socketio.emit", event="script_status")
+def send_script_status(job_status, session_id):
+    """
+    Send the progress of a session's script generation job via Socket.IO to clients in the session room.
+
+    Args:
+        job_status (dict): The job status ('status', 'step', 'error')
+        session_id (str): The session ID to send the status to
+    """
+    status_data = {
+        'source': 'system',
+        'content': job_status,
+        'timestamp': int(time.time() * 1000)
+    }
+
+    emit('script_status', status_data, room=session_id, namespace='/')
@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from flow.utils import metrics
+from flow.utils.session_log import get_session_log
+
+load_dotenv()
+
+# Bucket cho thời gian của span (giây): từ một lần emit Socket.IO tới cả một lượt hội thoại
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("name", "labels", "span_id", "trace_id", "parent_id", "started_at", "start_time")
+
+    def __init__(self, name, labels, parent):
+        self.name = name
+        self.labels = labels
+        self.span_id = next(_span_ids)
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.started_at = time.perf_counter()
+        self.start_time = time.time()
+
+
+class Tracer:
+    '''
+    Lightweight spans: each one is timed into the `span_seconds{span=..., <labels>}` histogram (served on /metrics)
+    and, when `export_file` is set, written as one JSON line (trace/parent ids, start, duration, labels) through
+    the background session log writer. Nesting follows the current asyncio task / thread via a context variable,
+    so the thinkers of a turn are children of that turn's span. Labels known only at the end (e.g. the agent that
+    spoke) can be set on `span.labels` inside the block.
+    '''
+
+    def __init__(self, export_file=""):
+        self.export_file = export_file
+
+    @contextmanager
+    def span(self, name, **labels):
+        span = Span(name, labels, _current_span.get())
+        token = _current_span.set(span)
+        status = "ok"
+        try:
+            yield span
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span, time.perf_counter() - span.started_at, status)
+
+    def _finish(self, span, duration, status):
+        metrics.observe("span_seconds", duration, buckets=SPAN_BUCKETS, span=span.name, **span.labels)
+        if status != "ok":
+            metrics.inc("span_errors_total", span=span.name, status=status)
+        if self.export_file:
+            get_session_log().write(self.export_file, json.dumps({
+                "name": span.name, "trace": span.trace_id, "span": span.span_id, "parent": span.parent_id,
+                "start": span.start_time, "duration": duration, "status": status, **span.labels
+            }, ensure_ascii=False, default=str) + "\n")
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    '''
+    Process-wide tracer configured from the environment:
+        SPAN_EXPORT_FILE  file JSONL nhận mọi span đã kết thúc (mặc định: rỗng = chỉ đo histogram cho /metrics)
+    '''
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(export_file=os.getenv("SPAN_EXPORT_FILE", ""))
+    return _tracer
+
+
+def span(name, **labels):
+    '''Time a block as a span: `with span("dialogue.think_agent", agent=name): ...` (sync or async code).'''
+    return get_tracer().span(name, **labels)
+
+
+def traced(name, **labels):
+    '''Decorator form of span() for plain and async functions (DB calls, emits).'''
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **labels):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
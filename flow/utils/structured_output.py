@@ -0,0 +1,57 @@
+import json
+import re
+from functools import lru_cache
+
+from pydantic import BaseModel, TypeAdapter
+
+from flow.utils import metrics
+from flow.utils.helpers import clean_response, parse_json_response
+from flow.utils.json_extract import extract_json
+
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+
+class OutputValidationError(ValueError):
+    '''Raised when an LLM output still does not match its schema after the re-ask.'''
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema):
+    return TypeAdapter(schema)
+
+
+def _load(raw):
+    '''
+    Strict JSON first, then the first JSON value embedded in surrounding prose;
+    the legacy regex repair is only a fallback and is counted.
+    '''
+    text = _FENCE_RE.sub('', raw)
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    data = extract_json(text)
+    if data is not None:
+        return data
+    metrics.inc("llm_output_repairs_total")
+    data = parse_json_response(clean_response(raw))
+    if data is None:
+        raise ValueError(f"Output is not JSON: {raw[:200]!r}")
+    return data
+
+
+def parse_structured(raw, schema, structured=None):
+    '''
+    Validate an LLM output against `schema` (a pydantic model or e.g. list[Model]) and return it as plain
+    dicts/lists. `structured` is the pydantic object already produced by the provider's structured output
+    (CrewOutput.pydantic), used as is when present. Raises ValueError (incl. pydantic ValidationError).
+    '''
+    if isinstance(structured, BaseModel) and isinstance(schema, type) and isinstance(structured, schema):
+        return structured.model_dump()
+    return validate_structured(_load(raw), schema)
+
+
+def validate_structured(data, schema):
+    '''Validate already decoded JSON (e.g. a value found by JSONStreamExtractor) against `schema`.'''
+    adapter = _adapter(schema)
+    return adapter.dump_python(adapter.validate_python(data))
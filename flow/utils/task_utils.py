@@ -1,68 +1,135 @@
-def track_task(stage_state: dict, current_stage_id: str, script: dict):
+TASK_LEGEND = "Đây là các nhiệm vụ cần thực hiện, [X] là task đã làm xong, [] là task chưa làm, [!] là task tiếp theo cần tập trung:"
+# Số mô tả stage đã ghép được giữ lại cho mỗi kịch bản (mỗi trạng thái hoàn thành của một stage là một mô tả)
+MAX_CACHED_DESCRIPTIONS = 256
+
+
+class CompiledStage:
+    '''One stage of a script (described by `description`, or `goal` in Claude SDK scripts) with its task ids and
+    pre-rendered task lines.'''
+    __slots__ = ("stage_id", "name", "description", "task_ids", "task_id_set", "done_lines", "next_lines",
+                 "todo_lines", "header", "footer", "initial_description")
+
+    def __init__(self, stage_id, stage):
+        self.stage_id = stage_id
+        self.name = stage.get("name", "")
+        # Kịch bản của Claude SDK (SIMPLE_SCRIPT) mô tả stage bằng `goal` thay vì `description`
+        self.description = stage["description"] if "description" in stage else stage.get("goal", "")
+        # Task thiếu id/description vẫn được hiển thị (rỗng) thay vì làm hỏng cả phiên
+        tasks = [{"id": task.get("id", ""), "description": task.get("description", "")}
+                 for task in stage.get("tasks") or []]
+        self.task_ids = tuple(task["id"] for task in tasks)
+        self.task_id_set = frozenset(self.task_ids)
+        # Ba cách hiển thị của mỗi task, giữ nguyên từng ký tự của mô tả cũ để prompt (và cache LLM) không đổi
+        self.done_lines = tuple(f'''
+                [X] [{task["id"]}] {task["description"]}
+                ''' for task in tasks)
+        self.next_lines = tuple(f'''
+                [!] [{task["id"]}] {task["description"]}
+                    ''' for task in tasks)
+        self.todo_lines = tuple(f'''
+                [] [{task["id"]}] {task["description"]}
+                    ''' for task in tasks)
+        self.header = f'''
+        Name: {self.name}
+        Description: {self.description}
+        {TASK_LEGEND}
+        Tasks:
+        '''
+        self.footer = '''
+        '''
+        self.initial_description = f'''
+    Name: {self.name}
+    Description: {self.description}
+    {TASK_LEGEND}
+    Tasks:
+    ''' + "".join(f'''
+        [!] [{task["id"]}] {task["description"]}
+    ''' for task in tasks[:1]) + "".join(f'''
+        [] [{task["id"]}] {task["description"]}
+        ''' for task in tasks[1:])
+
+
+class CompiledScript:
     '''
-    Track the task for the current stage.
-    Return the current stage description.
+    A script compiled once per session: stage order, task-id sets and pre-rendered task lines.
+    Stage descriptions are assembled from the cached lines and memoized per (stage, completed tasks of the stage),
+    so tracking a turn is O(tasks of the stage) set lookups instead of re-rendering the stage.
     '''
-    print("stage_state ", stage_state)
-    completed_task_ids = stage_state["completed_task_ids"]
-    signal = stage_state["signal"]
-    all_task_ids = [task["id"] for task in script[current_stage_id]["tasks"]]
-    max_number_of_stage = len(script.keys())
-    uncompleted_task_ids = [task_id for task_id in all_task_ids if task_id not in completed_task_ids]
-    next_stage_id = str(int(current_stage_id) + 1)
-    
-    # signal = 3 means the move to the next stage
-    if len(uncompleted_task_ids) == 0 and signal[0] == "3" and int(next_stage_id) <= max_number_of_stage:
-        return initialize_task(script, next_stage_id), completed_task_ids, next_stage_id
-    
-    else:
-        task_status = []
-        next_task_id = None
-        for i, task_id in enumerate(all_task_ids):
-            if task_id in completed_task_ids:
-                task_status.append(f'''
-                [X] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
-                ''')
-            else:
-                if next_task_id is None:
-                    next_task_id = task_id
-                    task_status.append(f'''
-                [!] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
-                    ''')
+
+    def __init__(self, script):
+        self.script = script
+        self.stage_ids = tuple(script.keys())
+        self.stages = {stage_id: CompiledStage(stage_id, stage) for stage_id, stage in script.items()}
+        self._descriptions = {}
+
+    def __contains__(self, stage_id):
+        return stage_id in self.stages
+
+    def initial_description(self, stage_id):
+        '''Description of a stage that was just entered: the first task is the one to focus on.'''
+        return self.stages[stage_id].initial_description
+
+    def stage_description(self, stage_id, completed_task_ids):
+        '''Description of a stage with its tasks marked done [X], next [!] or to do [].'''
+        stage = self.stages[stage_id]
+        completed = stage.task_id_set.intersection(completed_task_ids)
+        key = (stage_id, completed)
+        description = self._descriptions.get(key)
+        if description is None:
+            lines = []
+            next_found = False
+            for i, task_id in enumerate(stage.task_ids):
+                if task_id in completed:
+                    lines.append(stage.done_lines[i])
+                elif not next_found:
+                    next_found = True
+                    lines.append(stage.next_lines[i])
                 else:
-                    task_status.append(f'''
-                [] [{task_id}] {script[current_stage_id]["tasks"][i]["description"]}
-                    ''')
-        task_status = "\n".join(task_status)
-        current_stage_description = f'''
-        Name: {script[current_stage_id]["name"]}
-        Description: {script[current_stage_id]["description"]}
-        Đây là các nhiệm vụ cần thực hiện, [X] là task đã làm xong, [] là task chưa làm, [!] là task tiếp theo cần tập trung:
-        Tasks:
-        {task_status}
+                    lines.append(stage.todo_lines[i])
+            description = stage.header + "\n".join(lines) + stage.footer
+            if len(self._descriptions) >= MAX_CACHED_DESCRIPTIONS:
+                self._descriptions.clear()
+            self._descriptions[key] = description
+        return description
+
+    def track(self, stage_state, current_stage_id):
         '''
-        return current_stage_description, completed_task_ids, current_stage_id
+        Track the tasks of the current stage.
+        Return (current stage description, completed task ids, current stage id), moving to the next stage when all
+        tasks are done and the StageManager signals it (signal 3).
+        '''
+        completed_task_ids = stage_state["completed_task_ids"]
+        signal = stage_state["signal"]
+        stage = self.stages[current_stage_id]
+        next_stage_id = str(int(current_stage_id) + 1)
+
+        # signal = 3 means the move to the next stage
+        if (stage.task_id_set.issubset(completed_task_ids) and signal[0] == "3"
+                and int(next_stage_id) <= len(self.stage_ids)):
+            return self.initial_description(next_stage_id), completed_task_ids, next_stage_id
+        return self.stage_description(current_stage_id, completed_task_ids), completed_task_ids, current_stage_id
 
-def initialize_task(script: dict, current_stage_id: str):
+
+def compile_script(script):
+    '''Return `script` as a CompiledScript (unchanged when it already is one).'''
+    return script if isinstance(script, CompiledScript) else CompiledScript(script)
+
+
+def track_task(stage_state: dict, current_stage_id: str, script):
     '''
-    Initialize the task description for the current stage.
+    Track the task for the current stage.
+    `script` is the script dict or, to avoid recompiling it every turn, its CompiledScript.
     Return the current stage description.
     '''
-    current_stage_description = f'''
-    Name: {script[current_stage_id]["name"]}
-    Description: {script[current_stage_id]["description"]}
-    Đây là các nhiệm vụ cần thực hiện, [X] là task đã làm xong, [] là task chưa làm, [!] là task tiếp theo cần tập trung:
-    Tasks:
+    print("stage_state ", stage_state)
+    return compile_script(script).track(stage_state, current_stage_id)
+
+def initialize_task(script, current_stage_id: str):
     '''
-    tasks = script[current_stage_id]["tasks"]
-    current_stage_description += f'''
-        [!] [{tasks[0]["id"]}] {tasks[0]["description"]}
+    Initialize the task description for the current stage.
+    Return the current stage description.
     '''
-    for task in tasks[1:]:
-        current_stage_description += f'''
-        [] [{task["id"]}] {task["description"]}
-        '''
-    return current_stage_description
+    return compile_script(script).initial_description(current_stage_id)
 
 # print(initialize_task(load_yaml("macls/src/macls/crews/classmate_crew/config/base_script.yaml"), "2"))
 # stage_state = {"completed_task_ids": ["2.1", "2.2"], "signal": "3"}
@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from flow.utils.spans import span
+
+
+class PhaseTimer:
+    '''
+    Records the start/end of each phase of a turn (relative to the start of the turn),
+    so that the critical path can be compared with the sum of all phases run back to back.
+    With `span_prefix`, each phase is also a span "<prefix>.<phase>" (histogram on /metrics).
+    '''
+
+    def __init__(self, span_prefix=None):
+        self.span_prefix = span_prefix
+        self.turn_started_at = time.perf_counter()
+        self.phases = {}  # phase name -> [start, end] (giây, tính từ đầu lượt)
+
+    def start_turn(self):
+        self.turn_started_at = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            with span(f"{self.span_prefix}.{name}", **labels) if self.span_prefix else nullcontext():
+                yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        start -= self.turn_started_at
+        end -= self.turn_started_at
+        if name in self.phases:
+            # Một phase chạy nhiều lần trong lượt (ví dụ chạy lại thinker) được gộp thành một khoảng
+            start = min(start, self.phases[name][0])
+            end = max(end, self.phases[name][1])
+        self.phases[name] = [start, end]
+
+    def durations(self):
+        return {name: end - start for name, (start, end) in self.phases.items()}
+
+    def summary(self):
+        '''
+        Return per-phase durations, the critical path (wall time from the first phase start to the
+        last phase end) and the sequential total (sum of phase durations).
+        '''
+        durations = self.durations()
+        if not self.phases:
+            return {"phases": {}, "critical_path": 0.0, "sequential": 0.0, "saved": 0.0}
+        critical_path = max(end for _, end in self.phases.values()) - min(start for start, _ in self.phases.values())
+        sequential = sum(durations.values())
+        return {
+            "phases": durations,
+            "critical_path": critical_path,
+            "sequential": sequential,
+            "saved": max(0.0, sequential - critical_path),
+        }
+
+    def format_summary(self):
+        summary = self.summary()
+        phases = " ".join(f"{name}={duration:.2f}s" for name, duration in summary["phases"].items())
+        return (f"Phase timings: {phases} | critical path {summary['critical_path']:.2f}s "
+                f"(sequential {summary['sequential']:.2f}s, saved {summary['saved']:.2f}s)")
@@ -0,0 +1,337 @@
+"""
+Structured session traces: one JSON line per turn phase instead of free-text session logs.
+
+Every record has the same leading keys, so a reader can filter lines before parsing them:
+    {"phase": ..., "session": ..., "turn": ..., "ts": ..., "v": 1, ...phase fields}
+
+Phases:
+    session   script, participants and opening conversation (first line of a session)
+    message   a message from the user (or any sender outside the flow): sender, text, time
+    stage     stage_state returned by the StageManager, stage_id, stage_changed, skipped
+    think     thoughts: [{agent, inner_thought}], mode
+    evaluate  evaluation scores; skipped (the candidates, unscored, when the Evaluator was not called)
+    talk      talker, speech, speculative hit, latency_saved, wasted_tokens
+    turn      talker, tokens per phase and phase timings (PhaseTimer summary)
+stage/think/evaluate/talk also carry their token count and duration.
+
+Usage:
+    python -m flow.utils.traces convert logs/*.log
+    python -m flow.utils.traces read logs --phase evaluate --turns 3 10
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from ast import literal_eval
+
+from flow.utils.session_log import get_session_log
+
+TRACE_VERSION = 1
+PHASES = ("session", "message", "stage", "think", "evaluate", "talk", "turn")
+TRACE_SUFFIX = ".jsonl"
+
+
+def trace_path(log_file):
+    '''Trace file of a session: log_file itself, or its .jsonl sibling for sessions created with a .log file.'''
+    root, ext = os.path.splitext(log_file)
+    return log_file if ext == TRACE_SUFFIX else root + TRACE_SUFFIX
+
+
+def dump_record(phase, session, turn, ts=None, **fields):
+    '''One trace line. The key order is fixed: read_traces() matches "phase" and "session" on the raw line.'''
+    record = {"phase": phase, "session": session, "turn": turn, "ts": time.time() if ts is None else ts,
+              "v": TRACE_VERSION, **fields}
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+
+class TurnTrace:
+    '''
+    Writes the trace of one session through the background session log writer.
+    Phase records of a turn are collected with add() while the phases run, then written together by write_turn()
+    with the final turn number, the phase durations and a closing "turn" record.
+    '''
+
+    def __init__(self, log_file, session_id=""):
+        self.path = trace_path(log_file)
+        self.session_id = session_id
+        self._pending = []  # (phase, fields) của lượt hiện tại
+
+    def start(self, script, participants, conversation):
+        '''First line of a new session (replaces the content of the trace file).'''
+        get_session_log().truncate(self.path, dump_record(
+            "session", self.session_id, 0, script=script, participants=participants, conversation=conversation
+        ))
+
+    def record(self, phase, turn, **fields):
+        '''Write one record right away (messages arrive outside of a turn).'''
+        get_session_log().write(self.path, dump_record(phase, self.session_id, turn, **fields))
+
+    def add(self, phase, **fields):
+        self._pending.append((phase, fields))
+
+    def discard_turn(self):
+        self._pending = []
+
+    def write_turn(self, turn, timings, tokens, **fields):
+        '''
+        Write the collected phase records and the "turn" summary in one append.
+        `timings` is PhaseTimer.summary(); `tokens` maps phase -> tokens spent. A record may set its own
+        tokens/duration (e.g. a thinker re-run, timed as its own phase).
+        '''
+        durations = timings.get("phases", {})
+        now = time.time()
+        lines = [
+            dump_record(phase, self.session_id, turn, now,
+                        **{"tokens": tokens.get(phase, 0), "duration": durations.get(phase), **phase_fields})
+            for phase, phase_fields in self._pending
+        ]
+        lines.append(dump_record("turn", self.session_id, turn, now, tokens={**tokens, "total": sum(tokens.values())},
+                                 timings=timings, **fields))
+        self._pending = []
+        get_session_log().write(self.path, "".join(lines))
+
+
+# --- Đọc trace ---
+
+def trace_files(path):
+    '''
+    Trace files under path (a file or a directory), each with its rotated parts oldest first
+    (<name>.jsonl.3, .2, .1, then <name>.jsonl).
+    '''
+    names = sorted(glob.glob(os.path.join(path, "*" + TRACE_SUFFIX))) if os.path.isdir(path) else [path]
+    files = []
+    for name in names:
+        rotated = [f"{name}.{index}" for index in range(1, 100) if os.path.exists(f"{name}.{index}")]
+        files.extend(reversed(rotated))
+        if os.path.exists(name):
+            files.append(name)
+    return files
+
+
+def read_traces(paths, session=None, phase=None, turns=None, where=None):
+    '''
+    Stream trace records from files or directories, in file order.
+
+    Filters: `session` (id), `phase` (name or collection of names), `turns` ((first, last), inclusive) and
+    `where(record)`. Session and phase are matched on the raw line first, so lines of other phases are never parsed.
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    phases = {phase} if isinstance(phase, str) else set(phase or ())
+    phase_needles = tuple(f'{{"phase": "{name}"' for name in phases)
+    session_needle = f'"session": {json.dumps(session, ensure_ascii=False)},' if session is not None else None
+    for path in paths:
+        for file_name in trace_files(path):
+            with open(file_name, "r", encoding="utf-8") as f:
+                for line in f:
+                    if phase_needles and not line.startswith(phase_needles):
+                        continue
+                    if session_needle is not None and session_needle not in line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # dòng ghi dở khi tiến trình dừng đột ngột
+                    if turns is not None and not turns[0] <= record.get("turn", 0) <= turns[1]:
+                        continue
+                    if where is not None and not where(record):
+                        continue
+                    yield record
+
+
+# --- Chuyển log dạng văn bản cũ sang trace ---
+
+_TURN_RE = re.compile(r"^Turn: (\d+)\.$")
+_STAGE_CHANGED_RE = re.compile(r"^Stage changed to (\S+)$")
+_SPECULATIVE_RE = re.compile(r"^Speculative talk: hit for (.+), latency saved ([\d.]+)s, wasted tokens (\d+)$")
+_MESSAGE_RE = re.compile(r"^TIME=([\d.]+) \| CON#(\d+) \| SENDER=(.*?) \| TEXT=(.*)$", re.DOTALL)
+_TIMINGS_RE = re.compile(r"^Phase timings: (.*?) ?\| critical path ([\d.]+)s "
+                         r"\(sequential ([\d.]+)s, saved ([\d.]+)s\)$")
+_FLOAT_RE = re.compile(r"^-?\d+\.\d+$")
+_BANNER = "================================================="
+
+
+def _is_block_start(line):
+    return bool(_TURN_RE.match(line) or _STAGE_CHANGED_RE.match(line) or _SPECULATIVE_RE.match(line))
+
+
+def _literal(value):
+    '''
+    A value written with str(): lists/dicts and decimal numbers (scores) are read back, everything else stays a string
+    (signal "1" and score "4" were strings).
+    '''
+    if value[:1] in ("[", "{") or _FLOAT_RE.match(value):
+        try:
+            return literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+    return value
+
+
+def _key_values(lines):
+    '''"key: value" lines (values written with str()) back to a dict.'''
+    result = {}
+    for line in lines:
+        key, sep, value = line.strip().partition(":")
+        if sep:
+            result[key] = _literal(value.strip())
+    return result
+
+
+def _parse_message(lines):
+    match = _MESSAGE_RE.match("\n".join(lines).strip("\n"))
+    if match is None:
+        return None
+    return {"time": float(match.group(1)), "con": int(match.group(2)), "sender": match.group(3),
+            "text": match.group(4).rstrip("\n")}
+
+
+def _parse_timings(line):
+    match = _TIMINGS_RE.match(line)
+    if match is None:
+        return None
+    phases = {}
+    for item in match.group(1).split():
+        name, _, duration = item.partition("=")
+        phases[name] = float(duration.rstrip("s"))
+    return {"phases": phases, "critical_path": float(match.group(2)), "sequential": float(match.group(3)),
+            "saved": float(match.group(4))}
+
+
+def _sections(lines, headers):
+    '''Split the lines of a turn block on the given section headers ("Stage state:", ...).'''
+    sections = {}
+    current = None
+    for line in lines:
+        if line in headers:
+            current = line
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return sections
+
+
+def convert_log(lines, session_id=""):
+    '''
+    Turn the lines of an old free-text session log into trace records (dicts), in order.
+    Stage changes and speculative talk reports are attached to the stage/talk records of the turn that follows them.
+    '''
+    lines = [line.rstrip("\n") for line in lines]
+    index = 0
+    # Phần đầu: "Script:" ... "Conversation:" ... cho tới khối đầu tiên
+    header = []
+    while index < len(lines) and not _is_block_start(lines[index]):
+        header.append(lines[index])
+        index += 1
+    sections = _sections(header, {"Script:", "Conversation:"})
+    if sections:
+        yield {"phase": "session", "session": session_id, "turn": 0, "v": TRACE_VERSION,
+               "script_text": "\n".join(sections.get("Script:", [])).strip(),
+               "conversation": "\n".join(sections.get("Conversation:", [])).strip("\n") + "\n"}
+
+    stage_changed_to = None
+    speculative = None
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+        block = []
+        while index < len(lines) and not _is_block_start(lines[index]):
+            block.append(lines[index])
+            index += 1
+
+        match = _STAGE_CHANGED_RE.match(line)
+        if match:
+            stage_changed_to = match.group(1)
+            continue
+        match = _SPECULATIVE_RE.match(line)
+        if match:
+            speculative = {"speculative": True, "latency_saved": float(match.group(2)),
+                           "wasted_tokens": int(match.group(3))}
+            continue
+
+        turn = int(_TURN_RE.match(line).group(1))
+        record = {"session": session_id, "turn": turn, "v": TRACE_VERSION}
+        if not block or block[0].strip() != _BANNER:
+            # Tin nhắn của người dùng (hoặc một lượt của dialogue manager SDK)
+            message = _parse_message(block)
+            if message is not None:
+                yield {"phase": "message", **record, "ts": message["time"], **message}
+            continue
+
+        # Khối lượt của DialogueFlow: stage state, suy nghĩ, đánh giá, lời nói và thời gian từng phase
+        closing = next((i for i in range(1, len(block)) if block[i].strip() == _BANNER), len(block))
+        sections = _sections(block[1:closing], {"Stage state:", "Inner thoughts:", "Evaluation:"})
+        tail = block[closing + 1:]
+        timings = None
+        if tail and tail[-1].startswith("Phase timings:"):
+            timings = _parse_timings(tail.pop())
+        message = _parse_message(tail)
+        if message:
+            record["ts"] = message["time"]
+
+        stage = {"stage_state": _key_values(sections.get("Stage state:", []))}
+        if stage_changed_to is not None:
+            stage.update(stage_id=stage_changed_to, stage_changed=True)
+        yield {"phase": "stage", **record, **stage}
+        thoughts = []
+        for thought_line in sections.get("Inner thoughts:", []):
+            agent, sep, inner_thought = thought_line.partition(": ")
+            if sep:
+                thoughts.append({"agent": agent, "inner_thought": inner_thought})
+        yield {"phase": "think", **record, "thoughts": thoughts}
+        evaluation_lines = "\n".join(sections.get("Evaluation:", [])).strip()
+        evaluation = [_key_values(item.split("\n")) for item in evaluation_lines.split("\n\n") if item.strip()]
+        yield {"phase": "evaluate", **record, "evaluation": evaluation}
+        talker = message["sender"] if message and message["sender"] != "System" else None
+        talk = {"talker": talker, "speech": message["text"] if talker else ""}
+        yield {"phase": "talk", **record, **talk, **(speculative or {"speculative": False})}
+        yield {"phase": "turn", **record, "talker": talker, "timings": timings}
+        stage_changed_to = None
+        speculative = None
+
+
+def convert_log_file(log_file, output=None, session_id=None):
+    '''Convert an old <session>.log into <session>.jsonl (or `output`); return the trace path.'''
+    output = output or trace_path(log_file)
+    if os.path.realpath(output) == os.path.realpath(log_file):
+        raise ValueError(f"{log_file} is already a trace file")
+    session_id = session_id if session_id is not None else os.path.splitext(os.path.basename(log_file))[0]
+    with open(log_file, "r", encoding="utf-8") as f:
+        records = list(convert_log(f, session_id))
+    tmp_path = f"{output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            fields = {key: value for key, value in record.items() if key not in ("phase", "session", "turn", "ts", "v")}
+            f.write(dump_record(record["phase"], record["session"], record["turn"], record.get("ts", 0.0), **fields))
+    os.replace(tmp_path, output)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and query structured session traces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Convert old free-text session logs to JSONL traces")
+    convert.add_argument("logs", nargs="+", help="Old .log files")
+    convert.add_argument("--force", action="store_true", help="Overwrite existing .jsonl files")
+    read = commands.add_parser("read", help="Print matching trace records as JSON lines")
+    read.add_argument("paths", nargs="+", help="Trace files or directories")
+    read.add_argument("--session", help="Session id")
+    read.add_argument("--phase", action="append", choices=PHASES, help="Phase (repeatable)")
+    read.add_argument("--turns", nargs=2, type=int, metavar=("FIRST", "LAST"), help="Turn range, inclusive")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for log_file in args.logs:
+            if os.path.exists(trace_path(log_file)) and not args.force:
+                print(f"Skipping {log_file}: {trace_path(log_file)} exists (use --force)")
+                continue
+            print(f"{log_file} -> {convert_log_file(log_file)}")
+    else:
+        for record in read_traces(args.paths, session=args.session, phase=args.phase, turns=args.turns):
+            print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,22 @@ Replaces the CrewAI-based dialogue flow with a simpler Claude-powered system.
 import asyncio
 import json
 import time
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 from collections import deque
 
 from claude_agent_sdk import ClaudeSDKClient, ClaudeAgentOptions, create_sdk_mcp_server
+from flow.crews.schemas import AgentTurn
+from flow.utils import metrics
+from flow.utils.conversation import Conversation
+from flow.utils.fake_llm import FakeClaudeSDKClient, use_fake_llm
+from flow.utils.helpers import estimate_tokens
+from flow.utils.llm_scheduler import PRIORITY_TALK, get_scheduler
+from flow.utils.json_extract import JSONStreamExtractor
+from flow.utils.spans import span
+from flow.utils.structured_output import parse_structured, validate_structured
+from flow.utils.task_utils import CompiledScript
+from flow.utils.traces import TurnTrace
 from flow_sdk.agent_tools import (
     get_agent_persona,
     get_all_personas,
@@ -19,10 +30,16 @@ from flow_sdk.agent_tools import (
 )
 
 
+# Hỏi lại (tối đa một lần) khi câu trả lời cuối không khớp schema AgentTurn
+REASK_PROMPT = """Your last reply could not be parsed: {error}
+Reply again with ONLY one JSON object matching this JSON schema, with no other text:
+{schema}"""
+
+
 @dataclass
 class DialogueState:
     """State management for the dialogue session."""
-    conversation: str = ""
+    conversation: Conversation = field(default_factory=Conversation)
     participants: List[str] = field(default_factory=lambda: ["Harry", "Hermione", "Ron"])
     turn_number: int = 0
     problem: str = ""
@@ -60,11 +77,12 @@ class ClaudeDialogueManager:
         self.socketio = socketio
         self.session_id = kwargs.get("session_id", "")
         self.user_name = kwargs.get("user_name", "User")
-        self.filename = kwargs.get("filename", f"logs/{self.session_id}.log")
+        self.filename = kwargs.get("filename", f"logs/{self.session_id}.jsonl")
+        self.trace = TurnTrace(self.filename, self.session_id)
 
         # Initialize state
         self.state = DialogueState(
-            conversation=kwargs.get("conversation", ""),
+            conversation=Conversation.parse(kwargs.get("conversation", "")),
             problem=kwargs.get("problem", ""),
             participants=kwargs.get("participants", ["Harry", "Hermione", "Ron"]),
             script=kwargs.get("script", {}),
@@ -73,7 +91,11 @@ class ClaudeDialogueManager:
             inner_thoughts=kwargs.get("inner_thought", deque(maxlen=5))
         )
 
-        # Extract current stage description from script
+        self.state.stage_state = kwargs.get("stage_state") or {}
+        self.state.completed_task_ids = list(self.state.stage_state.get("completed_task_ids", []))
+
+        # Extract current stage description from script (compiled once, shared with DialogueFlow)
+        self.compiled_script = CompiledScript(self.state.script or {})
         self._update_stage_description()
 
         # Create MCP server with custom tools
@@ -104,11 +126,12 @@ class ClaudeDialogueManager:
         )
 
         self._is_cancelled = False
+        self._streamed_values = []  # giá trị JSON tìm được trong câu trả lời gần nhất
         self._processing_lock = asyncio.Lock()
 
-        # Initialize log file
+        # Initialize the session trace
         if self.state.turn_number == 0:
-            self._initialize_log_file()
+            self.trace.start(self.state.script, self.state.participants, self.state.conversation.text)
 
     def _build_system_prompt(self) -> str:
         """Build the system prompt for Claude."""
@@ -148,28 +171,14 @@ Use the provided tools to:
 """
 
     def _update_stage_description(self):
-        """Update current stage description from script."""
-        if self.state.script and self.state.current_stage_id in self.state.script:
-            stage_info = self.state.script[self.state.current_stage_id]
-            self.state.current_stage_description = f"{stage_info.get('goal', '')}\nTasks: {', '.join([t.get('description', '') for t in stage_info.get('tasks', [])])}"
+        """Update current stage description from the compiled script, with the same task markers as DialogueFlow."""
+        if self.state.current_stage_id in self.compiled_script:
+            self.state.current_stage_description = self.compiled_script.stage_description(
+                self.state.current_stage_id, self.state.completed_task_ids
+            )
         else:
             self.state.current_stage_description = "General discussion and problem-solving"
 
-    def _initialize_log_file(self):
-        """Initialize the log file with script information."""
-        with open(self.filename, "w") as f:
-            script_str = "\n\n".join([
-                f"{k}: {v}" for key, value in self.state.script.items()
-                for k, v in value.items()
-            ])
-            f.write(f'Script:\n{script_str}\n\n')
-            f.write(f"Conversation:\n{self.state.conversation}\n")
-
-    def _save_to_log(self, content: str):
-        """Append content to log file."""
-        with open(self.filename, "a") as f:
-            f.write(content)
-
     def _send_agent_status(self, agent_name: str, status: str):
         """Send agent status update via Socket.IO."""
         if self.session_id and self.socketio:
@@ -226,29 +235,27 @@ Use the provided tools to:
                 # Add message to conversation
                 self.state.turn_number += 1
                 timestamp = time.time()
-                message_entry = (
-                    f"TIME={timestamp} | "
-                    f"CON#{self.state.turn_number} | "
-                    f"SENDER={sender_name} | "
-                    f"TEXT={text}\n"
-                )
-                self.state.conversation += message_entry
+                self.state.conversation.append(sender_name, text, self.state.turn_number, timestamp)
 
-                # Log user message
-                self._save_to_log(f"Turn: {self.state.turn_number}.\n{message_entry}\n")
+                # Trace user message
+                self.trace.record("message", self.state.turn_number, sender=sender_name, text=text, time=timestamp)
 
                 # Send status update
                 self._send_system_status("Đang phân tích tin nhắn...")
 
                 # Wait a bit before processing (simulate thinking time)
-                await asyncio.sleep(2)
+                with span("sdk.delay"):
+                    await asyncio.sleep(2)
 
                 # Set all agents to "thinking" status
                 for agent in self.state.participants:
                     self._send_agent_status(agent, "thinking")
 
                 # Process with Claude Agent SDK
-                response_data = await self._generate_agent_turn(text, sender_name)
+                with span("sdk.turn") as turn_span:
+                    response_data = await self._generate_agent_turn(text, sender_name)
+                    # Histogram theo agent: agent chỉ được biết sau khi Claude chọn
+                    turn_span.labels["agent"] = response_data["agent"] if response_data else ""
 
                 # Set all agents back to idle
                 for agent in self.state.participants:
@@ -284,7 +291,7 @@ Use the provided tools to:
 1. Analyze the message and conversation context
 2. Use the evaluate_turn_taking tool to determine which agent (Harry, Hermione, or Ron) should respond next
 3. Use the generate_agent_response tool to create the response from that agent
-4. Respond in this exact JSON format:
+4. Respond with ONLY one JSON object in this exact format:
 {{
     "selected_agent": "agent_name",
     "response": "the agent's response in Vietnamese",
@@ -294,21 +301,43 @@ Use the provided tools to:
 Remember: Stay in character for each agent!
 """
 
-            # Create Claude SDK client
-            async with ClaudeSDKClient(options=self.agent_options) as client:
+            # Create Claude SDK client (sau khi được scheduler chung cấp lượt gửi request)
+            estimated_tokens = estimate_tokens(self.agent_options.system_prompt + prompt) + 512
+            started_at = time.perf_counter()
+            if use_fake_llm():
+                client = FakeClaudeSDKClient(options=self.agent_options, participants=self.state.participants)
+            else:
+                client = ClaudeSDKClient(options=self.agent_options)
+            # Thời gian chờ lượt gửi request đã có trong histogram llm_queue_seconds của scheduler
+            async with get_scheduler().slot_async(PRIORITY_TALK, self.session_id, estimated_tokens), client:
                 # Send the query
-                await client.query(prompt)
-
-                # Collect the response
-                full_response = ""
-                async for message in client.receive_response():
-                    if hasattr(message, 'content'):
-                        for block in message.content:
-                            if hasattr(block, 'text'):
-                                full_response += block.text
-
-                # Parse the response
-                response_data = self._parse_agent_response(full_response)
+                with span("sdk.query"):
+                    await client.query(prompt)
+                    full_response = await self._collect_response(client)
+
+                # Parse the response, asking once more in the same session if it does not match the schema
+                response_data, error = self._parse_agent_response(full_response)
+                if response_data is None:
+                    metrics.inc("llm_structured_outputs_total", task="sdk_turn", valid=False)
+                    metrics.inc("llm_reasks_total", task="sdk_turn")
+                    wasted_tokens = estimate_tokens(full_response)
+                    with span("sdk.reask"):
+                        await client.query(REASK_PROMPT.format(
+                            error=error, schema=json.dumps(AgentTurn.model_json_schema(), ensure_ascii=False)
+                        ))
+                        full_response = await self._collect_response(client)
+                    response_data, error = self._parse_agent_response(full_response)
+                    if response_data is None:
+                        metrics.inc("llm_structured_outputs_total", task="sdk_turn", valid=False)
+                        metrics.inc("llm_wasted_turns_total", task="sdk_turn")
+                        metrics.inc("llm_wasted_tokens_total", estimated_tokens + wasted_tokens
+                                    + estimate_tokens(full_response), task="sdk_turn")
+                        print(f"Could not parse agent response after re-ask: {error}")
+                    else:
+                        metrics.inc("llm_structured_outputs_total", task="sdk_turn", valid=True)
+                        metrics.inc("llm_reask_tokens_total", wasted_tokens, task="sdk_turn")
+                else:
+                    metrics.inc("llm_structured_outputs_total", task="sdk_turn", valid=True)
 
                 if response_data:
                     # Log the agent response
@@ -316,15 +345,15 @@ Remember: Stay in character for each agent!
                     response_text = response_data['response']
 
                     self.state.turn_number += 1
-                    timestamp = time.time()
-                    message_entry = (
-                        f"TIME={timestamp} | "
-                        f"CON#{self.state.turn_number} | "
-                        f"SENDER={agent_name} | "
-                        f"TEXT={response_text}\n"
-                    )
-                    self.state.conversation += message_entry
-                    self._save_to_log(f"Turn: {self.state.turn_number}.\n{message_entry}\n")
+                    self.state.conversation.append(agent_name, response_text, self.state.turn_number)
+                    # Một lần gọi SDK làm cả đánh giá lẫn lời nói: trace chỉ có phase 'talk'
+                    duration = time.perf_counter() - started_at
+                    tokens = {"talk": estimated_tokens + estimate_tokens(full_response)}
+                    self.trace.add("talk", talker=agent_name, speech=response_text,
+                                   reasoning=response_data['reasoning'])
+                    self.trace.write_turn(self.state.turn_number, {
+                        "phases": {"talk": duration}, "critical_path": duration, "sequential": duration, "saved": 0.0
+                    }, tokens, talker=agent_name)
 
                     # Send the message via Socket.IO
                     self._send_message({
@@ -346,43 +375,55 @@ Remember: Stay in character for each agent!
             return None
 
     def _get_recent_conversation(self, num_turns: int = 5) -> str:
-        """Get the most recent conversation turns."""
-        lines = self.state.conversation.strip().split('\n')
-        recent_lines = lines[-num_turns:] if len(lines) > num_turns else lines
-        return '\n'.join(recent_lines)
+        """Get the most recent conversation turns (whole messages, multi-line ones included)."""
+        return self.state.conversation.tail(num_turns).rstrip('\n')
 
-    def _parse_agent_response(self, response_text: str) -> Optional[Dict[str, str]]:
+    async def _collect_response(self, client) -> str:
+        """
+        Concatenate the text blocks of the response to the last query.
+        JSON values are picked out while the blocks stream in (self._streamed_values), so parsing does not
+        rescan the whole response.
+        """
+        full_response = ""
+        extractor = JSONStreamExtractor()
+        async for message in client.receive_response():
+            if hasattr(message, 'content'):
+                for block in message.content:
+                    if hasattr(block, 'text'):
+                        full_response += block.text
+                        extractor.feed(block.text)
+        self._streamed_values = extractor.values
+        return full_response
+
+    def _parse_agent_response(self, response_text: str) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
         """
-        Parse the agent response from Claude.
+        Parse and validate the agent response from Claude against the AgentTurn schema.
+        The last JSON object of the stream that matches the schema wins (earlier text may quote other JSON);
+        otherwise the whole text is parsed to get the error message.
 
         Returns:
-            Dict with 'agent' and 'response' keys, or None if parsing fails
+            (Dict with 'agent', 'response' and 'reasoning' keys, None), or (None, error message) if validation fails
         """
-        try:
-            # Try to find JSON in the response
-            import re
-
-            # Look for JSON object in the response
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
-                json_str = json_match.group(0)
-                data = json.loads(json_str)
-
-                if 'selected_agent' in data and 'response' in data:
-                    return {
-                        'agent': data['selected_agent'],
-                        'response': data['response'],
-                        'reasoning': data.get('reasoning', '')
-                    }
-
-            # If JSON parsing fails, try to extract agent and response heuristically
-            # This is a fallback
-            print(f"Could not parse JSON from response: {response_text[:200]}")
-            return None
-
-        except Exception as e:
-            print(f"Error parsing agent response: {e}")
-            return None
+        data = None
+        for value in reversed(self._streamed_values):
+            try:
+                data = validate_structured(value, AgentTurn)
+                break
+            except ValueError:
+                continue
+        if data is None:
+            try:
+                data = parse_structured(response_text, AgentTurn)
+            except ValueError as e:
+                print(f"Could not parse agent response: {response_text[:200]}")
+                return None, str(e)
+        if data['selected_agent'] not in self.state.participants:
+            return None, f"selected_agent must be one of {self.state.participants}"
+        return {
+            'agent': data['selected_agent'],
+            'response': data['response'],
+            'reasoning': data['reasoning']
+        }, None
 
     def cancel(self):
         """Cancel the dialogue manager."""
@@ -402,7 +443,7 @@ Remember: Stay in character for each agent!
             "script": self.state.script,
             "roles": {},  # Roles are now embedded in the agent personas
             "current_stage_id": self.state.current_stage_id,
-            "conversation": self.state.conversation,
+            "conversation": self.state.conversation.text,
             "log_file": self.filename,
             "stage_state": self.state.stage_state or {
                 "completed_task_ids": [],
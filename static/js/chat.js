@@ -37,6 +37,15 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Get session ID and username from HTML data attributes ---
     const currentSessionId = container?.dataset.sessionId;
     let currentUsername = container?.dataset.userName || '';
+    // 'preparing' while the script of this session is being generated in the background
+    const sessionStatus = container?.dataset.sessionStatus || 'ready';
+    const SCRIPT_STEP_LABELS = {
+        queued: 'Đang chờ tới lượt tạo kịch bản...',
+        running: 'Bắt đầu tạo kịch bản...',
+        write_script: 'Đang viết kịch bản thảo luận...',
+        write_roles: 'Đang tạo vai trò cho các thành viên...',
+    };
+    let lastScriptStep = '';
 
     // --- Check if essential data is present ---
     if (!currentSessionId) {
@@ -217,8 +226,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     statusIconEl.style.animationName = 'none'; // Stop pulsing
                     statusIconEl.style.opacity = '1';          // Ensure dot is solid
                 }
-                messageInput.disabled = false; // Enable input on connection
-                sendButton.disabled = false;
+                // Enable input on connection, unless the script is still being prepared
+                messageInput.disabled = sessionStatus === 'preparing';
+                sendButton.disabled = sessionStatus === 'preparing';
                 break;
             case 'connecting':
                 statusTextEl.textContent = 'Đang kết nối...';
@@ -353,7 +363,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     if (messageInput) messageInput.focus();
                     
                     // Update stage information
-                    if (data.script && data.current_stage_id) {
+                    if (data.script && Object.keys(data.script).length && data.current_stage_id) {
                         currentScript = data.script;
                         currentStageId = data.current_stage_id;
                         completedTaskIds = data.completed_task_ids;
@@ -387,6 +397,30 @@ document.addEventListener('DOMContentLoaded', () => {
         socket.on('joined', (data) => {
             console.log('Successfully joined session:', data.session_id);
         });
+
+        // Progress of the background script generation job
+        socket.on('script_status', (data) => {
+            const job = data.content || {};
+            if (sessionStatus !== 'preparing') return;
+            if (['done', 'fallback', 'ready'].includes(job.status)) {
+                if (job.status === 'fallback') {
+                    alert('Không tạo được kịch bản mới, lớp học sẽ dùng kịch bản mặc định.');
+                }
+                window.location.reload();
+                return;
+            }
+            const step = job.step || job.status;
+            const label = SCRIPT_STEP_LABELS[step];
+            if (label && step !== lastScriptStep) {
+                lastScriptStep = step;
+                if (statusTextEl) statusTextEl.textContent = label;
+                displayMessage({
+                    source: 'System',
+                    content: { text: label, sender_name: 'System' },
+                    timestamp: data.timestamp
+                });
+            }
+        });
         
         socket.on('message_received', (data) => {
             console.log('Message received confirmation:', data);
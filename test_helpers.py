@@ -0,0 +1,343 @@
+"""
+Fuzz tests: the precompiled clean_response/process_content in flow/utils/helpers.py must return exactly
+what the previous regex chain returned (kept in benchmarks/response_cleaning.py as the reference).
+The JSON extractor must find the same values whether the text arrives whole or in chunks.
+Old free-text session logs must convert to the same records the JSONL traces hold.
+The Conversation record list must render exactly the text format the conversation string had.
+Spans must nest across asyncio tasks and show up as histograms in the Prometheus output.
+"""
+import asyncio
+import json
+import os
+import random
+import tempfile
+
+import pytest
+
+from benchmarks.response_cleaning import legacy_clean_response, legacy_process_content, sample_outputs
+from flow.batch_scripts import Checkpoint, plan_units
+from flow.utils import metrics
+from flow.utils.conversation import Conversation
+from flow.utils.helpers import clean_response, fix_missing_commas, is_trivial_message, parse_json_response, process_content
+from flow.utils.json_extract import JSONStreamExtractor, extract_json
+from flow.utils.llm_cache import LLMResponseCache
+from flow.utils.resilience import DeadlineExceeded, is_transient
+from flow.utils.script_store import ScriptStore
+from flow.utils.session_log import get_session_log
+from flow.utils.spans import Tracer
+from flow.utils.traces import TurnTrace, convert_log_file, read_traces
+
+# Các mảnh có thể kích hoạt từng bước (và tương tác giữa các bước) của hai hàm
+FRAGMENTS = [
+    "```", "```json", "```yaml", "```html", "```markdown", "```js", "`", "<\\html>", "</html>", "html>", "<",
+    "\r\n", "\r", "\n", "  ", " ", "\t", " ", "{{", "}}", "{", "}", "\\", "\\\\", '\\"', "\\n", "\\t", "\\u00e9",
+    "\\u12", "\\x", "\\sqrt", "\\sqrt2", "\\sqrtx", "sqrt", "**", "*", "$", "$$", "1.", "12.", "3. ", "٣. ", ".", "•",
+    "• ", "◦", "■", "‣", "a", "đạo hàm", "x", "u", "0", "F", "json", "yaml",
+]
+
+
+def random_text(rng, max_fragments=30):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, max_fragments)))
+
+
+def test_clean_response_matches_legacy():
+    rng = random.Random(42)
+    for _ in range(20000):
+        text = random_text(rng)
+        assert clean_response(text) == legacy_clean_response(text), repr(text)
+
+
+def test_process_content_matches_legacy():
+    rng = random.Random(7)
+    for _ in range(20000):
+        text = random_text(rng)
+        assert process_content(text) == legacy_process_content(text), repr(text)
+
+
+def test_sample_outputs_match_legacy():
+    for name, (function, legacy, text) in sample_outputs().items():
+        assert function(text) == legacy(text), name
+
+
+def test_extract_json_skips_prose_and_strings():
+    assert extract_json('```json\n{"a": "x}{", "b": [1, 2]}\n```') == {"a": "x}{", "b": [1, 2]}
+    assert extract_json('Ghi chú {này} và [X], rồi {"a": 1} sau đó {"b": 2}') == {"a": 1}
+    assert extract_json('Bạn nói "chào {" rồi {"q": "\\"}"}') == {"q": '"}'}
+    assert extract_json('{văn bản {"inner": true} tiếp}') == {"inner": True}
+    assert extract_json('{"a": [1, 2}') is None
+    assert extract_json('[{"a": 1}{"b": 2}]', repair=fix_missing_commas) == [{"a": 1}, {"b": 2}]
+    assert parse_json_response('Mình nghĩ: {"action": "speak"} nhé') == {"action": "speak"}
+
+
+def test_trivial_messages_are_only_fillers():
+    for text in ["haha", "Cảm ơn bạn nhé!", "ừm...", "🙂👍", "thank you"]:
+        assert is_trivial_message(text), text
+    # Câu trả lời cho một câu hỏi có thể hoàn thành task: StageManager vẫn phải chạy
+    for text in ["ok", "đúng rồi", "được", "hiểu rồi", "yes", "no", "x = 2", ""]:
+        assert not is_trivial_message(text), text
+
+
+def test_extractor_streaming_matches_whole_text():
+    rng = random.Random(3)
+    values = [{"selected_agent": "Bob", "response": "f'(x) = {2} \\ \"ok\" [1]"}, [1, {"a": []}], {"x": "}"}]
+    prose = ["Chào ", "{ghi chú} ", "[X] ", '"', "}", "]", "\\", "\n"]
+    for _ in range(2000):
+        text = "".join(rng.choice(prose) if rng.random() < 0.6 else json.dumps(rng.choice(values), ensure_ascii=False)
+                       for _ in range(rng.randint(0, 8)))
+        whole = JSONStreamExtractor().feed(text)
+        extractor = JSONStreamExtractor()
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 7)
+            extractor.feed(text[position:position + size])
+            position += size
+            # Bộ đệm chỉ giữ giá trị đang mở
+            assert extractor._text[:1] in "{[" if extractor.pending else extractor._text == "", repr(text)
+        assert extractor.values == whole, repr(text)
+
+
+OLD_LOG = """Script:
+stage: 1
+
+Conversation:
+TIME=1.0 | CON#0 | SENDER=System | TEXT=Chào mừng
+Turn: 1.
+TIME=2.5 | CON#1 | SENDER=User | TEXT=Xin chào
+
+Speculative talk: hit for Bob, latency saved 1.25s, wasted tokens 40
+Turn: 2.
+================================================= 
+Stage state:
+ completed_task_ids: ['1.1']
+signal: 1
+
+Inner thoughts:
+Bob: {"action": "speak"}
+
+Evaluation:
+name: Bob
+action: speak
+score: 
+internal_score: 4.0
+=================================================
+TIME=3.0 | CON#2 | SENDER=Bob | TEXT=Đạo hàm: $f'(x)$
+dòng 2
+
+Phase timings: stage=1.20s talk=0.50s | critical path 1.50s (sequential 1.70s, saved 0.20s)
+"""
+
+
+def test_convert_log_and_read_traces():
+    with tempfile.TemporaryDirectory() as folder:
+        log_file = os.path.join(folder, "abc.log")
+        with open(log_file, "w", encoding="utf-8") as f:
+            f.write(OLD_LOG)
+        assert convert_log_file(log_file) == os.path.join(folder, "abc.jsonl")
+        records = list(read_traces(folder, session="abc"))
+        assert [r["phase"] for r in records] == ["session", "message", "stage", "think", "evaluate", "talk", "turn"]
+        assert records[1]["text"] == "Xin chào" and records[1]["turn"] == 1
+        assert records[2]["stage_state"] == {"completed_task_ids": ["1.1"], "signal": "1"}
+        assert records[4]["evaluation"] == [{"name": "Bob", "action": "speak", "score": "", "internal_score": 4.0}]
+        talk = records[5]
+        assert talk["talker"] == "Bob" and talk["speech"] == "Đạo hàm: $f'(x)$\ndòng 2" and talk["wasted_tokens"] == 40
+        assert records[6]["timings"]["phases"] == {"stage": 1.2, "talk": 0.5}
+
+        # Trace ghi trực tiếp: các bản ghi phase của lượt được ghi cùng bản ghi tổng kết
+        trace = TurnTrace(os.path.join(folder, "live.log"), "live")
+        trace.start({"1": {"stage": "1"}}, ["Bob"], "")
+        trace.record("message", 1, sender="User", text="hi", time=1.0)
+        trace.add("stage", stage_state={"signal": "1"}, stage_changed=False)
+        trace.add("talk", talker="Bob", speech="chào")
+        trace.write_turn(2, {"phases": {"stage": 0.5, "talk": 1.0}}, {"stage": 10, "talk": 20}, talker="Bob")
+        assert get_session_log().flush()
+        assert [r["phase"] for r in read_traces(folder, phase=["stage", "turn"])] == ["stage", "turn"] * 2
+        live = list(read_traces(os.path.join(folder, "live.jsonl"), turns=(2, 2)))
+        assert [(r["phase"], r["tokens"]) for r in live] == [("stage", 10), ("talk", 20), ("turn", {"stage": 10, "talk": 20, "total": 30})]
+        assert live[0]["duration"] == 0.5
+
+
+def test_conversation_renders_and_parses_like_the_string():
+    rng = random.Random(5)
+    pieces = ["Chào", "$f'(x)$", "\n", "  • a\n", "|", " | ", "TEXT=", "CON#1", "\n\n", "đạo hàm"]
+    for _ in range(500):
+        conversation = Conversation.parse("TIME=1.0 | CON#0 | SENDER=System | TEXT=Chào mừng\n")
+        expected = conversation.text
+        messages = [("System", "Chào mừng")]
+        for turn in range(1, rng.randint(1, 12)):
+            sender = rng.choice(["User", "Bob", "Alice"])
+            text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 6))).strip("\n") or "ok"
+            stamp = 1000.0 + turn / 8
+            conversation.append(sender, text, turn, stamp)
+            expected += f"TIME={stamp} | CON#{turn} | SENDER={sender} | TEXT={text}\n"
+            messages.append((sender, text))
+            assert conversation.text == expected
+        parsed = Conversation.parse(expected)
+        assert parsed.text == expected
+        assert [(record.sender, record.text) for record in parsed] == messages
+        count = rng.randint(1, 4)
+        assert conversation.tail(count) == "".join(record.line for record in parsed[-count:])
+
+    # Tin nhắn cuối được lưu không có xuống dòng; bản sao không dùng chung bản ghi với bản gốc
+    stored = "Mở đầu\nTIME=1.0 | CON#0 | SENDER=Bob | TEXT=a\nb"
+    original = Conversation.parse(stored)
+    copy = Conversation.parse(original)
+    copy.append("Alice", "c", 1, 2.0)
+    assert copy.text == "Mở đầu\nTIME=1.0 | CON#0 | SENDER=Bob | TEXT=a\nb\nTIME=2.0 | CON#1 | SENDER=Alice | TEXT=c\n"
+    assert original.text == stored and original[-1].line.endswith("b") and len(original) == 1
+
+
+def test_spans_nest_and_render_as_prometheus():
+    metrics.registry.reset()
+    with tempfile.TemporaryDirectory() as folder:
+        tracer = Tracer(export_file=os.path.join(folder, "spans.jsonl"))
+
+        async def think(agent):
+            with tracer.span("test.think_agent", agent=agent):
+                await asyncio.sleep(0)
+
+        async def turn():
+            with tracer.span("test.turn") as turn_span:
+                await asyncio.gather(think("Bob"), think("Alice"))
+                turn_span.labels["agent"] = "Bob"
+
+        asyncio.run(turn())
+        try:
+            with tracer.span("test.stage"):
+                raise RuntimeError("StageManager failed")
+        except RuntimeError:
+            pass
+        assert get_session_log().flush()
+        with open(os.path.join(folder, "spans.jsonl"), encoding="utf-8") as f:
+            spans = {(span["name"], span.get("agent")): span for span in map(json.loads, f)}
+    root = spans[("test.turn", "Bob")]
+    assert root["parent"] is None and root["trace"] == root["span"]
+    for agent in ("Bob", "Alice"):
+        assert spans[("test.think_agent", agent)]["parent"] == root["span"]
+        assert spans[("test.think_agent", agent)]["trace"] == root["trace"]
+    assert spans[("test.stage", None)]["status"] == "error"
+
+    text = metrics.render_prometheus()
+    assert "# TYPE span_seconds histogram" in text
+    assert 'span_seconds_count{agent="Alice",span="test.think_agent"} 1' in text
+    assert 'span_seconds_bucket{agent="Bob",span="test.turn",le="+Inf"} 1' in text
+    assert 'span_errors_total{span="test.stage",status="error"} 1' in text
+    metrics.inc("escape_total", label='a"b\\c\nd')
+    assert 'escape_total{label="a\\"b\\\\c\\nd"} 1' in metrics.render_prometheus()
+    metrics.registry.reset()
+
+
+def test_plan_units_retries_duplicates_with_fresh_ids():
+    with tempfile.TemporaryDirectory() as folder:
+        store = ScriptStore(os.path.join(folder, "store"), variants=2, version="test")
+        checkpoint = Checkpoint(os.path.join(folder, "checkpoint.jsonl"))
+        assert plan_units(["1"], ["đạo hàm"], 2, store, checkpoint) == [("1", "1|đạo hàm#0"), ("1", "1|đạo hàm#1")]
+
+        # #0 được lưu, #1 trùng với #0: chỉ có một biến thể trong store
+        assert store.add("1", ["đạo hàm"], {"s": 1}, {"r": 1})
+        checkpoint.record("1|đạo hàm#0", "done")
+        assert not store.add("1", ["đạo hàm"], {"s": 1}, {"r": 1})
+        checkpoint.record("1|đạo hàm#1", "duplicate")
+        assert checkpoint.done == {"1|đạo hàm#0"}
+        assert plan_units(["1"], ["đạo hàm"], 2, store, checkpoint) == [("1", "1|đạo hàm#2")]
+
+        # Chạy lại từ file checkpoint: cùng kết quả
+        resumed = Checkpoint(checkpoint.path)
+        assert resumed.done == {"1|đạo hàm#0"} and resumed.units == {"1|đạo hàm#0", "1|đạo hàm#1"}
+        assert plan_units(["1"], ["đạo hàm"], 2, store, resumed) == [("1", "1|đạo hàm#2")]
+        assert store.add("1", ["đạo hàm"], {"s": 2}, {"r": 2})
+        assert plan_units(["1"], ["đạo hàm"], 2, store, resumed) == []
+
+        # Kích thước store được xuất dưới dạng gauge trên /metrics
+        stats = store.stats()
+        assert stats["variants"] == 2 and stats["bytes"] == ScriptStore(store.store_dir, version="test").stats()["bytes"]
+        assert f'script_store_bytes{{flow="generation"}} {stats["bytes"]}' in metrics.render_prometheus()
+        assert "# TYPE script_store_variants gauge" in metrics.render_prometheus()
+
+
+def test_transient_errors_match_types_and_status_codes():
+    class RateLimitError(Exception):
+        pass
+
+    class APIStatusError(Exception):
+        def __init__(self, message, status_code):
+            super().__init__(message)
+            self.status_code = status_code
+
+    assert is_transient(RateLimitError("quota"))
+    assert is_transient(APIStatusError("bad gateway", 502))
+    assert is_transient(ConnectionResetError())
+    wrapped = ValueError("crew failed")
+    wrapped.__cause__ = APIStatusError("overloaded", 529)
+    assert is_transient(wrapped)
+    # Chỉ nội dung thông báo giống lỗi tạm thời thì không thử lại
+    assert not is_transient(ValueError("Bài toán có 500 học sinh, kết nối (connection) các ý"))
+    assert not is_transient(APIStatusError("invalid api key", 401))
+    assert not is_transient(DeadlineExceeded("'think' exceeded its 30s deadline"))
+
+
+def test_sdk_stage_description_from_simple_script():
+    try:
+        from backend.services.dialogue_service import SIMPLE_SCRIPT
+        from flow_sdk.dialogue_manager import ClaudeDialogueManager
+    except ImportError as e:
+        pytest.skip(f"Claude SDK dependencies not installed: {e}")
+    with tempfile.TemporaryDirectory() as folder:
+        manager = ClaudeDialogueManager(None, session_id="sdk", script=SIMPLE_SCRIPT, current_stage_id="1",
+                                        stage_state={"completed_task_ids": ["1.1"]},
+                                        filename=os.path.join(folder, "sdk.jsonl"))
+        description = manager.state.current_stage_description
+        assert SIMPLE_SCRIPT["1"]["goal"] in description
+        assert "[X] [1.1] Xác định dạng bài toán" in description
+        assert "[!] [1.2] Liệt kê các thông tin đã biết" in description
+
+        # Task thiếu khóa không làm hỏng việc khởi tạo
+        script = {"1": {"goal": "Mục tiêu", "tasks": [{"description": "Không có id"}, {"id": "1.2"}]}}
+        manager = ClaudeDialogueManager(None, session_id="sdk", script=script, filename=os.path.join(folder, "b.jsonl"))
+        assert "Mục tiêu" in manager.state.current_stage_description
+        assert get_session_log().flush()
+
+
+def test_llm_cache_evicts_by_access_and_expires_by_creation():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = LLMResponseCache(folder, mode="record", ttl=60)
+        cache.put("hot", "a" * 100)
+        cache.put("cold", "b" * 100)
+        cache._index["hot"][1] = cache._index["cold"][1] = 0.0
+        assert cache.get("hot") == "a" * 100 and cache.stats()["memory_hits"] == 1
+        # Entry đọc từ bộ nhớ vẫn được tính là vừa truy cập: entry lạnh bị xóa trước
+        cache.max_bytes = cache._total_bytes - 1
+        cache._evict()
+        assert "hot" in cache._index and "cold" not in cache._index
+
+        # TTL tính từ lúc tạo, không phải lần truy cập cuối
+        cache.max_bytes = 0
+        cache._index["hot"][2] -= 120
+        cache.get("hot")
+        cache._memory.clear()
+        cache._evict()
+        assert "hot" not in cache._index and cache.stats()["expired"] == 1
+
+
+def main():
+    tests = [test_clean_response_matches_legacy, test_process_content_matches_legacy, test_sample_outputs_match_legacy,
+             test_extract_json_skips_prose_and_strings, test_trivial_messages_are_only_fillers,
+             test_extractor_streaming_matches_whole_text,
+             test_convert_log_and_read_traces, test_conversation_renders_and_parses_like_the_string,
+             test_spans_nest_and_render_as_prometheus, test_plan_units_retries_duplicates_with_fresh_ids,
+             test_transient_errors_match_types_and_status_codes, test_sdk_stage_description_from_simple_script,
+             test_llm_cache_evicts_by_access_and_expires_by_creation]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {test.__name__}: {e}")
+        except pytest.skip.Exception as e:
+            print(f"- {test.__name__}: skipped ({e.msg})")
+    return failed == 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(0 if main() else 1)